@@ -0,0 +1,471 @@
+"""CPU benchmarks for the parts of mania that don't touch the network:
+converting TIDAL JSON into models, planning paths and tagging files.
+
+Everything runs against synthetic data, so results are comparable between
+machines and runs. TIDAL payloads are generated from a seed, or loaded from a
+file recorded earlier with --record; audio files are minimal but valid FLAC
+and MP4 files written to a temporary directory.
+
+Each benchmark is timed (best of --repeat runs), then run once more under
+tracemalloc to report the peak memory it needed. Results can be saved as a
+baseline and later runs compared against it, failing if anything got slower
+or hungrier than --tolerance allows. Run it as a module from the root of the
+repository, so that mania can be imported:
+
+    python -m benchmarks.benchmark --tracks 100000 --save baseline.json
+    python -m benchmarks.benchmark --tracks 100000 --baseline baseline.json
+
+Finally, the download orders are compared by running a simulated download
+of a random selection of the tracks, where each download takes time in
+proportion to the track's estimated size, and timing how long the whole run
+takes with each order.
+"""
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from mania import constants
+from mania.metadata import Cover, resolve_flac_metadata, resolve_mp4_metadata
+from mania.models import Album, Track
+from mania.paths import AlbumPathPlanner, sanitize
+from mania.schedule import DOWNLOAD_ORDERS, DownloadScheduler, Job, estimated_size
+from mania.stats import RunStats
+from mania.throttle import Throttle
+from mania.tidal import TidalClient, TidalSession
+
+TRACKS_PER_ALBUM = 12
+AUDIO_QUALITIES = ("HI_RES", "LOSSLESS", "LOSSLESS", "HIGH", "LOW")
+WORDS = (
+    "love",
+    "night",
+    "Dark Side",
+    "Moon",
+    "Über",
+    "café",
+    "東京",
+    "AC/DC",
+    "(Remastered)",
+    "[Live]",
+    "feat. Someone",
+    "Maxwell's",
+    "Silver",
+    "Hammer",
+    "Ω",
+)
+
+
+class Result(NamedTuple):
+    name: str
+    items: int
+    seconds: float
+    peak_bytes: int
+
+    @property
+    def microseconds_per_item(self) -> float:
+        return self.seconds / self.items * 1e6
+
+
+def _name(generator: random.Random, word_count: int) -> str:
+    return " ".join(generator.choice(WORDS) for _ in range(word_count))
+
+
+def generate_payload(track_count: int, seed: int = 0) -> Dict[str, List[dict]]:
+    """Generate albums, artists and tracks shaped like TIDAL API responses"""
+    generator = random.Random(seed)
+    artists = [
+        {"id": str(artist_id), "name": _name(generator, generator.randint(1, 3))}
+        for artist_id in range(1, max(track_count // 50, 2) + 1)
+    ]
+    albums = []
+    tracks = []
+    album_count = -(-track_count // TRACKS_PER_ALBUM)
+    for album_id in range(1, album_count + 1):
+        quality = generator.choice(AUDIO_QUALITIES)
+        album_artists = generator.sample(artists, generator.randint(1, 2))
+        albums.append(
+            {
+                "id": str(album_id),
+                "title": _name(generator, generator.randint(1, 6)),
+                "artists": album_artists,
+                "releaseDate": f"{generator.randint(1950, 2021)}-01-01",
+                "cover": "ab12cd34-ef56-7890-ab12-cd34ef567890",
+                "audioQuality": quality,
+                "audioModes": ["STEREO"],
+                "explicit": generator.random() < 0.1,
+            }
+        )
+        first_track_id = (album_id - 1) * TRACKS_PER_ALBUM
+        album_track_count = min(TRACKS_PER_ALBUM, track_count - first_track_id)
+        for track_index in range(album_track_count):
+            tracks.append(
+                {
+                    "id": str(first_track_id + track_index + 1),
+                    "title": _name(generator, generator.randint(1, 8)),
+                    "artists": [
+                        *album_artists,
+                        *generator.sample(artists, generator.randint(0, 2)),
+                    ],
+                    "album": {"id": str(album_id)},
+                    "trackNumber": track_index % 8 + 1,
+                    "volumeNumber": track_index // 8 + 1,
+                    "audioQuality": quality,
+                    "audioModes": ["STEREO"],
+                    "replayGain": round(generator.uniform(-12, 0), 2),
+                    "duration": generator.randint(60, 600),
+                    "explicit": generator.random() < 0.1,
+                }
+            )
+    return {"artists": artists, "albums": albums, "tracks": tracks}
+
+
+def make_config(output_directory: str) -> dict:
+    config: Dict[str, Any] = {
+        **constants.DEFAULT_CONFIG_TOML,
+        "output-directory": output_directory,
+        "cache-ttl": 0,
+    }
+    config["throttle"] = Throttle.from_config(config)
+    config["stats"] = RunStats()
+    return config
+
+
+def make_client(config: dict) -> TidalClient:
+    return TidalClient(config, TidalSession(country_code="US"))
+
+
+def make_flac(path: str, audio_size: int = 4096) -> None:
+    streaminfo = (
+        (4096).to_bytes(2, "big")
+        + (4096).to_bytes(2, "big")
+        + bytes(6)
+        # 44100 Hz, 2 channels, 16 bits per sample, 44100 samples
+        + ((44100 << 44) | (1 << 41) | (15 << 36) | 44100).to_bytes(8, "big")
+        + bytes(16)
+    )
+    with open(path, "wb") as flac_file:
+        flac_file.write(b"fLaC")
+        flac_file.write(bytes([0x80]) + len(streaminfo).to_bytes(3, "big"))
+        flac_file.write(streaminfo)
+        flac_file.write(bytes(audio_size))
+
+
+def _box(box_type: bytes, content: bytes) -> bytes:
+    return (8 + len(content)).to_bytes(4, "big") + box_type + content
+
+
+def make_mp4(path: str, audio_size: int = 4096) -> None:
+    # version and flags, creation and modification times, a timescale of
+    # 1000, a duration of one second, then the rest of the fields zeroed
+    movie_header = bytes(12) + (1000).to_bytes(4, "big") + (1000).to_bytes(4, "big")
+    movie_header += bytes(80)
+    with open(path, "wb") as mp4_file:
+        mp4_file.write(_box(b"ftyp", b"M4A \x00\x00\x00\x00M4A mp42isom"))
+        mp4_file.write(_box(b"moov", _box(b"mvhd", movie_header)))
+        mp4_file.write(_box(b"mdat", bytes(audio_size)))
+
+
+def measure(
+    name: str,
+    items: int,
+    setup: Callable[[], Any],
+    run: Callable[[Any], None],
+    repeat: int,
+) -> Result:
+    """Time `run(setup())`, leaving setup out of the timing, and then run it
+    again under tracemalloc"""
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        best = min(best, time.perf_counter() - start)
+
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Result(name, items, best, peak_bytes)
+
+
+def run_benchmarks(
+    payload: Dict[str, List[dict]], output_directory: str, file_count: int, repeat: int
+) -> List[Result]:
+    config = make_config(output_directory)
+    tidal_albums = payload["albums"]
+    tidal_tracks = payload["tracks"]
+    track_count = len(tidal_tracks)
+    results = []
+
+    def convert(client: TidalClient) -> List[Track]:
+        albums = {
+            tidal_album["id"]: client._tidal_album_to_album(tidal_album)
+            for tidal_album in tidal_albums
+        }
+        return [
+            client._tidal_track_to_track(
+                tidal_track, albums[tidal_track["album"]["id"]]
+            )
+            for tidal_track in tidal_tracks
+        ]
+
+    # conversion interns albums and artists, so each run needs a fresh client
+    results.append(
+        measure(
+            "convert",
+            track_count,
+            lambda: make_client(config),
+            convert,
+            repeat,
+        )
+    )
+
+    client = make_client(config)
+    results.append(
+        measure(
+            "get_quality",
+            track_count,
+            lambda: client,
+            lambda client: [
+                client._get_quality(tidal_track) for tidal_track in tidal_tracks
+            ],
+            repeat,
+        )
+    )
+
+    tracks = convert(client)
+    results.append(
+        measure(
+            "format_dict",
+            track_count,
+            lambda: tracks,
+            lambda tracks: [track.format_dict() for track in tracks],
+            repeat,
+        )
+    )
+    results.append(
+        measure(
+            "sanitize",
+            track_count,
+            lambda: tracks,
+            lambda tracks: [sanitize(config, track.name) for track in tracks],
+            repeat,
+        )
+    )
+
+    tracks_by_album: Dict[str, List[Track]] = {}
+    for track in tracks:
+        tracks_by_album.setdefault(track.album.id, []).append(track)
+
+    def plan_paths(albums: Dict[str, List[Track]]) -> None:
+        for album_tracks in albums.values():
+            album: Album = album_tracks[0].album
+            AlbumPathPlanner(
+                config, album, album_tracks, include_artist=True, include_album=True
+            ).track_paths()
+
+    results.append(
+        measure("plan_paths", track_count, lambda: tracks_by_album, plan_paths, repeat)
+    )
+
+    cover = Cover(data=b"\xff\xd8\xff" + bytes(64 * 1024), mime="image/jpeg")
+    for file_extension, make_file, tag in (
+        ("flac", make_flac, resolve_flac_metadata),
+        ("mp4", make_mp4, resolve_mp4_metadata),
+    ):
+        paths = [
+            os.path.join(output_directory, f"{index}.{file_extension}")
+            for index in range(file_count)
+        ]
+
+        def setup(paths: List[str] = paths, make_file: Callable = make_file):
+            for path in paths:
+                make_file(path)
+            return paths
+
+        def run(paths: List[str], tag: Callable = tag) -> None:
+            for path, track in zip(paths, tracks):
+                tag(config, track, path, cover)
+
+        results.append(measure(f"tag_{file_extension}", file_count, setup, run, repeat))
+
+    return results
+
+
+def measure_download_orders(
+    tracks: List[Track], concurrency: int, seconds: float
+) -> Tuple[Dict[str, float], float]:
+    """Download `tracks` with each download order, where downloads only
+    sleep, in proportion to their size and scaled so a perfectly balanced run
+    would take `seconds`. Returns how long each run took, by order, and the
+    shortest time any order could take."""
+    sizes = [estimated_size(track) for track in tracks]
+    seconds_per_byte = seconds * concurrency / sum(sizes)
+    durations = {}
+    for order in sorted(DOWNLOAD_ORDERS):
+        config = {"download-order": order, "concurrency": concurrency}
+        start = time.perf_counter()
+        with DownloadScheduler(config) as scheduler:
+            futures = scheduler.submit_all(
+                Job(lambda size=size: time.sleep(size * seconds_per_byte), track)
+                for track, size in zip(tracks, sizes)
+            )
+            for future in futures:
+                future.result()
+        durations[order] = time.perf_counter() - start
+    # no order can beat a perfect balance, or the largest download on its own
+    return durations, max(seconds, max(sizes) * seconds_per_byte)
+
+
+def report_download_orders(
+    durations: Dict[str, float], shortest: float, track_count: int, concurrency: int
+) -> None:
+    print(
+        f"\n{track_count} simulated downloads, {concurrency} at a time, "
+        f"{shortest:.2f} s at best:"
+    )
+    for order, duration in durations.items():
+        print(f"  {order:<14} {duration:>6.2f} s  ({duration / shortest - 1:+.0%})")
+
+
+def report(results: List[Result], baseline: Optional[Dict[str, dict]]) -> None:
+    print(
+        f"{'benchmark':<12} {'items':>8} {'total s':>9} {'µs/item':>10} {'peak KiB':>10}"
+    )
+    for result in results:
+        line = (
+            f"{result.name:<12} {result.items:>8} {result.seconds:>9.3f} "
+            f"{result.microseconds_per_item:>10.2f} {result.peak_bytes / 1024:>10.0f}"
+        )
+        if baseline and result.name in baseline:
+            previous = baseline[result.name]
+            change = result.microseconds_per_item / previous["microseconds_per_item"]
+            line += f"  ({change - 1:+.0%} time)"
+        print(line)
+
+
+def find_regressions(
+    results: List[Result], baseline: Dict[str, dict], tolerance: float
+) -> List[str]:
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if previous is None:
+            continue
+        allowed_time = previous["microseconds_per_item"] * (1 + tolerance)
+        if result.microseconds_per_item > allowed_time:
+            regressions.append(
+                f"{result.name}: {result.microseconds_per_item:.2f} µs/item, "
+                f"allowed {allowed_time:.2f}"
+            )
+        allowed_peak = previous["peak_bytes"] * (1 + tolerance)
+        if result.peak_bytes > allowed_peak:
+            regressions.append(
+                f"{result.name}: peak {result.peak_bytes} bytes, "
+                f"allowed {allowed_peak:.0f}"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tracks", type=int, default=10_000)
+    parser.add_argument("--files", type=int, default=200, help="files to tag")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--downloads",
+        type=int,
+        default=40,
+        help="simulated downloads for comparing download orders, 0 to skip",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--download-seconds",
+        type=float,
+        default=1.0,
+        help="how long the simulated downloads would take perfectly balanced",
+    )
+    parser.add_argument("--payload", help="load a recorded payload")
+    parser.add_argument("--record", help="save the generated payload")
+    parser.add_argument("--save", help="save the results as a baseline")
+    parser.add_argument("--baseline", help="compare against a saved baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="how much slower or bigger than the baseline is allowed",
+    )
+    args = parser.parse_args()
+
+    if args.payload:
+        with open(args.payload) as payload_file:
+            payload = json.load(payload_file)
+    else:
+        payload = generate_payload(args.tracks, args.seed)
+    if args.record:
+        with open(args.record, "w") as payload_file:
+            json.dump(payload, payload_file)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    with tempfile.TemporaryDirectory(prefix="mania-benchmark-") as output_directory:
+        results = run_benchmarks(payload, output_directory, args.files, args.repeat)
+    report(results, baseline)
+
+    if args.downloads > 0:
+        client = make_client(make_config(tempfile.gettempdir()))
+        albums = {
+            tidal_album["id"]: client._tidal_album_to_album(tidal_album)
+            for tidal_album in payload["albums"]
+        }
+        tidal_tracks = random.Random(args.seed).sample(
+            payload["tracks"], min(args.downloads, len(payload["tracks"]))
+        )
+        tracks = [
+            client._tidal_track_to_track(
+                tidal_track, albums[tidal_track["album"]["id"]]
+            )
+            for tidal_track in tidal_tracks
+        ]
+        durations, shortest = measure_download_orders(
+            tracks, args.concurrency, args.download_seconds
+        )
+        report_download_orders(durations, shortest, len(tracks), args.concurrency)
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(
+                {
+                    result.name: {
+                        "items": result.items,
+                        "microseconds_per_item": result.microseconds_per_item,
+                        "peak_bytes": result.peak_bytes,
+                    }
+                    for result in results
+                },
+                baseline_file,
+                indent=2,
+            )
+
+    if baseline:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
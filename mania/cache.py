@@ -0,0 +1,46 @@
+"""On-disk cache for TIDAL API responses"""
+
+from typing import Any, Optional
+import hashlib
+import json
+import os
+import time
+
+from .locking import write_atomically
+
+
+class Cache:
+    """A directory of JSON files, one per key, each with an expiry time. A TTL
+    of zero disables the cache."""
+
+    def __init__(self, directory: str, ttl: float):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get the value stored under `key`, or None if it's missing or
+        expired"""
+        if self.ttl <= 0:
+            return None
+        try:
+            with open(self._path(key), "r") as cache_file:
+                entry = json.load(cache_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if entry["expires"] < time.time():
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any) -> None:
+        """Store `value` under `key`. The write is atomic, so readers in any
+        process never see a partial entry and don't need to take a lock."""
+        if self.ttl <= 0:
+            return
+        write_atomically(
+            self._path(key),
+            json.dumps({"expires": time.time() + self.ttl, "value": value}),
+        )
@@ -0,0 +1,48 @@
+"""Sharing one call among threads that make the same request at once"""
+
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+import threading
+
+from .stats import RunStats
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Makes sure that a call is only in flight once per key. Threads asking
+    for a key that's already being fetched wait for that call and share its
+    result, or its error, instead of making their own. Once it's done, the
+    next call for the key is made afresh, so nothing is cached.
+
+    Each call that was shared rather than made increments the `counter` of
+    the `stats` passed to `do`."""
+
+    def __init__(self, counter: str):
+        self._counter = counter
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self, key: Hashable, call: Callable[[], T], stats: Optional[RunStats] = None
+    ) -> T:
+        with self._lock:
+            shared = self._in_flight.get(key)
+            if shared is None:
+                future: Future = Future()
+                self._in_flight[key] = future
+        if shared is not None:
+            if stats is not None:
+                stats.increment(self._counter)
+            return shared.result()
+        try:
+            result = call()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
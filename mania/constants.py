@@ -13,20 +13,94 @@ CONFIG_DIR = os.path.join(config_home, PROGRAM_NAME)
 
 SESSION_PATH = os.path.join(CACHE_DIR, "session.toml")
 CONFIG_PATH = os.path.join(CONFIG_DIR, "config.toml")
+# API request budget shared by every mania process
+REQUEST_BUDGET_PATH = os.path.join(CACHE_DIR, "request-budget.json")
 INDENT = "  "
 TEMPORARY_EXTENSION = "part"
-DOWNLOAD_CHUNK_SIZE = 1024
+# records which favorites have already been synced to an output directory
+FAVORITES_STATE_NAME = ".mania-favorites.toml"
+# seconds between saves of the favorites state during a sync
+FAVORITES_SAVE_INTERVAL = 10
+# checksums of downloaded audio, and tracks that failed verification
+CHECKSUMS_NAME = ".mania-checksums.jsonl"
+REDOWNLOAD_QUEUE_NAME = ".mania-redownload.jsonl"
+CORRUPT_EXTENSION = "corrupt"
+VERIFY_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# how long a resolved playback URL is trusted before it's resolved again
+MEDIA_URL_LIFETIME = 5 * 60
+# seconds between redraws of the progress display or byte-count events
+PROGRESS_INTERVAL = 0.5
+
+# qualities from worst to best, and the container each is downloaded in
+QUALITY_LEVELS = {"low": 1, "high": 2, "lossless": 3, "master": 4}
+FILE_EXTENSIONS = {
+    "master": "flac",
+    "lossless": "flac",
+    "high": "mp4",
+    "low": "mp4",
+}
+# the file extension for each container a stream can come in. Lossless
+# streams from DASH manifests are FLAC in fragmented MP4, and are saved as MP4.
+CONTAINER_EXTENSIONS = {"audio/flac": "flac", "audio/mp4": "mp4"}
+# rough average stream sizes in bytes per second, for estimating downloads
+# without asking TIDAL
+ESTIMATED_BYTE_RATES = {
+    "master": 250_000,
+    "lossless": 110_000,
+    "high": 40_000,
+    "low": 12_000,
+}
+# assumed download rate for time estimates when max-bandwidth is unlimited
+ESTIMATED_BANDWIDTH = 10 * 1024 * 1024
 DEFAULT_CONFIG = """quality = "lossless"
+quality-fallback = "downgrade"
 output-directory = "."
 by-id = false
 lucky = false
 search-count = 16
+search-cache-ttl = 300
 quiet = false
 nice-format = false
 full-structure = false
 skip-metadata = false
 replay-gain = true
 include-eps-singles = false
+concurrency = 1
+max-bandwidth = 0
+max-auxiliary-bandwidth = 0
+max-request-rate = 0
+segment-concurrency = 4
+media-lookahead = 4
+cache-ttl = 3600
+staging-directory = ""
+max-staging-size = "1G"
+mover-concurrency = 2
+plan = false
+plan-sizes = false
+plan-json = false
+export = false
+export-format = "ndjson"
+export-path = ""
+progress = "bar"
+progress-fd = 1
+crawl-directory = ""
+crawl-shard = "0/1"
+crawl-claim-timeout = 600
+connect-timeout = 10
+read-timeout = 60
+stall-speed = "16K"
+stall-timeout = 30
+stall-retries = 3
+download-order = "largest-first"
+probe-sizes = false
+storage = "local"
+storage-endpoint = ""
+storage-bucket = ""
+storage-prefix = ""
+storage-region = "us-east-1"
+storage-part-size = "8M"
+warm-connections = true
 
 track-format = "{track_number} {track_name}"
 individual-track-format = "{track_name}"
@@ -0,0 +1,201 @@
+"""A crawl of many URLs split between workers on any number of machines,
+coordinated through a shared directory.
+
+The directory holds one file per work item under `items/`, and a worker
+claims an item by creating its file under `claims/` with O_EXCL, which is
+atomic even on network filesystems. Workers keep touching their claims while
+they work, so a claim that hasn't been touched for the claim timeout belongs
+to a dead worker and can be taken over. A worker taking over a claim renames
+it to a name of its own, which only one worker can do, and checks that what
+it renamed is still the stale claim before removing it, since a fresh claim
+may have replaced it in the meantime. Finished items get a file under
+`done/`, and items that couldn't be downloaded one under `failed/`."""
+
+from typing import Iterator, NamedTuple, Optional, Tuple
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from .locking import write_atomically
+
+SUBDIRECTORIES = ("items", "claims", "done", "failed")
+
+
+class WorkItem(NamedTuple):
+    key: str
+    url: str
+
+    def shard(self, shard_count: int) -> int:
+        """The shard the item belongs to. Stable across processes and runs,
+        unlike hash()."""
+        return int(self.key, 16) % shard_count
+
+
+def item_key(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse a shard like `"2/4"`, the third of four, into (2, 4)"""
+    try:
+        index, count = (int(part) for part in str(shard).split("/"))
+    except ValueError as error:
+        raise ValueError(
+            f'Couldn\'t parse the shard "{shard}". Try one like "0/4".'
+        ) from error
+    if not 0 <= index < count:
+        raise ValueError(f'Shard "{shard}" is out of range.')
+    return index, count
+
+
+class Claim:
+    """A worker's claim on an item. Kept fresh by a background thread until
+    it's released."""
+
+    def __init__(self, path: str, worker_id: str, heartbeat_interval: float):
+        self.path = path
+        self._worker_id = worker_id
+        self._released = threading.Event()
+        self._heartbeat = threading.Thread(
+            target=self._beat, args=(heartbeat_interval,), daemon=True
+        )
+        self._heartbeat.start()
+
+    def _beat(self, interval: float) -> None:
+        while not self._released.wait(interval):
+            try:
+                with open(self.path) as claim_file:
+                    if claim_file.read() != self._worker_id:
+                        # taken over by another worker; nothing left to keep
+                        # fresh
+                        return
+                os.utime(self.path)
+            except FileNotFoundError:
+                # another worker may be checking whether the claim is stale,
+                # and will put it back once it sees it isn't
+                continue
+
+    def __enter__(self) -> "Claim":
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        self.release()
+
+    def release(self) -> None:
+        self._released.set()
+        self._heartbeat.join()
+        try:
+            with open(self.path) as claim_file:
+                owner = claim_file.read()
+            # don't remove a claim another worker took over from us
+            if owner == self._worker_id:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class CrawlDirectory:
+    def __init__(self, directory: str, claim_timeout: float):
+        self.directory = directory
+        self.claim_timeout = claim_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        for subdirectory in SUBDIRECTORIES:
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+    def _path(self, subdirectory: str, key: str) -> str:
+        return os.path.join(self.directory, subdirectory, key)
+
+    def add(self, url: str) -> bool:
+        """Add a URL to the crawl, returning False if it's already in it"""
+        key = item_key(url)
+        path = self._path("items", key)
+        if os.path.exists(path):
+            return False
+        write_atomically(path, json.dumps({"url": url}))
+        return True
+
+    def items(self) -> Iterator[WorkItem]:
+        for key in sorted(os.listdir(os.path.join(self.directory, "items"))):
+            try:
+                with open(self._path("items", key)) as item_file:
+                    yield WorkItem(key, json.load(item_file)["url"])
+            except FileNotFoundError:
+                continue
+
+    def state(self, item: WorkItem) -> str:
+        """One of "done", "failed", "claimed", "stale" or "pending" """
+        for finished_state in ("done", "failed"):
+            if os.path.exists(self._path(finished_state, item.key)):
+                return finished_state
+        try:
+            claimed_at = os.path.getmtime(self._path("claims", item.key))
+        except FileNotFoundError:
+            return "pending"
+        return "stale" if self._is_stale(claimed_at) else "claimed"
+
+    def _is_stale(self, claimed_at: float) -> bool:
+        return time.time() - claimed_at > self.claim_timeout
+
+    def claim(self, item: WorkItem) -> Optional[Claim]:
+        """Try to claim `item`, taking over a stale claim if there is one.
+        Returns None if the item is finished or someone else has it."""
+        path = self._path("claims", item.key)
+        if not self._create_claim(path):
+            if not self._remove_stale_claim(path) or not self._create_claim(path):
+                return None
+        claim = Claim(path, self.worker_id, self.claim_timeout / 4)
+        # the item may have been finished between listing and claiming it
+        if self.state(item) in ("done", "failed"):
+            claim.release()
+            return None
+        return claim
+
+    def _remove_stale_claim(self, path: str) -> bool:
+        """Remove the claim at `path` if it's stale, returning False if it's
+        fresh. Another worker may be taking it over at the same time."""
+        try:
+            seen = os.stat(path)
+            if not self._is_stale(seen.st_mtime):
+                return False
+            # only one worker can rename the claim away
+            stale_path = f"{path}.{self.worker_id}.stale"
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            # removed by its owner or another worker; try to claim it
+            return True
+        renamed = os.stat(stale_path)
+        if (renamed.st_ino, renamed.st_mtime) != (seen.st_ino, seen.st_mtime):
+            # another worker took the stale claim over after we looked, and
+            # this is its fresh claim; put it back, unless someone else has
+            # claimed the item since, in which case that claim stands and
+            # this one's owner stops keeping it fresh
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        return True
+
+    def _create_claim(self, path: str) -> bool:
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(descriptor, "w") as claim_file:
+            claim_file.write(self.worker_id)
+        return True
+
+    def complete(self, item: WorkItem) -> None:
+        write_atomically(self._path("done", item.key), self.worker_id)
+
+    def fail(self, item: WorkItem, error: str) -> None:
+        write_atomically(
+            self._path("failed", item.key),
+            json.dumps({"worker": self.worker_id, "error": error}),
+        )
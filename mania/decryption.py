@@ -0,0 +1,35 @@
+"""Decryption of encrypted TIDAL streams. Adapted from
+https://github.com/Dniel97/RedSea/blob/master/redsea/decryption.py"""
+
+from typing import Tuple
+import base64
+
+from Crypto.Cipher import AES
+
+# the key that every stream's key is wrapped with
+MASTER_KEY = base64.b64decode("UIlTTEMmmLfGowo/UC60x2H45W6MdGgTRfo/umg4754=")
+
+
+def unwrap_key(key_id: str) -> Tuple[bytes, bytes]:
+    """Decrypt a manifest's `keyId` into the stream's AES key and nonce"""
+    security_token = base64.b64decode(key_id)
+    iv, encrypted_token = security_token[:16], security_token[16:]
+    token = AES.new(MASTER_KEY, AES.MODE_CBC, iv).decrypt(encrypted_token)
+    return token[:16], token[16:24]
+
+
+class StreamDecryptor:
+    """Decrypts an AES-CTR stream chunk by chunk, as it's downloaded. Chunks
+    can be any length. Output goes into a buffer that's reused for every
+    chunk, so each returned view is only valid until the next call."""
+
+    def __init__(self, key: bytes, nonce: bytes):
+        self._cipher = AES.new(key, AES.MODE_CTR, nonce=nonce, initial_value=0)
+        self._buffer = bytearray()
+
+    def decrypt(self, chunk: bytes) -> memoryview:
+        if len(self._buffer) < len(chunk):
+            self._buffer = bytearray(len(chunk))
+        output = memoryview(self._buffer)[: len(chunk)]
+        self._cipher.decrypt(chunk, output=output)
+        return output
@@ -0,0 +1,92 @@
+"""Writing track metadata out as NDJSON or CSV"""
+
+from typing import Any, Dict, IO, Optional
+import csv
+import json
+import sys
+import threading
+
+from .models import Track
+
+EXPORT_FORMATS = frozenset(("ndjson", "csv"))
+EXPORT_FIELDS = (
+    "track_id",
+    "isrc",
+    "track_name",
+    "track_artists",
+    "track_number",
+    "disc_number",
+    "duration",
+    "explicit",
+    "chosen_quality",
+    "best_available_quality",
+    "replay_gain",
+    "album_id",
+    "album_name",
+    "album_artists",
+    "album_year",
+)
+
+
+def track_row(track: Track) -> Dict[str, Any]:
+    return {
+        "track_id": track.id,
+        "isrc": track.isrc,
+        "track_name": track.name,
+        "track_artists": [artist.name for artist in track.artists],
+        "track_number": track.track_number,
+        "disc_number": track.disc_number,
+        "duration": track.duration,
+        "explicit": track.explicit,
+        "chosen_quality": track.chosen_quality,
+        "best_available_quality": track.best_available_quality,
+        "replay_gain": track.replay_gain,
+        "album_id": track.album.id,
+        "album_name": track.album.name,
+        "album_artists": [artist.name for artist in track.album.artists],
+        "album_year": track.album.year,
+    }
+
+
+class ExportWriter:
+    """Writes one row per track as soon as it's resolved, so nothing
+    accumulates in memory however large the export. Lists of artists are
+    joined with ", " in CSV."""
+
+    def __init__(self, config: dict):
+        if config["export-format"] not in EXPORT_FORMATS:
+            raise ValueError(
+                f'Unknown export format "{config["export-format"]}". Try "ndjson" or "csv".'
+            )
+        self._format = config["export-format"]
+        self._output: IO[str] = (
+            open(config["export-path"], "w", newline="")
+            if config["export-path"]
+            else sys.stdout
+        )
+        self._csv_writer: Optional[Any] = None
+        if self._format == "csv":
+            self._csv_writer = csv.DictWriter(self._output, fieldnames=EXPORT_FIELDS)
+            self._csv_writer.writeheader()
+        self._lock = threading.Lock()
+        self.row_count = 0
+
+    def write(self, track: Track) -> None:
+        row = track_row(track)
+        with self._lock:
+            if self._csv_writer is not None:
+                self._csv_writer.writerow(
+                    {
+                        key: ", ".join(value) if isinstance(value, list) else value
+                        for key, value in row.items()
+                    }
+                )
+            else:
+                self._output.write(json.dumps(row) + "\n")
+            self.row_count += 1
+
+    def close(self) -> None:
+        if self._output is sys.stdout:
+            self._output.flush()
+        else:
+            self._output.close()
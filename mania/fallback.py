@@ -0,0 +1,76 @@
+"""What to do with tracks that can't be had in the quality that was asked for"""
+
+from typing import List, NamedTuple
+import threading
+
+from . import constants
+from .models import Track
+
+QUALITY_FALLBACKS = frozenset(("downgrade", "skip", "defer"))
+
+
+def parse_quality_fallback(policy: str) -> str:
+    """Check a `quality-fallback` option"""
+    if policy not in QUALITY_FALLBACKS:
+        raise ValueError(
+            f'Unknown quality fallback "{policy}". Try "downgrade", "skip" or "defer".'
+        )
+    return policy
+
+
+def with_quality(track: Track, quality: str) -> Track:
+    """`track` as it would be downloaded in `quality`, which may change its
+    file extension"""
+    return track._replace(
+        chosen_quality=quality, file_extension=constants.FILE_EXTENSIONS[quality]
+    )
+
+
+class Fallback(NamedTuple):
+    """A track that couldn't be had in the quality that was asked for, and what
+    was done about it"""
+
+    track: Track
+    requested_quality: str
+    available_quality: str
+    action: str
+
+
+class FallbackLog:
+    """The tracks that fell back to `quality-fallback` during a run, shared by
+    every thread and summarized when it ends"""
+
+    def __init__(self, config: dict):
+        self.policy = parse_quality_fallback(config["quality-fallback"])
+        self._fallbacks: List[Fallback] = []
+        self._lock = threading.Lock()
+
+    def add(self, track: Track, available_quality: str) -> Fallback:
+        fallback = Fallback(
+            track=track,
+            requested_quality=track.chosen_quality,
+            available_quality=available_quality,
+            action={
+                "downgrade": "downgraded",
+                "skip": "skipped",
+                "defer": "deferred",
+            }[self.policy],
+        )
+        with self._lock:
+            self._fallbacks.append(fallback)
+        return fallback
+
+    def summary(self) -> List[str]:
+        with self._lock:
+            fallbacks = list(self._fallbacks)
+        if not fallbacks:
+            return []
+        lines = [f"{len(fallbacks)} track(s) weren't available in the chosen quality:"]
+        for fallback in fallbacks:
+            artists = ", ".join(artist.name for artist in fallback.track.artists)
+            lines.append(
+                f'{constants.INDENT}{artists} - "{fallback.track.name}" '
+                f"({fallback.track.id}): {fallback.action}, only "
+                f"{fallback.available_quality} instead of {fallback.requested_quality}"
+            )
+        return lines
@@ -0,0 +1,260 @@
+"""Checksums of downloaded audio, and verification of the library against
+them"""
+
+from typing import Dict, Iterator, List, NamedTuple, Optional
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+import mutagen
+from mutagen.flac import FLAC
+from mutagen.mp4 import MP4
+
+from . import constants
+from .locking import locked
+
+# header sizes for each state of the PayloadHasher parser
+HEADER_SIZES = {
+    "flac-magic": 4,
+    "flac-block": 4,
+    "mp4-box": 8,
+    "mp4-largesize": 8,
+}
+
+_record_lock = threading.Lock()
+
+
+class PayloadHasher:
+    """Incrementally hashes the audio payload of a FLAC or MP4 stream: the
+    frames after a FLAC file's metadata blocks, or the contents of an MP4
+    file's `mdat` boxes. Tagging rewrites the metadata but not the payload, so
+    the hash of a file as it's downloaded still matches after it's tagged."""
+
+    def __init__(self, file_extension: str):
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.payload_size = 0
+        self.valid = True
+        self._state = {"flac": "flac-magic", "mp4": "mp4-box"}[file_extension]
+        self._header = b""
+        self._box_type = b""
+        # bytes left to skip or hash before the next header. None means
+        # until the end of the stream.
+        self._skip: Optional[int] = 0
+        self._payload: Optional[int] = 0
+
+    def update(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        data = memoryview(chunk)
+        while data:
+            if self._skip is None or self._skip > 0:
+                skipped = (
+                    len(data) if self._skip is None else min(self._skip, len(data))
+                )
+                if self._skip is not None:
+                    self._skip -= skipped
+                data = data[skipped:]
+            elif self._payload is None or self._payload > 0:
+                length = len(data) if self._payload is None else self._payload
+                taken = data[:length]
+                self._hash.update(taken)
+                self.payload_size += len(taken)
+                if self._payload is not None:
+                    self._payload -= len(taken)
+                data = data[len(taken) :]
+            else:
+                needed = HEADER_SIZES[self._state] - len(self._header)
+                self._header += bytes(data[:needed])
+                data = data[needed:]
+                if len(self._header) == HEADER_SIZES[self._state]:
+                    header, self._header = self._header, b""
+                    self._parse_header(header)
+
+    def _parse_header(self, header: bytes) -> None:
+        if self._state == "flac-magic":
+            if header != b"fLaC":
+                self._invalid()
+                return
+            self._state = "flac-block"
+        elif self._state == "flac-block":
+            self._skip = int.from_bytes(header[1:], "big")
+            if header[0] & 0x80:
+                # last metadata block; everything after it is audio frames
+                self._payload = None
+        elif self._state == "mp4-box":
+            size = int.from_bytes(header[:4], "big")
+            self._box_type = header[4:]
+            if size == 1:
+                self._state = "mp4-largesize"
+            else:
+                self._start_box(size - 8 if size else None)
+        elif self._state == "mp4-largesize":
+            self._state = "mp4-box"
+            self._start_box(int.from_bytes(header, "big") - 16)
+
+    def _start_box(self, content_size: Optional[int]) -> None:
+        if content_size is not None and content_size < 0:
+            self._invalid()
+        elif self._box_type == b"mdat":
+            self._payload = content_size
+        elif content_size is None:
+            # a box that runs to the end of the file, but isn't audio
+            self._skip = None
+        else:
+            self._skip = content_size
+
+    def _invalid(self) -> None:
+        self.valid = False
+        self._skip = None
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class Record(NamedTuple):
+    """What a track looked like when it was downloaded, the quality it was
+    downloaded in, and how its path was laid out. The quality and layout are
+    None in records from before they were recorded."""
+
+    path: str
+    track_id: str
+    payload_size: int
+    payload_sha256: str
+    include_artist: Optional[bool] = None
+    include_album: Optional[bool] = None
+    quality: Optional[str] = None
+
+
+def _library_file(config: dict, name: str) -> str:
+    return os.path.join(config["output-directory"], name)
+
+
+def add_record(config: dict, record: Record) -> None:
+    """Append `record` to the output directory's checksum file, which other
+    processes may be appending to as well. Paths are stored relative to the
+    output directory."""
+    relative_path = os.path.relpath(record.path, config["output-directory"])
+    line = json.dumps(record._replace(path=relative_path)._asdict()) + "\n"
+    records_path = _library_file(config, constants.CHECKSUMS_NAME)
+    with _record_lock, locked(records_path), open(records_path, "a") as records_file:
+        records_file.write(line)
+
+
+def load_records(config: dict) -> Dict[str, Record]:
+    """Get the latest record of each file in the output directory, by path"""
+    records = {}
+    try:
+        with open(_library_file(config, constants.CHECKSUMS_NAME)) as records_file:
+            for line in records_file:
+                record = Record(**json.loads(line))
+                path = os.path.join(config["output-directory"], record.path)
+                records[path] = record._replace(path=path)
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def find_library_files(config: dict) -> Iterator[str]:
+    for directory, _, file_names in os.walk(config["output-directory"]):
+        for file_name in file_names:
+            extension = file_name.rsplit(".", 1)[-1]
+            temporary = f".{constants.TEMPORARY_EXTENSION}." in file_name
+            if extension in ("flac", "mp4") and not temporary:
+                yield os.path.join(directory, file_name)
+
+
+def verify_file(path: str, record: Optional[Record]) -> List[str]:
+    """Check a downloaded file, returning a list of problems with it. Run in a
+    worker process, so everything passed in and out has to be picklable."""
+    problems = []
+    file_extension = path.rsplit(".", 1)[-1]
+
+    try:
+        tagger = {"flac": FLAC, "mp4": MP4}[file_extension](path)
+    except mutagen.MutagenError as error:
+        return [f"invalid container: {error}"]
+
+    hasher = PayloadHasher(file_extension)
+    with open(path, "rb") as audio_file:
+        for chunk in iter(lambda: audio_file.read(constants.VERIFY_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    if not hasher.valid or hasher.payload_size == 0:
+        problems.append("invalid container: no audio data")
+
+    if record is not None:
+        if hasher.payload_size != record.payload_size:
+            problems.append(
+                f"audio is {hasher.payload_size} bytes, expected {record.payload_size}"
+            )
+        elif hasher.hexdigest() != record.payload_sha256:
+            problems.append("audio checksum doesn't match")
+
+    # checking STREAMINFO's MD5 of the decoded audio needs a FLAC decoder, so
+    # only do it if the reference one is installed
+    if (
+        file_extension == "flac"
+        and tagger.info.md5_signature != 0
+        and shutil.which("flac")
+    ):
+        result = subprocess.run(
+            ["flac", "--test", "--silent", path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            problems.append("STREAMINFO MD5 doesn't match decoded audio")
+
+    return problems
+
+
+class QueuedTrack(NamedTuple):
+    """A track whose file failed verification and should be downloaded again.
+    Like records, queued paths are stored relative to the output directory."""
+
+    track_id: str
+    path: str
+
+
+def queue_redownload(config: dict, queued_tracks: List[QueuedTrack]) -> None:
+    if not queued_tracks:
+        return
+    queue_path = _library_file(config, constants.REDOWNLOAD_QUEUE_NAME)
+    with open(queue_path, "a") as queue_file:
+        for queued_track in queued_tracks:
+            relative_path = os.path.relpath(
+                queued_track.path, config["output-directory"]
+            )
+            line = json.dumps(queued_track._replace(path=relative_path)._asdict())
+            queue_file.write(line + "\n")
+
+
+def load_redownload_queue(config: dict) -> List[QueuedTrack]:
+    queue_path = _library_file(config, constants.REDOWNLOAD_QUEUE_NAME)
+    try:
+        with open(queue_path) as queue_file:
+            queued_tracks = [QueuedTrack(**json.loads(line)) for line in queue_file]
+    except FileNotFoundError:
+        return []
+    return [
+        queued_track._replace(
+            path=os.path.join(config["output-directory"], queued_track.path)
+        )
+        for queued_track in queued_tracks
+    ]
+
+
+def save_redownload_queue(config: dict, queued_tracks: List[QueuedTrack]) -> None:
+    """Replace the queue with `queued_tracks`"""
+    queue_path = _library_file(config, constants.REDOWNLOAD_QUEUE_NAME)
+    if os.path.exists(queue_path):
+        os.remove(queue_path)
+    queue_redownload(config, queued_tracks)
+
+
+def move_aside(path: str) -> None:
+    """Rename a file that failed verification so that it gets downloaded again,
+    without deleting it"""
+    shutil.move(path, f"{path}.{constants.CORRUPT_EXTENSION}")
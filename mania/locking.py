@@ -0,0 +1,42 @@
+"""Locking and atomic writes for files shared between mania processes"""
+
+from contextlib import contextmanager
+from typing import Iterator
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where files are only written atomically
+    fcntl = None  # type: ignore
+
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on `path` for the duration of the block, across
+    threads and processes. The lock is taken on a `.lock` file next to `path`,
+    so `path` itself can still be replaced atomically while it's held."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # closing the file releases the lock
+        yield
+
+
+def write_atomically(path: str, text: str) -> None:
+    """Replace the contents of `path` with `text`, so that readers see either
+    the old contents or the new ones but never a partial write"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(descriptor, "w") as temporary_file:
+            temporary_file.write(text)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
@@ -1,55 +1,108 @@
 """Main logic"""
 
 import argparse
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import json
 import os
+import re
+import shutil
 import sys
-from typing import cast, List, Optional
+import threading
+import time
+from functools import partial
+from itertools import islice
+from typing import (
+    cast,
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 import traceback
 
 import questionary
 import requests
 import toml
+import urllib3
 from tqdm import tqdm
 
 from . import constants
 from .models import (
     ManiaException,
     ManiaSeriousException,
+    QualityUnavailableException,
     UnavailableException,
+    IncompleteDownloadError,
+    StallError,
     Client,
     Track,
     Album,
     Artist,
+    Playlist,
+    Mix,
     Media,
     MediaType,
+    Stream,
 )
+from .coalesce import SingleFlight
+from .crawl import CrawlDirectory, parse_shard
+from . import integrity
+from .locking import locked, write_atomically
+from .decryption import StreamDecryptor
+from .export import ExportWriter
+from .fallback import FallbackLog, with_quality
 from . import metadata
+from .paths import AlbumPathPlanner, remove_empty_directories
+from .prefetch import MediaPrefetcher
+from .staging import StagingMover
+from .storage import make_storage, StorageWriter
+from .progress import make_progress
+from .ranking import best_match
+from .schedule import (
+    DownloadScheduler,
+    Job,
+    estimated_size,
+    parse_download_order,
+    probe_size,
+    probe_sizes,
+)
+from .stats import RunStats
+from .throttle import parse_rate, StallWatchdog, Throttle
 from .tidal import TidalAuthError, TidalSession, TidalClient
+from .transfer import TransferClient
+
+# the choice that asks for another page of search results
+SHOW_MORE = object()
 
 
 def log(config: dict, message: str = "", indent: int = 0) -> None:
     """Log a message to stdout unless config["quiet"] is set. Optionally indent
-    by `indent` levels"""
+    by `indent` levels. Goes to stderr instead when stdout is taken by JSON
+    progress events or an export."""
     if message is not None and not config["quiet"]:
-        print(constants.INDENT * indent + str(message))
-
-
-def sanitize(config: dict, string: str, length_padding: int = 0) -> str:
-    """Sanitize a string for use as a filesystem path"""
-    if config["nice-format"]:
-        alphanumeric = "".join(c for c in string if c.isalnum() or c in (" ", "-"))
-        hyphenated = alphanumeric.replace(" ", "-")
-        sanitized = "-".join(word for word in hyphenated.split("-") if word).lower()
-    else:
-        illegal_characters = frozenset("/")
-        sanitized = "".join(c for c in string if c not in illegal_characters)
-
-    # get maximum filename length (bytes)
-    max_length = os.statvfs(config["output-directory"]).f_namemax
-
-    # truncate unicode string to a byte count
-    encoded = sanitized.encode("utf-8")[: max_length - length_padding]
-    return encoded.decode("utf-8", "ignore")
+        stdout_taken = (
+            config["progress"] == "json" and int(config["progress-fd"]) == 1
+        ) or (config["export"] and not config["export-path"])
+        tqdm.write(
+            constants.INDENT * indent + str(message),
+            file=sys.stderr if stdout_taken else sys.stdout,
+        )
 
 
 def search(
@@ -63,12 +116,14 @@ def search(
             Track: client.get_track_by_id,
             Album: client.get_album_by_id,
             Artist: client.get_artist_by_id,
+            Playlist: client.get_playlist_by_id,
         }[media_type](query)
         if result is None:
             media_type_name = {
                 Track: "track",
                 Album: "album",
                 Artist: "artist",
+                Playlist: "playlist",
             }[media_type]
             raise ManiaSeriousException(
                 f"Couldn't find the {media_type_name} with ID {query}."
@@ -76,11 +131,12 @@ def search(
         return result
 
     log(config, "Searching...")
-    results = client.search(query, media_type, config["search-count"])
-    if not results:
+    count = int(config["search-count"])
+    page = client.search(query, media_type, count)
+    if not page:
         raise ManiaSeriousException("No results found.")
     if config["lucky"]:
-        return results[0]
+        return best_match(query, page)
 
     def label_track(track: Track) -> str:
         name = track.name
@@ -122,81 +178,203 @@ def search(
     def label_artist(artist: Artist) -> str:
         return artist.name
 
+    def label_playlist(playlist: Playlist) -> str:
+        label = playlist.name
+        if playlist.number_of_tracks is not None:
+            indent = constants.INDENT + " " * 3
+            label += f"\n{indent}{playlist.number_of_tracks} track(s)"
+        return label
+
     labeler = {
         Track: label_track,
         Album: label_album,
         Artist: label_artist,
+        Playlist: label_playlist,
     }[media_type]
 
-    choices = [questionary.Choice(labeler(result), value=result) for result in results]
-    answer = questionary.select("Select one:", choices=choices).ask()
-    if not answer:
-        raise ManiaException("")
-    return answer
+    choices: List[questionary.Choice] = []
+    # the next page is fetched while the user looks at this one
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        while True:
+            first_new_choice = len(choices)
+            choices.extend(
+                questionary.Choice(labeler(result), value=result) for result in page
+            )
+            next_page = None
+            if len(page) >= count:
+                next_page = executor.submit(
+                    client.search, query, media_type, count, len(choices)
+                )
+            answer = questionary.select(
+                "Select one:",
+                choices=[
+                    *choices,
+                    *(
+                        [questionary.Choice("Show more", value=SHOW_MORE)]
+                        if next_page
+                        else []
+                    ),
+                ],
+                default=choices[min(first_new_choice, len(choices) - 1)],
+            ).ask()
+            if not answer:
+                raise ManiaException("")
+            if answer is not SHOW_MORE:
+                return answer
+            page = cast(Future, next_page).result()
+    finally:
+        executor.shutdown(wait=False)
 
 
-def resolve_metadata(config: dict, track: Track, path: str, indent: int) -> None:
-    """Embed tags and cover art from `track` to the file at `path`"""
-    log(config, "Resolving metadata...", indent=indent)
+def fetch_cover(config: dict, album: Album) -> Optional[metadata.Cover]:
+    """Download an album's cover. Tracks of the same album being tagged at
+    the same time share one download."""
+    if not album.cover_url:
+        return None
+    cover_url = album.cover_url
 
-    cover: Optional[metadata.Cover]
-    if track.album.cover_url:
-        request = requests.get(track.album.cover_url)
+    def fetch() -> metadata.Cover:
+        request = config["transfer"].get(cover_url, timeout=request_timeout(config))
         request.raise_for_status()
         data = request.content
+        config["throttle"].consume_auxiliary(len(data))
         mime = request.headers.get("Content-Type", "")
-        cover = metadata.Cover(data, mime)
-    else:
-        cover = None
+        return metadata.Cover(data, mime)
 
-    {"mp4": metadata.resolve_mp4_metadata, "flac": metadata.resolve_flac_metadata}[
-        track.file_extension
-    ](config, track, path, cover)
+    return config["cover-requests"].do(cover_url, fetch, config["stats"])
 
 
-def get_track_path(
-    client: Client,
+def write_metadata(
     config: dict,
     track: Track,
-    siblings: List[Track] = None,
-    include_artist: bool = False,
-    include_album: bool = False,
-) -> str:
-    artist_path = ""
-    album_path = ""
-    disc_path = ""
-    track_path = ""
+    target: Union[str, BinaryIO],
+    cover: Optional[metadata.Cover],
+) -> None:
+    {"mp4": metadata.resolve_mp4_metadata, "flac": metadata.resolve_flac_metadata}[
+        track.file_extension
+    ](config, track, target, cover)
 
-    temporary_extension = f".{constants.TEMPORARY_EXTENSION}.{track.file_extension}"
 
-    if include_artist or config["full-structure"]:
-        artist_path = sanitize(config, track.album.artists[0].name)
-        album_format_string = config["album-format"]
-    else:
-        album_format_string = config["individual-album-format"]
-
-    siblings = siblings or client.get_album_tracks(track.album)
-    maximum_disc_number = max(sibling.disc_number for sibling in siblings)
-    maximum_track_number = max(sibling.track_number for sibling in siblings)
-    if include_album or config["full-structure"]:
-        if maximum_disc_number > 1:
-            disc_number = str(track.disc_number).zfill(len(str(maximum_disc_number)))
-            disc_path = sanitize(config, f"Disc {disc_number}")
-        album_formatted = album_format_string.format(**track.album.format_dict())
-        album_path = sanitize(config, album_formatted)
-        track_format_string = config["track-format"]
-    else:
-        track_format_string = config["individual-track-format"]
-    track_format_dict = track.format_dict(maximum_track_number=maximum_track_number)
-    track_path = sanitize(
-        config,
-        track_format_string.format(**track_format_dict),
-        length_padding=len(temporary_extension),
-    )
+def resolve_metadata(
+    config: dict, track: Track, target: Union[str, BinaryIO], indent: int
+) -> None:
+    """Embed tags and cover art from `track` to the file at `target`, a path
+    or a file object"""
+    log(config, "Resolving metadata...", indent=indent)
+    write_metadata(config, track, target, fetch_cover(config, track.album))
 
-    return os.path.join(
-        config["output-directory"], artist_path, album_path, disc_path, track_path
-    )
+
+def request_timeout(config: dict) -> Tuple[float, float]:
+    """The (connect, read) timeout for requests"""
+    return float(config["connect-timeout"]), float(config["read-timeout"])
+
+
+def fetch(
+    config: dict,
+    url: str,
+    on_chunk: Callable[[bytes], None],
+    on_length: Optional[Callable[[int], None]] = None,
+) -> None:
+    """GET `url` and pass its body to `on_chunk` piece by piece, under the
+    bandwidth cap. `on_length` is called with the Content-Length first, if
+    there is one.
+
+    A transfer that stalls, either by sending nothing for `read-timeout`
+    seconds or by staying slower than `stall-speed` for `stall-timeout`
+    seconds, or whose connection drops partway through, is retried up to
+    `stall-retries` times, resuming from where it stopped. `on_chunk` never
+    sees the difference."""
+    stats = config["stats"]
+    minimum_rate = parse_rate(config["stall-speed"])
+    stall_timeout = float(config["stall-timeout"])
+    retries = int(config["stall-retries"])
+    expected_size: Optional[int] = None
+    received_size = 0
+
+    for attempt in range(retries + 1):
+        headers = {"Range": f"bytes={received_size}-"} if received_size else {}
+        watchdog = StallWatchdog(minimum_rate, stall_timeout)
+        try:
+            with config["transfer"].get(
+                url, headers=headers, stream=True, timeout=request_timeout(config)
+            ) as response:
+                response.raise_for_status()
+                resumed = response.status_code == 206
+                # a server that ignores the Range header sends everything
+                # again, so skip what we already have
+                skip_size = 0 if resumed else received_size
+                content_length = response.headers.get("Content-Length")
+                if expected_size is None and content_length is not None:
+                    expected_size = int(content_length)
+                    if on_length is not None:
+                        on_length(expected_size)
+
+                chunks = response.iter_content(chunk_size=constants.DOWNLOAD_CHUNK_SIZE)
+                while True:
+                    waiting_since = time.monotonic()
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    watchdog.update(len(chunk), time.monotonic() - waiting_since)
+                    if skip_size:
+                        skipped = min(skip_size, len(chunk))
+                        skip_size -= skipped
+                        chunk = chunk[skipped:]
+                    config["throttle"].consume_media(len(chunk))
+                    received_size += len(chunk)
+                    on_chunk(chunk)
+            break
+        except (
+            StallError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            # a connection reset or cut short while reading the body
+            requests.exceptions.ChunkedEncodingError,
+            urllib3.exceptions.ProtocolError,
+        ) as error:
+            stats.increment("stalled transfers")
+            if attempt == retries:
+                raise IncompleteDownloadError(
+                    f"transfer stalled {retries + 1} time(s); last time: {error}"
+                ) from error
+            if received_size:
+                stats.increment("resumed transfers")
+
+    if expected_size is not None and received_size != expected_size:
+        raise IncompleteDownloadError(
+            f"received {received_size} of {expected_size} bytes"
+        )
+
+
+def fetch_segments(
+    config: dict, urls: Iterable[str], on_chunk: Callable[[bytes], None]
+) -> None:
+    """Fetch a segmented stream several segments at a time, passing each
+    segment to `on_chunk` in order as soon as it and all before it have
+    arrived"""
+
+    def fetch_segment(url: str) -> bytes:
+        chunks: List[bytes] = []
+        fetch(config, url, chunks.append)
+        return b"".join(chunks)
+
+    concurrency = int(config["segment-concurrency"])
+    remaining_urls = iter(urls)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        window: Deque[Future] = deque(
+            executor.submit(fetch_segment, url)
+            for url in islice(remaining_urls, concurrency)
+        )
+        try:
+            while window:
+                segment = window.popleft().result()
+                for url in islice(remaining_urls, 1):
+                    window.append(executor.submit(fetch_segment, url))
+                on_chunk(segment)
+        finally:
+            for future in window:
+                future.cancel()
 
 
 def download_track(
@@ -207,76 +385,224 @@ def download_track(
     include_artist: bool = False,
     include_album: bool = False,
     indent: int = 0,
+    path_planner: Optional[AlbumPathPlanner] = None,
+    track_path: Optional[str] = None,
+    prefetcher: Optional[MediaPrefetcher] = None,
+    stream: Optional[Stream] = None,
+    on_stored: Optional[Callable[[Track], None]] = None,
 ) -> None:
-    track_path = get_track_path(
-        client,
-        config,
-        track,
-        siblings=siblings,
-        include_artist=include_artist,
-        include_album=include_album,
-    )
-    temporary_path = (
-        f"{track_path}.{constants.TEMPORARY_EXTENSION}.{track.file_extension}"
-    )
+    """Download `track`, unless it's already there. `on_stored` is called
+    with the track once its file is in place, which may be later, from
+    another thread; it isn't called if the track is skipped or fails."""
+    if track_path is None:
+        path_planner = path_planner or AlbumPathPlanner(
+            config,
+            track.album,
+            siblings or client.get_album_tracks(track.album),
+            include_artist=include_artist,
+            include_album=include_album,
+        )
+        track_path = path_planner.track_path(track)
     final_path = f"{track_path}.{track.file_extension}"
-    if os.path.isfile(final_path):
+    storage = config["storage"]
+    progress = config["progress-reporter"]
+    if storage.exists(final_path):
         log(
             config,
             f"Skipping download of {os.path.basename(final_path)}; it already exists.",
             indent=indent,
         )
+        progress.skipped(track, "exists")
+        if prefetcher is not None:
+            prefetcher.discard(track)
+        if on_stored is not None:
+            on_stored(track)
         return
+    storage.wait_for_space()
+    # a stream that was prefetched or passed in may have expired by now, but
+    # one resolved here is as fresh as it gets
+    fresh = stream is None and prefetcher is None
     try:
-        media_url = client.get_media(track)
+        if stream is None:
+            stream = (prefetcher or client).get_media(track)
+    except QualityUnavailableException as error:
+        fallback = config["quality-fallbacks"].add(track, error.quality)
+        if fallback.action == "downgraded":
+            log(
+                config,
+                f"{os.path.basename(final_path)} isn't available in {track.chosen_quality} quality; downloading it in {error.quality} quality instead.",
+                indent=indent,
+            )
+            download_track(
+                client,
+                config,
+                with_quality(track, error.quality),
+                indent=indent,
+                path_planner=path_planner,
+                track_path=track_path,
+                stream=error.stream,
+                on_stored=on_stored,
+            )
+            return
+        if fallback.action == "deferred":
+            integrity.queue_redownload(
+                config, [integrity.QueuedTrack(track.id, final_path)]
+            )
+        log(
+            config,
+            f"Skipping download of {os.path.basename(final_path)}; it's only available in {error.quality} quality.",
+            indent=indent,
+        )
+        progress.skipped(track, f"only available in {error.quality} quality")
+        return
     except UnavailableException:
         log(
             config,
             f"Skipping download of {os.path.basename(final_path)}; track is not available. Perhaps it's region-locked?",
             indent=indent,
         )
+        progress.skipped(track, "unavailable")
         return
-    os.makedirs(os.path.dirname(final_path), exist_ok=True)
-    request = requests.get(media_url, stream=True)
-    request.raise_for_status()
-    with open(temporary_path, mode="wb") as temp_file:
-        chunk_size = constants.DOWNLOAD_CHUNK_SIZE
-        iterator = request.iter_content(chunk_size=chunk_size)
-        if config["quiet"]:
-            for chunk in iterator:
-                temp_file.write(chunk)
-        else:
-            total = int(request.headers["Content-Length"])
-            with tqdm(
-                total=total,
-                miniters=1,
-                unit="B",
-                unit_divisor=1024,
-                unit_scale=True,
-                dynamic_ncols=True,
-            ) as progress_bar:
-                for chunk in iterator:
-                    temp_file.write(chunk)
-                    progress_bar.update(chunk_size)
+    except Exception as error:
+        progress.failed(track, str(error))
+        raise
+
+    # the track's extension is a guess from its quality; the stream says
+    # what the file really is
+    if stream.mime_type and stream.mime_type not in constants.CONTAINER_EXTENSIONS:
+        log(
+            config,
+            f"Skipping download of {os.path.basename(final_path)}; it comes in a container Mania can't save ({stream.mime_type}).",
+            indent=indent,
+        )
+        progress.skipped(track, f"unsupported container {stream.mime_type}")
+        return
+    file_extension = constants.CONTAINER_EXTENSIONS.get(
+        stream.mime_type, track.file_extension
+    )
+    if file_extension != track.file_extension:
+        log(
+            config,
+            f"{os.path.basename(final_path)} is served as {file_extension.upper()}; saving it as {os.path.basename(track_path)}.{file_extension} instead.",
+            indent=indent,
+        )
+        download_track(
+            client,
+            config,
+            track._replace(file_extension=file_extension),
+            indent=indent,
+            path_planner=path_planner,
+            track_path=track_path,
+            stream=stream,
+            on_stored=on_stored,
+        )
+        return
+
+    def transfer(stream: Stream) -> Tuple[StorageWriter, integrity.PayloadHasher]:
+        hasher = integrity.PayloadHasher(track.file_extension)
+        decryptor = None
+        if stream.encrypted:
+            decryptor = StreamDecryptor(
+                cast(bytes, stream.key), cast(bytes, stream.nonce)
+            )
+        progress.started(track)
+        writer = storage.open(final_path)
+
+        def write(chunk: bytes) -> None:
+            if decryptor is not None:
+                chunk = decryptor.decrypt(chunk)
+            writer.write(chunk)
+            hasher.update(chunk)
+            progress.advance(track, len(chunk))
+
+        try:
+            if stream.segmented:
+                fetch_segments(config, stream.urls, write)
+            else:
+                fetch(
+                    config,
+                    stream.urls[0],
+                    write,
+                    on_length=lambda length: progress.resize(track, length),
+                )
+        except BaseException:
+            writer.abort()
+            raise
+        return writer, hasher
+
+    try:
+        writer, hasher = transfer(stream)
+    except requests.exceptions.HTTPError as error:
+        if fresh or error.response.status_code not in (403, 410):
+            progress.failed(track, str(error))
+            raise error
+        # the URL expired before we got to it. Resolve it again, which may
+        # find that the track is no longer available, or not in this quality.
+        download_track(
+            client,
+            config,
+            track,
+            indent=indent,
+            path_planner=path_planner,
+            track_path=track_path,
+            on_stored=on_stored,
+        )
+        return
+    except IncompleteDownloadError as error:
+        log(
+            config,
+            f"Skipping {os.path.basename(final_path)}; {error}",
+            indent=indent,
+        )
+        progress.skipped(track, str(error))
+        return
+    except Exception as error:
+        progress.failed(track, str(error))
+        raise
 
     if not config["skip-metadata"]:
         try:
-            resolve_metadata(config, track, temporary_path, indent)
+            writer.tag(lambda target: resolve_metadata(config, track, target, indent))
         except metadata.InvalidFileError:
             log(
                 config,
                 f"Skipping {os.path.basename(final_path)}; received invalid file",
                 indent=indent,
             )
-            os.remove(temporary_path)
+            progress.skipped(track, "invalid file")
+            writer.abort()
             return
-    os.rename(temporary_path, final_path)
+        except Exception as error:
+            progress.failed(track, str(error))
+            writer.abort()
+            raise
+    record = integrity.Record(
+        path=final_path,
+        track_id=track.id,
+        payload_size=hasher.payload_size,
+        payload_sha256=hasher.hexdigest(),
+        include_artist=path_planner and path_planner.include_artist,
+        include_album=path_planner and path_planner.include_album,
+        quality=track.chosen_quality,
+    )
+
+    def finish() -> None:
+        integrity.add_record(config, record)
+        progress.finished(track, final_path)
+        if on_stored is not None:
+            on_stored(track)
+
+    try:
+        writer.commit(on_stored=finish)
+    except Exception as error:
+        progress.failed(track, str(error))
+        writer.abort()
+        raise
 
 
 def handle_track(client: Client, config: dict, query: str) -> None:
     track = cast(Track, search(client, config, Track, query))
-    log(config, f'Downloading "{track.name}"...')
-    download_track(client, config, track)
+    process(client, config, Track, track)
 
 
 def download_album(
@@ -285,9 +611,29 @@ def download_album(
     album: Album,
     include_artist: bool = False,
     indent: int = 0,
+    on_complete: Optional[Callable[[], None]] = None,
+    priority: Optional[Callable[[Track], int]] = None,
 ) -> None:
+    """Download every track of `album`. `on_complete` is called once all of
+    them are in place, which may be later, from another thread; it isn't
+    called if any of them was skipped or failed. Tracks that `priority`
+    ranks higher are downloaded first, before the rest are ordered by
+    `download-order`."""
     tracks = client.get_album_tracks(album)
-    for index, track in enumerate(tracks, 1):
+    path_planner = AlbumPathPlanner(
+        config, album, tracks, include_artist=include_artist, include_album=True
+    )
+    stored_track_ids: Set[str] = set()
+    stored_lock = threading.Lock()
+
+    def stored(track: Track) -> None:
+        with stored_lock:
+            stored_track_ids.add(track.id)
+            complete = len(stored_track_ids) == len(tracks)
+        if complete and on_complete is not None:
+            on_complete()
+
+    def download(index: int, track: Track) -> None:
         log(
             config,
             f'Downloading "{track.name}" ({index} of {len(tracks)} track(s))...',
@@ -297,17 +643,58 @@ def download_album(
             client,
             config,
             track,
-            siblings=tracks,
-            include_artist=include_artist,
-            include_album=True,
             indent=indent + 1,
+            path_planner=path_planner,
+            prefetcher=prefetcher,
+            on_stored=stored,
+        )
+
+    with MediaPrefetcher(client, config) as prefetcher, DownloadScheduler(
+        config
+    ) as scheduler:
+        # tracks that already exist will be skipped, so don't resolve them
+        pending_tracks = [
+            track
+            for track in tracks
+            if not config["storage"].exists(
+                f"{path_planner.track_path(track)}.{track.file_extension}"
+            )
+        ]
+        sizes: Dict[str, int] = {}
+        if config["probe-sizes"] and scheduler.by_size:
+            sizes = probe_sizes(
+                config["transfer"],
+                prefetcher,
+                pending_tracks,
+                int(config["concurrency"]),
+                request_timeout(config),
+            )
+        jobs = [
+            Job(
+                partial(download, index, track),
+                track,
+                size=sizes.get(track.id),
+                priority=priority(track) if priority is not None else 0,
+            )
+            for index, track in enumerate(tracks, 1)
+        ]
+        pending_track_ids = {track.id for track in pending_tracks}
+        prefetcher.expect(
+            job.track
+            for job in scheduler.order(jobs)
+            if job.track.id in pending_track_ids
         )
+        for track in tracks:
+            config["progress-reporter"].queued(track)
+        # all at once, so the tracks that start first are the ones prefetched
+        futures = scheduler.submit_all(jobs)
+        for future in futures:
+            future.result()
 
 
 def handle_album(client: Client, config: dict, query: str) -> None:
     album = cast(Album, search(client, config, Album, query))
-    log(config, f'Downloading "{album.name}"...')
-    download_album(client, config, album)
+    process(client, config, Album, album)
 
 
 def download_artist(
@@ -328,29 +715,749 @@ def download_artist(
 
 def handle_artist(client: Client, config: dict, query: str) -> None:
     artist = cast(Artist, search(client, config, Artist, query))
-    log(config, f'Downloading "{artist.name}"...')
-    download_artist(client, config, artist)
+    process(client, config, Artist, artist)
+
+
+def download_tracks(
+    client: Client,
+    config: dict,
+    tracks: Iterable[Track],
+    indent: int = 0,
+    on_stored: Optional[Callable[[Track], None]] = None,
+    priority: Optional[Callable[[Track], int]] = None,
+) -> None:
+    """Download a stream of tracks from different albums, such as a playlist.
+    Downloads start as soon as the first tracks arrive, and only a few tracks
+    beyond those being downloaded are pulled from `tracks` at a time, so later
+    pages are fetched while earlier tracks download instead of the whole
+    listing being held at once. The IDs of tracks already seen, and the
+    artists and albums the client shares between tracks, do still grow with
+    the number of distinct tracks, artists and albums in the stream. Of the
+    tracks waiting at once, those that `priority` ranks higher go first."""
+    concurrency = int(config["concurrency"])
+    seen_track_ids: Set[str] = set()
+
+    def download(index: int, track: Track) -> None:
+        log(config, f'Downloading "{track.name}" (track {index})...', indent=indent)
+        download_track(
+            client,
+            config,
+            track,
+            indent=indent + 1,
+            prefetcher=prefetcher,
+            on_stored=on_stored,
+        )
+
+    with MediaPrefetcher(client, config) as prefetcher, DownloadScheduler(
+        config
+    ) as scheduler:
+        pending: Set[Future] = set()
+        for index, track in enumerate(tracks, 1):
+            # playlists can contain the same track more than once
+            if track.id in seen_track_ids:
+                continue
+            seen_track_ids.add(track.id)
+            if len(pending) >= 2 * concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            prefetcher.expect([track])
+            config["progress-reporter"].queued(track)
+            pending.add(
+                scheduler.submit(
+                    partial(download, index, track),
+                    track,
+                    priority=priority(track) if priority is not None else 0,
+                )
+            )
+        for future in pending:
+            future.result()
 
 
-def handle_url(client: Client, config: dict, url: str):
+def load_favorites_state(config: dict) -> Dict[str, Set[str]]:
+    """Get the IDs of the favorite tracks and albums that have already been
+    synced to the output directory, by kind"""
+    state_path = os.path.join(
+        config["output-directory"], constants.FAVORITES_STATE_NAME
+    )
     try:
-        media_type, media = client.resolve_url(url)
-    except ValueError as error:
-        raise ManiaSeriousException(str(error)) from error
+        state = toml.load(state_path)
+    except FileNotFoundError:
+        state = {}
+    return {kind: set(state.get(kind, ())) for kind in ("tracks", "albums")}
 
-    if media is None:
-        raise ManiaSeriousException(f"Couldn't find anything at that URL.")
+
+def save_favorites_state(config: dict, state: Dict[str, Set[str]]) -> None:
+    """Add `state` to the saved state. Favorites synced by other processes in
+    the meantime are kept."""
+    state_path = os.path.join(
+        config["output-directory"], constants.FAVORITES_STATE_NAME
+    )
+    with locked(state_path):
+        saved_state = load_favorites_state(config)
+        merged_state = {
+            kind: sorted(saved_state.get(kind, set()) | ids)
+            for kind, ids in state.items()
+        }
+        write_atomically(state_path, toml.dumps(merged_state))
+
+
+def handle_favorites(client: Client, config: dict, query: str) -> None:
+    """Sync the user's favorite tracks, albums and artists, or only the kinds
+    listed in `query`. Tracks, and albums with every track in place, are
+    remembered once they're synced and left out of later runs before
+    anything else is fetched for them. Artists are looked at on every run,
+    since they may have released something new; their files that are
+    already there are skipped as usual."""
+    all_kinds = ("tracks", "albums", "artists")
+    kinds = query.split() or all_kinds
+    for kind in kinds:
+        if kind not in all_kinds:
+            raise ManiaSeriousException(
+                f'Unknown kind of favorite "{kind}". Try "tracks", "albums" or "artists".'
+            )
+
+    state = load_favorites_state(config)
+    state_lock = threading.Lock()
+    # only downloads count; planning and exporting don't store anything
+    syncing = not config["plan"] and not config["export"]
+    unsaved = False
+    last_saved = time.monotonic()
+
+    def save() -> None:
+        nonlocal unsaved, last_saved
+        save_favorites_state(config, state)
+        unsaved = False
+        last_saved = time.monotonic()
+
+    def synced(kind: str, media_id: str) -> None:
+        # called from download workers, and from the staging mover. Rewriting
+        # the state for every track would make a large sync quadratic, so
+        # it's saved every so often, and once more at the end.
+        nonlocal unsaved
+        with state_lock:
+            state[kind].add(str(media_id))
+            unsaved = True
+            if time.monotonic() - last_saved >= constants.FAVORITES_SAVE_INTERVAL:
+                save()
+
+    try:
+        if "tracks" in kinds:
+            log(config, "Syncing favorite tracks...")
+            tracks = client.get_favorite_tracks(exclude_ids=state["tracks"])
+            if syncing:
+                download_tracks(
+                    client,
+                    config,
+                    tracks,
+                    indent=1,
+                    on_stored=lambda track: synced("tracks", track.id),
+                )
+            elif config["export"]:
+                export_tracks(client, config, tracks)
+            else:
+                report_plan(client, config, plan_tracks(client, config, tracks))
+
+        if "albums" in kinds:
+            log(config, "Syncing favorite albums...")
+            for album in client.get_favorite_albums(exclude_ids=state["albums"]):
+                if syncing:
+                    log(config, f'Downloading "{album.name}"...')
+                    download_album(
+                        client,
+                        config,
+                        album,
+                        on_complete=partial(synced, "albums", album.id),
+                    )
+                else:
+                    process(client, config, Album, album)
+
+        if "artists" in kinds:
+            log(config, "Syncing favorite artists...")
+            for artist in client.get_favorite_artists():
+                process(client, config, Artist, artist)
+    finally:
+        if config["staging-mover"] is not None:
+            # files still on their way out of staging are synced once moved
+            config["staging-mover"].wait()
+        with state_lock:
+            if unsaved:
+                save()
+
+
+def handle_verify(config: dict, query: str) -> None:
+    """Check every file in the output directory, in parallel across all
+    cores. Files that fail and whose track is known from the checksum records
+    are moved aside and queued for `mania redownload`."""
+    records = integrity.load_records(config)
+    paths = list(integrity.find_library_files(config))
+    log(config, f"Verifying {len(paths)} file(s)...")
+
+    queued_tracks = []
+    failed_count = 0
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(
+            integrity.verify_file,
+            paths,
+            [records.get(path) for path in paths],
+            chunksize=16,
+        )
+        for path, problems in zip(paths, results):
+            if not problems:
+                continue
+            failed_count += 1
+            relative_path = os.path.relpath(path, config["output-directory"])
+            log(config, f"{relative_path}: {'; '.join(problems)}", indent=1)
+            record = records.get(path)
+            if record is None:
+                log(config, "Not queued; its track ID is unknown.", indent=2)
+                continue
+            integrity.move_aside(path)
+            queued_tracks.append(integrity.QueuedTrack(record.track_id, path))
+
+    integrity.queue_redownload(config, queued_tracks)
+    if failed_count:
+        raise ManiaSeriousException(
+            f"{failed_count} of {len(paths)} file(s) failed verification. "
+            f'{len(queued_tracks)} file(s) queued; run "mania redownload" to fetch them again.'
+        )
+    log(config, "All files are intact.")
+
+
+def handle_redownload(client: Client, config: dict, query: str) -> None:
+    """Download the tracks queued by `mania verify` to the same paths"""
+    queued_tracks = integrity.load_redownload_queue(config)
+    lookup = client.get_tracks_by_ids(
+        [queued_track.track_id for queued_track in queued_tracks]
+    )
+    remaining = []
+    for index, (queued_track, track) in enumerate(zip(queued_tracks, lookup.items), 1):
+        if track is None:
+            log(config, f"Couldn't find the track with ID {queued_track.track_id}.")
+            continue
+        log(
+            config,
+            f'Downloading "{track.name}" ({index} of {len(queued_tracks)} track(s))...',
+        )
+        track_path, _ = os.path.splitext(queued_track.path)
+        config["progress-reporter"].queued(track)
+        download_track(client, config, track, indent=1, track_path=track_path)
+        # the track may have been downloaded in a lower quality, in another
+        # format
+        if not any(
+            config["storage"].exists(f"{track_path}.{file_extension}")
+            for file_extension in set(constants.FILE_EXTENSIONS.values())
+        ):
+            remaining.append(queued_track)
+    integrity.save_redownload_queue(config, remaining)
+
+
+def infer_layout(config: dict, path: str) -> Tuple[bool, bool]:
+    """Guess whether a file from before layouts were recorded was downloaded
+    with an artist directory and an album directory, from how deep it is"""
+    directories = os.path.relpath(path, config["output-directory"]).split(os.sep)[:-1]
+    if directories and re.fullmatch(r"(?i)disc[ -]\d+", directories[-1]):
+        directories.pop()
+    return len(directories) >= 2, len(directories) >= 1
+
+
+def handle_relayout(client: Client, config: dict, query: str) -> None:
+    """Move files in the output directory to where the current configuration
+    would put them, and tag them again with fresh metadata, without
+    downloading any audio. Files are matched to tracks by their checksum
+    records."""
+    records = [
+        record
+        for path, record in integrity.load_records(config).items()
+        if os.path.isfile(path)
+    ]
+    recorded_paths = {record.path for record in records}
+    untracked_count = sum(
+        1 for path in integrity.find_library_files(config) if path not in recorded_paths
+    )
+    log(config, f"Looking up {len(records)} track(s)...")
+    track_ids = list({record.track_id for record in records})
+    tracks = dict(zip(track_ids, client.get_tracks_by_ids(track_ids).items))
+
+    # files laid out the same way in the same album share a path planner
+    groups: Dict[Tuple[str, bool, bool], List[Tuple[integrity.Record, Track]]] = {}
+    for record in records:
+        track = tracks[record.track_id]
+        if track is None:
+            log(config, f"Couldn't find the track with ID {record.track_id}.")
+            continue
+        # keep the file's format and quality, whatever the current setting
+        track = track._replace(
+            chosen_quality=record.quality or track.chosen_quality,
+            file_extension=record.path.rsplit(".", 1)[-1],
+        )
+        if record.include_artist is None or record.include_album is None:
+            include_artist, include_album = infer_layout(config, record.path)
+        else:
+            include_artist, include_album = record.include_artist, record.include_album
+        key = (track.album.id, include_artist, include_album)
+        groups.setdefault(key, []).append((record, track))
+
+    def relayout(
+        key: Tuple[str, bool, bool], members: List[Tuple[integrity.Record, Track]]
+    ) -> int:
+        _, include_artist, include_album = key
+        album = members[0][1].album
+        path_planner = AlbumPathPlanner(
+            config,
+            album,
+            client.get_album_tracks(album),
+            include_artist=include_artist,
+            include_album=include_album,
+        )
+        cover = None if config["skip-metadata"] else fetch_cover(config, album)
+        moved_count = 0
+        for record, track in members:
+            new_path = f"{path_planner.track_path(track)}.{track.file_extension}"
+            if new_path != record.path:
+                if os.path.exists(new_path):
+                    log(
+                        config,
+                        f"Not moving {record.path}; {new_path} already exists.",
+                    )
+                    continue
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                shutil.move(record.path, new_path)
+                remove_empty_directories(
+                    config["output-directory"], os.path.dirname(record.path)
+                )
+                moved_count += 1
+            if not config["skip-metadata"]:
+                write_metadata(config, track, new_path, cover)
+            integrity.add_record(
+                config,
+                record._replace(
+                    path=new_path,
+                    include_artist=include_artist,
+                    include_album=include_album,
+                ),
+            )
+        return moved_count
+
+    with ThreadPoolExecutor(max_workers=int(config["concurrency"])) as executor:
+        futures = [
+            executor.submit(relayout, key, members) for key, members in groups.items()
+        ]
+        moved_count = sum(future.result() for future in futures)
+
+    log(config, f"Moved {moved_count} file(s).")
+    if untracked_count:
+        log(
+            config,
+            f"Left {untracked_count} file(s) alone; they have no checksum record, so their tracks are unknown.",
+        )
+
+
+def download_playlist(
+    client: Client, config: dict, playlist: Playlist, indent: int = 0
+) -> None:
+    download_tracks(client, config, client.get_playlist_tracks(playlist), indent)
+
+
+def handle_playlist(client: Client, config: dict, query: str) -> None:
+    playlist = cast(Playlist, search(client, config, Playlist, query))
+    process(client, config, Playlist, playlist)
+
+
+def download_mix(client: Client, config: dict, mix: Mix, indent: int = 0) -> None:
+    download_tracks(client, config, client.get_mix_tracks(mix), indent)
+
+
+def handle_mix(client: Client, config: dict, query: str) -> None:
+    # mixes can't be searched for, so the query is always an ID
+    mix = client.get_mix_by_id(query)
+    if mix is None:
+        raise ManiaSeriousException(f"Couldn't find the mix with ID {query}.")
+    process(client, config, Mix, mix)
+
+
+def open_crawl_directory(config: dict) -> CrawlDirectory:
+    if not config["crawl-directory"]:
+        raise ManiaSeriousException(
+            "Set crawl-directory to a directory shared by all workers."
+        )
+    return CrawlDirectory(
+        os.path.expanduser(config["crawl-directory"]),
+        float(config["crawl-claim-timeout"]),
+    )
+
+
+def handle_crawl_queue(config: dict, query: str) -> None:
+    """Add the URLs listed in the file `query`, one per line, to the crawl"""
+    crawl = open_crawl_directory(config)
+    added_count = 0
+    try:
+        with open(os.path.expanduser(query)) as work_file:
+            for line in work_file:
+                url = line.strip()
+                if url and not url.startswith("#") and crawl.add(url):
+                    added_count += 1
+    except FileNotFoundError as error:
+        raise ManiaSeriousException(f"Couldn't find the file {query}.") from error
+    log(config, f"Added {added_count} URL(s) to the crawl.")
+
+
+def handle_crawl_status(config: dict, query: str) -> None:
+    crawl = open_crawl_directory(config)
+    counts: Dict[str, int] = {}
+    for item in crawl.items():
+        state = crawl.state(item)
+        counts[state] = counts.get(state, 0) + 1
+    for state in ("pending", "claimed", "stale", "done", "failed"):
+        print(f"{state}: {counts.get(state, 0)}")
+
+
+def handle_crawl_work(client: Client, config: dict, query: str) -> None:
+    """Work through the crawl until every item is done or failed. The items
+    of this worker's shard come first; after those it helps with the rest,
+    so the crawl still finishes if a worker dies or falls behind. While
+    other workers hold claims, it waits around to take over any of them that
+    go stale."""
+    crawl = open_crawl_directory(config)
+    shard, shard_count = parse_shard(config["crawl-shard"])
+    while True:
+        items = sorted(
+            (
+                item
+                for item in crawl.items()
+                if crawl.state(item) in ("pending", "stale")
+            ),
+            key=lambda item: item.shard(shard_count) != shard,
+        )
+        claimed_count = 0
+        for item in items:
+            claim = crawl.claim(item)
+            if claim is None:
+                continue
+            claimed_count += 1
+            with claim:
+                log(config, f"Crawling {item.url}...")
+                try:
+                    media_type, media = client.resolve_url(item.url)
+                    if media is None:
+                        raise ManiaSeriousException("Couldn't find anything there.")
+                    process(client, config, media_type, media)
+                except (
+                    ManiaException,
+                    ValueError,
+                    requests.exceptions.RequestException,
+                ) as error:
+                    log(config, f"Failed to crawl {item.url}: {error}", indent=1)
+                    crawl.fail(item, str(error))
+                    continue
+                crawl.complete(item)
+        # go around again for items added or left stale in the meantime
+        if claimed_count == 0:
+            if not any(crawl.state(item) == "claimed" for item in crawl.items()):
+                break
+            time.sleep(crawl.claim_timeout / 4)
+
+
+class PlannedTrack(NamedTuple):
+    """A track that a real run would download, or skip if it already exists"""
+
+    track: Track
+    path: str
+    exists: bool
+    available: Optional[bool] = None
+    size: Optional[int] = None
+
+    def estimated_size(self) -> int:
+        """The exact size if it's known, otherwise a guess from the duration
+        and quality"""
+        if self.size is not None:
+            return self.size
+        return estimated_size(self.track)
+
+
+def plan_track(
+    client: Client,
+    config: dict,
+    track: Track,
+    siblings: List[Track] = None,
+    include_artist: bool = False,
+    include_album: bool = False,
+) -> List[PlannedTrack]:
+    path_planner = AlbumPathPlanner(
+        config,
+        track.album,
+        siblings or client.get_album_tracks(track.album),
+        include_artist=include_artist,
+        include_album=include_album,
+    )
+    final_path = f"{path_planner.track_path(track)}.{track.file_extension}"
+    return [PlannedTrack(track, final_path, config["storage"].exists(final_path))]
+
+
+def plan_album(
+    client: Client, config: dict, album: Album, include_artist: bool = False
+) -> List[PlannedTrack]:
+    tracks = client.get_album_tracks(album)
+    path_planner = AlbumPathPlanner(
+        config, album, tracks, include_artist=include_artist, include_album=True
+    )
+    planned_tracks = []
+    for track, track_path in zip(tracks, path_planner.track_paths()):
+        final_path = f"{track_path}.{track.file_extension}"
+        planned_tracks.append(
+            PlannedTrack(track, final_path, config["storage"].exists(final_path))
+        )
+    return planned_tracks
+
+
+def plan_artist(client: Client, config: dict, artist: Artist) -> List[PlannedTrack]:
+    albums = client.get_artist_albums(artist)
+    if config["include-eps-singles"]:
+        eps_singles = client.get_artist_eps_singles(artist)
+        albums = [*albums, *eps_singles]
+    return [
+        planned_track
+        for album in albums
+        for planned_track in plan_album(client, config, album, include_artist=True)
+    ]
+
+
+def plan_tracks(
+    client: Client, config: dict, tracks: Iterable[Track]
+) -> List[PlannedTrack]:
+    planned_tracks = []
+    seen_track_ids: Set[str] = set()
+    for track in tracks:
+        if track.id not in seen_track_ids:
+            seen_track_ids.add(track.id)
+            planned_tracks += plan_track(client, config, track)
+    return planned_tracks
+
+
+def plan_playlist(
+    client: Client, config: dict, playlist: Playlist
+) -> List[PlannedTrack]:
+    return plan_tracks(client, config, client.get_playlist_tracks(playlist))
+
+
+def plan_mix(client: Client, config: dict, mix: Mix) -> List[PlannedTrack]:
+    return plan_tracks(client, config, client.get_mix_tracks(mix))
+
+
+def resolve_plan_sizes(
+    client: Client, config: dict, planned_tracks: List[PlannedTrack]
+) -> List[PlannedTrack]:
+    """Find the exact size of each track that would be downloaded by resolving
+    its media URL and sending a HEAD request"""
+
+    def resolve(planned_track: PlannedTrack) -> PlannedTrack:
+        if planned_track.exists:
+            return planned_track
+        try:
+            stream = client.get_media(planned_track.track)
+        except QualityUnavailableException as error:
+            if config["quality-fallbacks"].policy != "downgrade":
+                return planned_track._replace(available=False)
+            track = with_quality(planned_track.track, error.quality)
+            path, _ = os.path.splitext(planned_track.path)
+            planned_track = planned_track._replace(
+                track=track,
+                path=f"{path}.{track.file_extension}",
+                exists=config["storage"].exists(f"{path}.{track.file_extension}"),
+            )
+            if planned_track.exists or error.stream is None:
+                # resolving again asks for the lower quality
+                return resolve(planned_track)
+            stream = error.stream
+        except UnavailableException:
+            return planned_track._replace(available=False)
+        # segmented streams would take too many requests; leave the estimate
+        return planned_track._replace(
+            available=True,
+            size=probe_size(config["transfer"], stream, request_timeout(config)),
+        )
+
+    with ThreadPoolExecutor(max_workers=int(config["concurrency"])) as executor:
+        return list(executor.map(resolve, planned_tracks))
+
+
+def report_plan(
+    client: Client, config: dict, planned_tracks: List[PlannedTrack]
+) -> None:
+    """Print a summary of what a real run would do, or the whole plan as JSON
+    if config["plan-json"] is set"""
+    if config["plan-sizes"]:
+        log(config, "Resolving sizes...")
+        planned_tracks = resolve_plan_sizes(client, config, planned_tracks)
+
+    pending = [
+        planned_track
+        for planned_track in planned_tracks
+        if not planned_track.exists and planned_track.available is not False
+    ]
+    pending_bytes = sum(planned_track.estimated_size() for planned_track in pending)
+    bandwidth = (
+        config["throttle"].media.rate
+        if config["throttle"].media
+        else constants.ESTIMATED_BANDWIDTH
+    )
+    totals = {
+        "tracks": len(planned_tracks),
+        "existing": sum(planned_track.exists for planned_track in planned_tracks),
+        "unavailable": sum(
+            planned_track.available is False for planned_track in planned_tracks
+        ),
+        "pending": len(pending),
+        "pending_bytes": pending_bytes,
+        "exact_sizes": all(planned_track.size is not None for planned_track in pending),
+        "estimated_seconds": round(pending_bytes / bandwidth),
+    }
+
+    if config["plan-json"]:
+        plan = {
+            "tracks": [
+                {
+                    "id": planned_track.track.id,
+                    "name": planned_track.track.name,
+                    "album": planned_track.track.album.name,
+                    "path": planned_track.path,
+                    "exists": planned_track.exists,
+                    "available": planned_track.available,
+                    "size": planned_track.size,
+                    "estimated_size": planned_track.estimated_size(),
+                }
+                for planned_track in planned_tracks
+            ],
+            "totals": totals,
+        }
+        print(json.dumps(plan, indent=2))
+        return
+
+    for planned_track in planned_tracks:
+        if planned_track.exists:
+            status = "exists"
+        elif planned_track.available is False:
+            status = "unavailable"
+        else:
+            status = "download"
+        log(config, f"[{status}] {planned_track.path}", indent=1)
+    approximate = "" if totals["exact_sizes"] else "~"
+    log(
+        config,
+        f"{totals['pending']} of {totals['tracks']} track(s) to download, "
+        f"{approximate}{pending_bytes / 1024 ** 2:.1f} MiB, "
+        f"~{totals['estimated_seconds'] // 60} minute(s) "
+        f"at {bandwidth / 1024 ** 2:.1f} MiB/s",
+    )
+
+
+def map_ahead(
+    executor: ThreadPoolExecutor,
+    function: Callable[[Any], Any],
+    items: Iterable[Any],
+    window: int,
+) -> Iterator[Any]:
+    """Like executor.map, but only submits up to `window` calls ahead of the
+    results that have been consumed, so `items` is read lazily"""
+    pending: Deque[Future] = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def export_tracks(client: Client, config: dict, tracks: Iterable[Track]) -> None:
+    for track in tracks:
+        config["export-writer"].write(track)
+
+
+def export_track(client: Client, config: dict, track: Track) -> None:
+    export_tracks(client, config, [track])
+
+
+def export_album(client: Client, config: dict, album: Album) -> None:
+    export_tracks(client, config, client.get_album_tracks(album))
+
+
+def export_artist(client: Client, config: dict, artist: Artist) -> None:
+    """Export an artist's albums in order, fetching the track listings of the
+    next few while earlier ones are written"""
+    albums = client.get_artist_albums(artist)
+    if config["include-eps-singles"]:
+        eps_singles = client.get_artist_eps_singles(artist)
+        albums = [*albums, *eps_singles]
+    concurrency = int(config["concurrency"])
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for tracks in map_ahead(
+            executor, client.get_album_tracks, albums, 2 * concurrency
+        ):
+            export_tracks(client, config, tracks)
+
+
+def export_playlist(client: Client, config: dict, playlist: Playlist) -> None:
+    export_tracks(client, config, client.get_playlist_tracks(playlist))
+
+
+def export_mix(client: Client, config: dict, mix: Mix) -> None:
+    export_tracks(client, config, client.get_mix_tracks(mix))
+
+
+def process(client: Client, config: dict, media_type: MediaType, media: Media) -> None:
+    """Download `media`, or only plan the download if config["plan"] is set,
+    or only export its metadata if config["export"] is set"""
+    if config["export"]:
+        log(config, f'Exporting "{media.name}"...')
+        exporter = {
+            Track: export_track,
+            Album: export_album,
+            Artist: export_artist,
+            Playlist: export_playlist,
+            Mix: export_mix,
+        }[media_type]
+        exporter(client, config, media)
+        return
+
+    if config["plan"]:
+        log(config, f'Planning "{media.name}"...')
+        planner = {
+            Track: plan_track,
+            Album: plan_album,
+            Artist: plan_artist,
+            Playlist: plan_playlist,
+            Mix: plan_mix,
+        }[media_type]
+        report_plan(client, config, planner(client, config, media))
+        return
 
     log(config, f'Downloading "{media.name}"...')
+    if media_type is Track:
+        config["progress-reporter"].queued(cast(Track, media))
     downloader = {
         Track: download_track,
         Album: download_album,
         Artist: download_artist,
+        Playlist: download_playlist,
+        Mix: download_mix,
     }[media_type]
-
     downloader(client, config, media)
 
 
+def handle_url(client: Client, config: dict, query: str):
+    """Handle one or more URLs, separated by whitespace"""
+    for url in query.split():
+        try:
+            media_type, media = client.resolve_url(url)
+        except ValueError as error:
+            raise ManiaSeriousException(str(error)) from error
+
+        if media is None:
+            raise ManiaSeriousException(f"Couldn't find anything at {url}.")
+
+        process(client, config, media_type, media)
+
+
 def load_config(args: dict) -> dict:
     if args["config-path"]:
         config_path = args["config-path"]
@@ -377,6 +1484,22 @@ def load_config(args: dict) -> dict:
     config["output-directory"] = os.path.expanduser(config["output-directory"])
     os.makedirs(config["output-directory"], exist_ok=True)
     config["config-path"] = config_path
+    config["stats"] = RunStats()
+    config["cover-requests"] = SingleFlight("coalesced cover requests")
+    try:
+        config["throttle"] = Throttle.from_config(config)
+        parse_shard(config["crawl-shard"])
+        parse_download_order(config["download-order"])
+        config["quality-fallbacks"] = FallbackLog(config)
+        config["progress-reporter"] = make_progress(config)
+        config["staging-mover"] = (
+            StagingMover(config) if config["staging-directory"] else None
+        )
+        config["export-writer"] = ExportWriter(config) if config["export"] else None
+        config["storage"] = make_storage(config)
+        config["transfer"] = TransferClient(config)
+    except ValueError as error:
+        raise ManiaSeriousException(str(error)) from error
     return config
 
 
@@ -387,9 +1510,31 @@ def run() -> None:
         "track": handle_track,
         "album": handle_album,
         "artist": handle_artist,
+        "playlist": handle_playlist,
+        "mix": handle_mix,
         "url": handle_url,
+        "favorites": handle_favorites,
+        "redownload": handle_redownload,
+        "relayout": handle_relayout,
+        "crawl-work": handle_crawl_work,
     }
-    parser.add_argument("command", choices=handlers.keys())
+    # commands that don't need a TIDAL session
+    offline_handlers = {
+        "verify": handle_verify,
+        "crawl-queue": handle_crawl_queue,
+        "crawl-status": handle_crawl_status,
+    }
+    queryless_commands = frozenset(
+        (
+            "favorites",
+            "redownload",
+            "relayout",
+            "verify",
+            "crawl-status",
+            "crawl-work",
+        )
+    )
+    parser.add_argument("command", choices=[*handlers, *offline_handlers])
 
     parser.add_argument("--config-path", dest="config-path")
 
@@ -406,12 +1551,20 @@ def run() -> None:
         else:
             parser.add_argument(f"--{key}", nargs="?", dest=key)
 
-    parser.add_argument("query", nargs="+")
+    parser.add_argument("query", nargs="*")
 
     parsed_args = parser.parse_args()
     args = vars(parsed_args)
+    if not args["query"] and args["command"] not in queryless_commands:
+        parser.error("the following arguments are required: query")
 
     config = load_config(args)
+    query = " ".join(args["query"])
+
+    if args["command"] in offline_handlers:
+        offline_handlers[args["command"]](config, query)
+        log(config, "Done!")
+        return
 
     if "username" in config or "password" in config:
         config_path = config["config-path"]
@@ -420,9 +1573,7 @@ def run() -> None:
             f"Note: due to changes on TIDAL's end, login is now done by mimicking an Android TV, and directly specifying a username and password is no longer supported. You can remove them from your configuration file ({config_path}).",
         )
     try:
-        with open(constants.SESSION_PATH, "r") as session_file:
-            session_dict = toml.load(session_file)
-        session = TidalSession(**session_dict)
+        session = TidalSession.load(constants.SESSION_PATH)
         session.check_valid()
         log(config, "Loaded cached TIDAL session.")
     except (FileNotFoundError, toml.TomlDecodeError, TidalAuthError):
@@ -430,16 +1581,29 @@ def run() -> None:
         session = TidalSession()
         session.get_authorization()
         session.authenticate()
+        # save right away, so other processes can use it
+        session.save(constants.SESSION_PATH)
 
     client = TidalClient(config, session)
 
     try:
-        handlers[args["command"]](client, config, " ".join(args["query"]))
+        handlers[args["command"]](client, config, query)
     finally:
-        log(config, "Saving TIDAL session for future use...")
-        os.makedirs(os.path.dirname(constants.SESSION_PATH), exist_ok=True)
-        with open(constants.SESSION_PATH, "w") as session_file:
-            toml.dump(session.to_dict(), session_file)
+        try:
+            if config["staging-mover"] is not None:
+                log(config, "Waiting for files to move out of the staging directory...")
+                config["staging-mover"].close()
+        finally:
+            config["progress-reporter"].close()
+            if config["export-writer"] is not None:
+                config["export-writer"].close()
+            config["transfer"].close(config["stats"])
+            for line in config["stats"].summary():
+                log(config, line)
+            for line in config["quality-fallbacks"].summary():
+                log(config, line)
+            log(config, "Saving TIDAL session for future use...")
+            session.save(constants.SESSION_PATH)
 
     log(config, "Done!")
 
@@ -0,0 +1,131 @@
+"""Parsing of TIDAL playback manifests"""
+
+from typing import List, Optional
+from urllib.parse import urljoin
+from xml.etree import ElementTree
+import base64
+import json
+import re
+
+from .decryption import unwrap_key
+from .models import Stream
+
+BTS_MIME_TYPE = "application/vnd.tidal.bts"
+MPD_MIME_TYPE = "application/dash+xml"
+MPD_NAMESPACES = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
+
+
+class ManifestError(Exception):
+    """A manifest in a format we can't handle"""
+
+
+def parse_manifest(manifest_mime_type: str, manifest: str) -> Stream:
+    """Parse the base64-encoded manifest from a playbackinfopostpaywall
+    response"""
+    decoded = base64.b64decode(manifest)
+    if manifest_mime_type == MPD_MIME_TYPE:
+        return _parse_mpd(decoded)
+    if manifest_mime_type == BTS_MIME_TYPE:
+        return _parse_bts(decoded)
+    raise ManifestError(f'Unsupported manifest type "{manifest_mime_type}".')
+
+
+def _parse_bts(decoded: bytes) -> Stream:
+    """A JSON manifest, with the whole file at a single URL"""
+    manifest = json.loads(decoded)
+
+    encryption_type = manifest.get("encryptionType", "NONE")
+    if encryption_type == "OLD_AES":
+        key, nonce = unwrap_key(manifest["keyId"])
+    elif encryption_type == "NONE":
+        key, nonce = None, None
+    else:
+        raise ManifestError(f'Unsupported encryption type "{encryption_type}".')
+
+    return Stream(
+        urls=(manifest["urls"][0],),
+        mime_type=manifest.get("mimeType", ""),
+        codecs=manifest.get("codecs", ""),
+        key=key,
+        nonce=nonce,
+    )
+
+
+def _find(element: ElementTree.Element, path: str) -> Optional[ElementTree.Element]:
+    return element.find(path, MPD_NAMESPACES)
+
+
+def _base_url(element: ElementTree.Element, parent_url: str) -> str:
+    base_url = _find(element, "mpd:BaseURL")
+    if base_url is None or not base_url.text:
+        return parent_url
+    return urljoin(parent_url, base_url.text.strip())
+
+
+def _expand_template(template: str, representation_id: str, number: int) -> str:
+    """Fill in the $RepresentationID$ and $Number$ (optionally with a width,
+    as in $Number%05d$) identifiers of a DASH segment template"""
+
+    def replace(match: re.Match) -> str:
+        identifier, width = match.groups()
+        if identifier == "RepresentationID":
+            return representation_id
+        if identifier == "Number":
+            return f"{number:{width or 'd'}}"
+        return "$"
+
+    return re.sub(r"\$(RepresentationID|Number|)(?:%(\d+d))?\$", replace, template)
+
+
+def _parse_mpd(decoded: bytes) -> Stream:
+    """A DASH manifest, with the file split into an initialization segment
+    followed by numbered media segments"""
+    root = ElementTree.fromstring(decoded)
+    if root.find(".//mpd:ContentProtection", MPD_NAMESPACES) is not None:
+        raise ManifestError("DASH manifest is DRM-protected.")
+    period = _find(root, "mpd:Period")
+    adaptation_set = _find(root, "mpd:Period/mpd:AdaptationSet")
+    representation = _find(root, "mpd:Period/mpd:AdaptationSet/mpd:Representation")
+    if period is None or adaptation_set is None or representation is None:
+        raise ManifestError("DASH manifest has no representation.")
+
+    segment_template = _find(representation, "mpd:SegmentTemplate")
+    if segment_template is None:
+        segment_template = _find(adaptation_set, "mpd:SegmentTemplate")
+    if segment_template is None:
+        raise ManifestError("DASH manifest has no segment template.")
+
+    base_url = _base_url(root, "")
+    for element in (period, adaptation_set, representation):
+        base_url = _base_url(element, base_url)
+
+    representation_id = representation.get("id", "")
+    start_number = int(segment_template.get("startNumber", "1"))
+    timeline = _find(segment_template, "mpd:SegmentTimeline")
+    if timeline is None:
+        raise ManifestError("DASH manifest has no segment timeline.")
+    segment_count = sum(
+        1 + int(segment.get("r", "0"))
+        for segment in timeline.findall("mpd:S", MPD_NAMESPACES)
+    )
+
+    urls: List[str] = []
+    initialization = segment_template.get("initialization")
+    if initialization:
+        urls.append(
+            urljoin(
+                base_url,
+                _expand_template(initialization, representation_id, start_number),
+            )
+        )
+    media = segment_template.get("media", "")
+    for number in range(start_number, start_number + segment_count):
+        urls.append(
+            urljoin(base_url, _expand_template(media, representation_id, number))
+        )
+
+    return Stream(
+        urls=tuple(urls),
+        mime_type=representation.get("mimeType") or adaptation_set.get("mimeType", ""),
+        codecs=representation.get("codecs", ""),
+    )
@@ -1,7 +1,7 @@
 import mutagen
 from mutagen.mp4 import MP4, MP4Cover as MP4Picture
 from mutagen.flac import FLAC, Picture as FLACPicture
-from typing import NamedTuple, Optional
+from typing import BinaryIO, NamedTuple, Optional, Union
 
 from .models import Track, Album, Artist
 
@@ -15,10 +15,18 @@ class Cover(NamedTuple):
     mime: str
 
 
+def _save(tagger: mutagen.FileType, target: Union[str, BinaryIO]) -> None:
+    if not isinstance(target, str):
+        # mutagen rereads the file from wherever it's positioned
+        target.seek(0)
+    tagger.save(target)
+
+
 def resolve_mp4_metadata(
-    config: dict, track: Track, path: str, cover: Optional[Cover]
+    config: dict, track: Track, target: Union[str, BinaryIO], cover: Optional[Cover]
 ) -> None:
-    tagger = MP4(path)
+    """Tag the MP4 file at `target`, a path or a file object"""
+    tagger = MP4(target)
     tagger["\xa9nam"] = track.name
     tagger["\xa9alb"] = track.album.name
     tagger["\xa9ART"] = [artist.name for artist in track.artists]
@@ -31,14 +39,15 @@ def resolve_mp4_metadata(
             "image/jpeg": MP4Picture.FORMAT_JPEG,
         }[cover.mime]
         tagger["covr"] = [MP4Picture(cover.data, imageformat=imageformat)]
-    tagger.save()
+    _save(tagger, target)
 
 
 def resolve_flac_metadata(
-    config: dict, track: Track, path: str, cover: Optional[Cover]
+    config: dict, track: Track, target: Union[str, BinaryIO], cover: Optional[Cover]
 ) -> None:
+    """Tag the FLAC file at `target`, a path or a file object"""
     try:
-        tagger = FLAC(path)
+        tagger = FLAC(target)
     except mutagen.flac.FLACNoHeaderError:
         raise InvalidFileError()
     tagger["title"] = track.name
@@ -55,5 +64,7 @@ def resolve_flac_metadata(
         flac_picture.desc = "Cover"
         flac_picture.mime = cover.mime
         flac_picture.data = cover.data
+        # files being tagged again already have a picture
+        tagger.clear_pictures()
         tagger.add_picture(flac_picture)
-    tagger.save()
+    _save(tagger, target)
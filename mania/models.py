@@ -2,7 +2,17 @@
 since TIDAL is now the only supported back-end."""
 
 from abc import ABC, abstractmethod
-from typing import List, NamedTuple, Optional, Tuple, Type, Union
+from typing import (
+    Collection,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
 
 class ManiaException(Exception):
@@ -21,6 +31,25 @@ class UnavailableException(Exception):
     """For region-locked or otherwise unavailable items"""
 
 
+class QualityUnavailableException(UnavailableException):
+    """A track isn't available in the quality that was asked for. `quality`
+    is the best quality it is available in, and `stream` its stream in that
+    quality, if it was resolved along the way."""
+
+    def __init__(self, quality: str, stream: Optional["Stream"] = None):
+        super().__init__(f"Only available in {quality} quality")
+        self.quality = quality
+        self.stream = stream
+
+
+class IncompleteDownloadError(Exception):
+    """A transfer ended before all of the data arrived"""
+
+
+class StallError(Exception):
+    """A transfer slowed to a crawl"""
+
+
 class Artist(NamedTuple):
     """A musical artist"""
 
@@ -33,7 +62,7 @@ class Album(NamedTuple):
 
     id: str
     name: str
-    artists: List[Artist]
+    artists: Tuple[Artist, ...]
     year: Optional[str]
     explicit: bool
     cover_url: Optional[str]
@@ -54,7 +83,7 @@ class Track(NamedTuple):
 
     id: str
     name: str
-    artists: List[Artist]
+    artists: Tuple[Artist, ...]
     album: Album
     explicit: bool
     track_number: int
@@ -62,9 +91,11 @@ class Track(NamedTuple):
     chosen_quality: str
     best_available_quality: str
     replay_gain: Optional[float]
+    duration: Optional[int]
+    isrc: Optional[str]
     file_extension: str
 
-    def format_dict(self, maximum_track_number=0):
+    def format_dict(self, maximum_track_number=0, album_format_dict=None):
         track_number = str(self.track_number).zfill(len(str(maximum_track_number)))
         return {
             "track_id": self.id,
@@ -72,19 +103,63 @@ class Track(NamedTuple):
             "track_artists": ", ".join(artist.name for artist in self.artists),
             "track_first_artist": self.artists[0].name,
             "track_number": track_number,
-            **self.album.format_dict(),
+            **(album_format_dict or self.album.format_dict()),
         }
 
 
-Media = Union[Track, Album, Artist]
-MediaType = Union[Type[Track], Type[Album], Type[Artist]]
+class Stream(NamedTuple):
+    """Where to download a track's audio from. The file is the concatenation
+    of everything at `urls`, in order: a single URL for most tracks, or many
+    segments for some. Encrypted streams come with an AES-CTR key and nonce."""
+
+    urls: Tuple[str, ...]
+    mime_type: str
+    codecs: str
+    key: Optional[bytes] = None
+    nonce: Optional[bytes] = None
+
+    @property
+    def segmented(self) -> bool:
+        return len(self.urls) > 1
+
+    @property
+    def encrypted(self) -> bool:
+        return self.key is not None
+
+
+class Playlist(NamedTuple):
+    """A user-curated list of tracks"""
+
+    id: str
+    name: str
+    number_of_tracks: Optional[int]
+
+
+class Mix(NamedTuple):
+    """A generated list of tracks, such as a radio station or daily mix"""
+
+    id: str
+    name: str
+
+
+Media = Union[Track, Album, Artist, Playlist, Mix]
+MediaType = Union[Type[Track], Type[Album], Type[Artist], Type[Playlist], Type[Mix]]
+
+
+class Lookup(NamedTuple):
+    """The results of looking up several IDs at once. `items` has one entry
+    per ID asked for, in the same order, which is None for IDs that weren't
+    found; `missing` lists those IDs."""
+
+    items: List[Optional[Media]]
+    missing: List[str]
 
 
 class Client(ABC):
     """An abstract streaming service client"""
 
     @abstractmethod
-    def search(self, query: str, media_type: MediaType, count: int):
+    def search(self, query: str, media_type: MediaType, count: int, offset: int = 0):
         pass
 
     @abstractmethod
@@ -100,7 +175,29 @@ class Client(ABC):
         pass
 
     @abstractmethod
-    def get_media(self, track: Track) -> str:
+    def get_playlist_tracks(self, playlist: Playlist) -> Iterator[Track]:
+        pass
+
+    @abstractmethod
+    def get_mix_tracks(self, mix: Mix) -> Iterator[Track]:
+        pass
+
+    @abstractmethod
+    def get_favorite_tracks(self, exclude_ids: Collection[str] = ()) -> Iterator[Track]:
+        pass
+
+    @abstractmethod
+    def get_favorite_albums(self, exclude_ids: Collection[str] = ()) -> Iterator[Album]:
+        pass
+
+    @abstractmethod
+    def get_favorite_artists(
+        self, exclude_ids: Collection[str] = ()
+    ) -> Iterator[Artist]:
+        pass
+
+    @abstractmethod
+    def get_media(self, track: Track) -> Stream:
         pass
 
     @abstractmethod
@@ -115,6 +212,26 @@ class Client(ABC):
     def get_track_by_id(self, track_id: str):
         pass
 
+    @abstractmethod
+    def get_artists_by_ids(self, artist_ids: Sequence[str]) -> Lookup:
+        pass
+
+    @abstractmethod
+    def get_albums_by_ids(self, album_ids: Sequence[str]) -> Lookup:
+        pass
+
+    @abstractmethod
+    def get_tracks_by_ids(self, track_ids: Sequence[str]) -> Lookup:
+        pass
+
+    @abstractmethod
+    def get_playlist_by_id(self, playlist_id: str):
+        pass
+
+    @abstractmethod
+    def get_mix_by_id(self, mix_id: str):
+        pass
+
     @abstractmethod
     def resolve_url(self, url: str) -> Tuple[MediaType, Optional[Media]]:
         pass
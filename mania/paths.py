@@ -0,0 +1,117 @@
+"""Filesystem paths for downloaded tracks"""
+
+from functools import lru_cache
+from typing import Dict, List
+import os
+
+from . import constants
+from .models import Album, Track
+
+
+@lru_cache(maxsize=None)
+def get_name_max(directory: str) -> int:
+    """Get the maximum filename length (bytes) on the filesystem holding
+    `directory`. Cached, since it doesn't change during a run."""
+    return os.statvfs(directory).f_namemax
+
+
+def sanitize(config: dict, string: str, length_padding: int = 0) -> str:
+    """Sanitize a string for use as a filesystem path"""
+    if config["nice-format"]:
+        alphanumeric = "".join(c for c in string if c.isalnum() or c in (" ", "-"))
+        hyphenated = alphanumeric.replace(" ", "-")
+        sanitized = "-".join(word for word in hyphenated.split("-") if word).lower()
+    else:
+        illegal_characters = frozenset("/")
+        sanitized = "".join(c for c in string if c not in illegal_characters)
+
+    max_length = get_name_max(config["output-directory"])
+
+    # truncate unicode string to a byte count
+    encoded = sanitized.encode("utf-8")[: max_length - length_padding]
+    return encoded.decode("utf-8", "ignore")
+
+
+def remove_empty_directories(root: str, directory: str) -> None:
+    """Remove `directory` and its parents, up to but not including `root`, as
+    long as they're empty"""
+    root = os.path.abspath(root)
+    directory = os.path.abspath(directory)
+    while directory != root and directory.startswith(root + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+
+class AlbumPathPlanner:
+    """Computes the paths of all tracks in an album. Everything shared by the
+    album (padding widths, the artist and album directories) is worked out
+    once up front instead of once per track."""
+
+    def __init__(
+        self,
+        config: dict,
+        album: Album,
+        tracks: List[Track],
+        include_artist: bool = False,
+        include_album: bool = False,
+    ):
+        self._config = config
+        self._tracks = tracks
+        self.include_artist = include_artist
+        self.include_album = include_album
+
+        artist_path = ""
+        album_path = ""
+        if include_artist or config["full-structure"]:
+            artist_path = sanitize(config, album.artists[0].name)
+            album_format_string = config["album-format"]
+        else:
+            album_format_string = config["individual-album-format"]
+
+        self._album_format_dict = album.format_dict()
+        maximum_disc_number = max(track.disc_number for track in tracks)
+        self._maximum_track_number = max(track.track_number for track in tracks)
+        self._disc_paths: Dict[int, str] = {}
+        if include_album or config["full-structure"]:
+            if maximum_disc_number > 1:
+                disc_width = len(str(maximum_disc_number))
+                self._disc_paths = {
+                    disc_number: sanitize(
+                        config, f"Disc {str(disc_number).zfill(disc_width)}"
+                    )
+                    for disc_number in {track.disc_number for track in tracks}
+                }
+            album_formatted = album_format_string.format(**self._album_format_dict)
+            album_path = sanitize(config, album_formatted)
+            self._track_format_string = config["track-format"]
+        else:
+            self._track_format_string = config["individual-track-format"]
+
+        self._album_directory = os.path.join(
+            config["output-directory"], artist_path, album_path
+        )
+
+    def track_path(self, track: Track) -> str:
+        """Get the path of `track`, without a file extension"""
+        temporary_extension = f".{constants.TEMPORARY_EXTENSION}.{track.file_extension}"
+        track_format_dict = track.format_dict(
+            maximum_track_number=self._maximum_track_number,
+            album_format_dict=self._album_format_dict,
+        )
+        track_path = sanitize(
+            self._config,
+            self._track_format_string.format(**track_format_dict),
+            length_padding=len(temporary_extension),
+        )
+        return os.path.join(
+            self._album_directory,
+            self._disc_paths.get(track.disc_number, ""),
+            track_path,
+        )
+
+    def track_paths(self) -> List[str]:
+        """Get the paths of every track in the album, in order"""
+        return [self.track_path(track) for track in self._tracks]
@@ -0,0 +1,98 @@
+"""Resolving playback URLs ahead of the downloads that need them"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, Tuple
+import threading
+import time
+
+from . import constants
+from .models import Client, Stream, Track
+
+
+class MediaPrefetcher:
+    """Resolves the streams of upcoming tracks in the background, at most
+    `media-lookahead` at a time, so a download doesn't have to wait for a
+    playbackinfopostpaywall round trip before it can start.
+
+    Has the same get_media method as a Client, so it can be used in place of
+    one. Streams that were resolved too long ago to be trusted are resolved
+    again, and tracks found to be unavailable raise UnavailableException
+    without any further requests."""
+
+    def __init__(self, client: Client, config: dict):
+        self._client = client
+        self._transfer = config["transfer"]
+        self._lookahead = int(config["media-lookahead"])
+        self._upcoming: Deque[Track] = deque()
+        self._resolving: Dict[str, Tuple[Track, Future]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(self._lookahead, 1))
+
+    def __enter__(self) -> "MediaPrefetcher":
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        with self._lock:
+            self._upcoming.clear()
+            for _, future in self._resolving.values():
+                future.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _resolve(self, track: Track) -> Tuple[Stream, float]:
+        stream = self._client.get_media(track)
+        resolved_at = time.monotonic()
+        # the first stream from a CDN host opens connections to it for the
+        # downloads to come
+        self._transfer.warm(stream.urls[0])
+        return stream, resolved_at
+
+    def _fill(self) -> None:
+        with self._lock:
+            while self._upcoming and len(self._resolving) < self._lookahead:
+                track = self._upcoming.popleft()
+                if track.id not in self._resolving:
+                    future = self._executor.submit(self._resolve, track)
+                    self._resolving[track.id] = (track, future)
+
+    def expect(self, tracks: Iterable[Track]) -> None:
+        """Queue up tracks that are going to be downloaded, in order. Tracks
+        that were already peeked at are left out."""
+        with self._lock:
+            self._upcoming.extend(
+                track for track in tracks if track.id not in self._resolving
+            )
+        self._fill()
+
+    def discard(self, track: Track) -> None:
+        """Forget a track that won't be downloaded after all"""
+        with self._lock:
+            if self._resolving.pop(track.id, None) is None and track in self._upcoming:
+                self._upcoming.remove(track)
+        self._fill()
+
+    def peek(self, track: Track) -> Stream:
+        """Resolve the stream of `track` now, or wait for it if it's already
+        being resolved, and keep it for get_media"""
+        with self._lock:
+            _, future = self._resolving.get(track.id, (None, None))
+            if future is None:
+                if track in self._upcoming:
+                    self._upcoming.remove(track)
+                future = self._executor.submit(self._resolve, track)
+                self._resolving[track.id] = (track, future)
+        stream, _ = future.result()
+        return stream
+
+    def get_media(self, track: Track) -> Stream:
+        with self._lock:
+            _, future = self._resolving.pop(track.id, (None, None))
+            if future is None and track in self._upcoming:
+                self._upcoming.remove(track)
+        self._fill()
+        if future is None:
+            return self._client.get_media(track)
+        stream, resolved_at = future.result()
+        if time.monotonic() - resolved_at > constants.MEDIA_URL_LIFETIME:
+            return self._client.get_media(track)
+        return stream
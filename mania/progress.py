@@ -0,0 +1,243 @@
+"""Reporting the progress of downloads, either as progress bars or as a
+stream of NDJSON events for other programs to read"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, IO, Optional
+import json
+import os
+import sys
+import threading
+import time
+
+from tqdm import tqdm
+
+from . import constants
+from .models import Track
+
+
+class Progress:
+    """Receives download events. Transfers only bump counters; anything that
+    draws or writes happens on a timer, every PROGRESS_INTERVAL seconds. This
+    base class ignores everything, for when progress isn't shown."""
+
+    def queued(self, track: Track) -> None:
+        pass
+
+    def started(self, track: Track) -> None:
+        pass
+
+    def resize(self, track: Track, total: int) -> None:
+        pass
+
+    def advance(self, track: Track, amount: int) -> None:
+        pass
+
+    def finished(self, track: Track, path: str) -> None:
+        pass
+
+    def skipped(self, track: Track, reason: str) -> None:
+        pass
+
+    def failed(self, track: Track, error: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _Transfer:
+    def __init__(self, track: Track):
+        self.track = track
+        self.total: Optional[int] = None
+        self.done = 0
+        self.reported = -1
+        self.ended = False
+        self.bar: Optional[tqdm] = None
+
+
+class _TimedProgress(Progress, ABC):
+    """Keeps track of active transfers and calls _tick periodically from a
+    background thread, started when the first track is queued"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._transfers: Dict[str, _Transfer] = {}
+        self._stop = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+
+    def _ensure_timer(self) -> None:
+        if self._timer is None:
+            self._timer = threading.Thread(target=self._run, daemon=True)
+            self._timer.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(constants.PROGRESS_INTERVAL):
+            with self._lock:
+                self._tick()
+
+    @abstractmethod
+    def _tick(self) -> None:
+        """Draw or write the progress of the active transfers, with the lock
+        held"""
+
+    def started(self, track: Track) -> None:
+        with self._lock:
+            self._ensure_timer()
+            self._transfers[track.id] = _Transfer(track)
+
+    def resize(self, track: Track, total: int) -> None:
+        self._transfers[track.id].total = total
+
+    def advance(self, track: Track, amount: int) -> None:
+        # only the thread downloading `track` touches its counter, so there's
+        # no need to lock
+        self._transfers[track.id].done += amount
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        with self._lock:
+            self._tick()
+
+
+class BarProgress(_TimedProgress):
+    """One bar for the whole run plus a bar for each active transfer"""
+
+    def __init__(self):
+        super().__init__()
+        self._overall: Optional[tqdm] = None
+        self._total = 0
+        self._completed = 0
+
+    def queued(self, track: Track) -> None:
+        with self._lock:
+            self._ensure_timer()
+            self._total += 1
+            if self._overall is None:
+                self._overall = tqdm(unit="track", position=0, dynamic_ncols=True)
+
+    def _complete(self, track: Track) -> None:
+        # the transfer's bar is closed on the next tick
+        with self._lock:
+            transfer = self._transfers.get(track.id)
+            if transfer is not None:
+                transfer.ended = True
+            self._completed += 1
+
+    def finished(self, track: Track, path: str) -> None:
+        self._complete(track)
+
+    def skipped(self, track: Track, reason: str) -> None:
+        self._complete(track)
+
+    def failed(self, track: Track, error: str) -> None:
+        self._complete(track)
+
+    def _tick(self) -> None:
+        if self._overall is None:
+            return
+        self._overall.total = self._total
+        self._overall.n = self._completed
+        self._overall.refresh()
+
+        for track_id, transfer in list(self._transfers.items()):
+            if transfer.ended:
+                if transfer.bar is not None:
+                    transfer.bar.close()
+                del self._transfers[track_id]
+                continue
+            if transfer.bar is None:
+                transfer.bar = tqdm(
+                    desc=transfer.track.name[:32],
+                    leave=False,
+                    unit="B",
+                    unit_divisor=1024,
+                    unit_scale=True,
+                    dynamic_ncols=True,
+                )
+            transfer.bar.total = transfer.total
+            transfer.bar.n = transfer.done
+            transfer.bar.refresh()
+
+    def close(self) -> None:
+        super().close()
+        if self._overall is not None:
+            self._overall.close()
+
+
+class JsonProgress(_TimedProgress):
+    """Writes one JSON object per line for each event. Byte counts of active
+    transfers are written on the timer, when they've changed."""
+
+    def __init__(self, output: IO[str]):
+        super().__init__()
+        self._output = output
+        self._output_lock = threading.Lock()
+
+    def _emit(self, event: str, track: Track, **fields) -> None:
+        line = json.dumps(
+            {
+                "event": event,
+                "time": time.time(),
+                "track_id": track.id,
+                "track_name": track.name,
+                **fields,
+            }
+        )
+        with self._output_lock:
+            self._output.write(line + "\n")
+            self._output.flush()
+
+    def queued(self, track: Track) -> None:
+        self._emit("queued", track)
+
+    def started(self, track: Track) -> None:
+        super().started(track)
+        self._emit("started", track)
+
+    def _report_bytes(self, transfer: _Transfer) -> None:
+        if transfer.done != transfer.reported:
+            transfer.reported = transfer.done
+            self._emit(
+                "bytes", transfer.track, bytes=transfer.done, total=transfer.total
+            )
+
+    def _finish(self, track: Track, event: str, **fields) -> None:
+        # the final byte count goes out before the event that ends the transfer
+        with self._lock:
+            transfer = self._transfers.pop(track.id, None)
+            if transfer is not None:
+                self._report_bytes(transfer)
+        self._emit(event, track, **fields)
+
+    def finished(self, track: Track, path: str) -> None:
+        self._finish(track, "finished", path=path)
+
+    def skipped(self, track: Track, reason: str) -> None:
+        self._finish(track, "skipped", reason=reason)
+
+    def failed(self, track: Track, error: str) -> None:
+        self._finish(track, "failed", error=error)
+
+    def _tick(self) -> None:
+        for transfer in self._transfers.values():
+            self._report_bytes(transfer)
+
+
+def make_progress(config: dict) -> Progress:
+    if config["progress"] == "json":
+        descriptor = int(config["progress-fd"])
+        output = (
+            sys.stdout
+            if descriptor == 1
+            else os.fdopen(descriptor, "w", buffering=1, closefd=False)
+        )
+        return JsonProgress(output)
+    if config["progress"] == "bar" and not config["quiet"]:
+        return BarProgress()
+    if config["progress"] not in ("bar", "none"):
+        raise ValueError(
+            f'Unknown progress display "{config["progress"]}". Try "bar", "json" or "none".'
+        )
+    return Progress()
@@ -0,0 +1,64 @@
+"""Picking the search result that best matches a query"""
+
+from difflib import SequenceMatcher
+from typing import List, Sequence, Tuple
+import unicodedata
+
+from .models import Album, Artist, Media, Playlist, Track
+
+# how much matching every word of the query counts, against the result's
+# name having no words the query didn't ask for
+COVERAGE_WEIGHT = 0.8
+
+
+def words(text: str) -> List[str]:
+    """Split `text` into lowercase words without accents or punctuation"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    cleaned = "".join(
+        c if c.isalnum() else " " for c in decomposed if not unicodedata.combining(c)
+    )
+    return cleaned.split()
+
+
+def _similarity(word: str, others: Sequence[str]) -> float:
+    return max(SequenceMatcher(None, word, other).ratio() for other in others)
+
+
+def describe(result: Media) -> Tuple[str, str]:
+    """The name of a search result, and everything else a query might mention
+    about it"""
+    if isinstance(result, Track):
+        artists = " ".join(artist.name for artist in result.artists)
+        return result.name, f"{artists} {result.album.name}"
+    if isinstance(result, Album):
+        return result.name, " ".join(artist.name for artist in result.artists)
+    if isinstance(result, (Artist, Playlist)):
+        return result.name, ""
+    return getattr(result, "name", ""), ""
+
+
+def match_score(query: str, result: Media) -> float:
+    """Score from 0 to 1 how well `result` matches `query`. Every word of the
+    query should appear, possibly misspelled, somewhere in the result, and
+    the result's name shouldn't have much else, such as "Live" or "Remix"."""
+    query_words = words(query)
+    name, details = describe(result)
+    name_words = words(name)
+    if not query_words or not name_words:
+        return 0.0
+    coverage = sum(
+        _similarity(word, name_words + words(details)) for word in query_words
+    ) / len(query_words)
+    precision = sum(_similarity(word, query_words) for word in name_words) / len(
+        name_words
+    )
+    return COVERAGE_WEIGHT * coverage + (1 - COVERAGE_WEIGHT) * precision
+
+
+def best_match(query: str, results: Sequence[Media]) -> Media:
+    """The result that best matches `query`. Ties go to the result TIDAL
+    ranked higher."""
+    return max(
+        enumerate(results),
+        key=lambda item: (match_score(query, item[1]), -item[0]),
+    )[1]
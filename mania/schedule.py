@@ -0,0 +1,161 @@
+"""Ordering downloads so that a run with several workers finishes early"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import heapq
+import itertools
+import threading
+
+from . import constants
+from .models import Stream, Track
+from .prefetch import MediaPrefetcher
+from .transfer import TransferClient
+
+DOWNLOAD_ORDERS = frozenset(("largest-first", "listing"))
+
+
+def parse_download_order(order: str) -> bool:
+    """Check a `download-order` option, returning whether it orders by size"""
+    if order not in DOWNLOAD_ORDERS:
+        raise ValueError(
+            f'Unknown download order "{order}". Try "largest-first" or "listing".'
+        )
+    return order == "largest-first"
+
+
+def estimated_size(track: Track) -> int:
+    """Guess the size of a track from its duration and quality"""
+    byte_rate = constants.ESTIMATED_BYTE_RATES[track.chosen_quality]
+    return (track.duration or 0) * byte_rate
+
+
+def probe_size(
+    transfer: TransferClient, stream: Stream, timeout: Tuple[float, float]
+) -> Optional[int]:
+    """Find the exact size of a stream with a HEAD request. A segmented
+    stream would take a request per segment, so its size is left unknown."""
+    if stream.segmented:
+        return None
+    response = transfer.head(stream.urls[0], allow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    content_length = response.headers.get("Content-Length")
+    return int(content_length) if content_length is not None else None
+
+
+def probe_sizes(
+    transfer: TransferClient,
+    prefetcher: MediaPrefetcher,
+    tracks: Iterable[Track],
+    concurrency: int,
+    timeout: Tuple[float, float],
+) -> Dict[str, int]:
+    """Find the exact sizes of `tracks`, by track ID. Their streams are
+    resolved through `prefetcher`, which keeps them for the downloads. Tracks
+    whose size can't be found are left out."""
+
+    def probe(track: Track) -> Tuple[str, Optional[int]]:
+        try:
+            return track.id, probe_size(transfer, prefetcher.peek(track), timeout)
+        except Exception:
+            # the download runs into the same problem and reports it
+            return track.id, None
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        return {
+            track_id: size
+            for track_id, size in executor.map(probe, tracks)
+            if size is not None
+        }
+
+
+class Job(NamedTuple):
+    """A download for a DownloadScheduler: `run` downloads `track`. Without a
+    `size`, one is estimated from the track's duration and quality. Jobs with
+    a higher `priority` go before any job with a lower one, whatever their
+    size."""
+
+    run: Callable[[], Any]
+    track: Track
+    size: Optional[int] = None
+    priority: int = 0
+
+
+class DownloadScheduler:
+    """Runs download jobs `concurrency` at a time, in the order that gets
+    them all done soonest.
+
+    A run lasts until its last job is done, so a long hi-res track that starts
+    last keeps one worker busy while the others sit idle. Instead, a worker
+    that frees up takes the largest job waiting, leaving the small ones to
+    even out the finish. A single worker finishes at the same time whatever
+    the order, so it runs jobs in the order they were submitted, as
+    `download-order = "listing"` does. Either way, jobs with a higher
+    priority run first."""
+
+    def __init__(self, config: dict):
+        concurrency = int(config["concurrency"])
+        self.by_size = (
+            parse_download_order(config["download-order"]) and concurrency > 1
+        )
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._waiting: List[Tuple[int, int, int, Future, Callable[[], Any]]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "DownloadScheduler":
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _key(self, job: Job) -> Tuple[int, int]:
+        if not self.by_size:
+            return -job.priority, 0
+        size = job.size if job.size is not None else estimated_size(job.track)
+        return -job.priority, -size
+
+    def order(self, jobs: Iterable[Job]) -> List[Job]:
+        """`jobs` in the order they'd run if they were all submitted at once"""
+        return sorted(jobs, key=self._key)
+
+    def submit(
+        self,
+        job: Callable[[], Any],
+        track: Track,
+        size: Optional[int] = None,
+        priority: int = 0,
+    ) -> Future:
+        """Queue up `job`, which downloads `track`"""
+        (future,) = self.submit_all([Job(job, track, size, priority)])
+        return future
+
+    def submit_all(self, jobs: Iterable[Job]) -> List[Future]:
+        """Queue up every job in `jobs` before any of them starts, so the
+        first ones to run are the best of the whole batch, not just of those
+        submitted so far"""
+        futures = []
+        with self._lock:
+            for job in jobs:
+                future: Future = Future()
+                heapq.heappush(
+                    self._waiting,
+                    (*self._key(job), next(self._sequence), future, job.run),
+                )
+                futures.append(future)
+        # each job adds one run to the pool; whichever job is best when a
+        # worker frees up is the one that runs
+        for _ in futures:
+            self._executor.submit(self._run_next)
+        return futures
+
+    def _run_next(self) -> None:
+        with self._lock:
+            *_, future, job = heapq.heappop(self._waiting)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = job()
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
@@ -0,0 +1,134 @@
+"""Downloading to a fast staging directory and moving finished files to the
+output directory in the background"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Set
+import errno
+import os
+import shutil
+import threading
+
+from . import constants
+from .models import ManiaSeriousException
+from .paths import remove_empty_directories
+from .throttle import parse_size
+
+
+def _fsync_directory(directory: str) -> None:
+    if not hasattr(os, "O_DIRECTORY"):
+        # directories can't be opened, or synced, on Windows
+        return
+    descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def move_file(source: str, destination: str) -> None:
+    """Move `source` to `destination`. Across filesystems, the file is copied
+    next to its destination, synced and renamed into place, so a crash never
+    leaves a partial file at `destination`."""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.rename(source, destination)
+        return
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    temporary_path = f"{destination}.{constants.TEMPORARY_EXTENSION}"
+    try:
+        with open(source, "rb") as source_file, open(
+            temporary_path, "wb"
+        ) as temporary_file:
+            shutil.copyfileobj(source_file, temporary_file, constants.VERIFY_CHUNK_SIZE)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        shutil.copystat(source, temporary_path)
+        os.replace(temporary_path, destination)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    _fsync_directory(os.path.dirname(destination))
+    os.remove(source)
+
+
+class StagingMover:
+    """Moves finished files from the staging directory to the output
+    directory, `mover-concurrency` at a time. Downloads wait for the mover
+    when the files waiting to be moved take up more than `max-staging-size`,
+    so a slow output directory can't fill up the staging disk."""
+
+    def __init__(self, config: dict):
+        self.staging_directory = os.path.expanduser(config["staging-directory"])
+        self._output_directory = config["output-directory"]
+        self._max_size = parse_size(config["max-staging-size"])
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(int(config["mover-concurrency"]), 1)
+        )
+        self._condition = threading.Condition()
+        self._staged_size = 0
+        self._pending: Set[str] = set()
+        self._failures: List[str] = []
+
+    def staging_path(self, path: str) -> str:
+        """Where to stage a file that belongs at `path` in the output
+        directory"""
+        return os.path.join(
+            self.staging_directory, os.path.relpath(path, self._output_directory)
+        )
+
+    def is_pending(self, destination: str) -> bool:
+        with self._condition:
+            return destination in self._pending
+
+    def wait_for_space(self) -> None:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._max_size <= 0 or self._staged_size < self._max_size
+            )
+
+    def move(self, source: str, destination: str, on_moved: Callable[[], None]) -> None:
+        """Move `source` to `destination` in the background and call
+        `on_moved` once it's there"""
+        size = os.path.getsize(source)
+        with self._condition:
+            self._staged_size += size
+            self._pending.add(destination)
+        self._executor.submit(self._move, source, destination, size, on_moved)
+
+    def _move(
+        self, source: str, destination: str, size: int, on_moved: Callable[[], None]
+    ) -> None:
+        try:
+            move_file(source, destination)
+            on_moved()
+        except Exception as error:
+            # nothing waits on the move, so errors are reported by close()
+            with self._condition:
+                self._failures.append(f"{source}: {error}")
+        finally:
+            # a file that couldn't be moved stays put, but isn't waited on
+            with self._condition:
+                self._staged_size -= size
+                self._pending.discard(destination)
+                self._condition.notify_all()
+
+    def wait(self) -> None:
+        """Wait for the moves queued so far to finish"""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._pending)
+
+    def close(self) -> None:
+        """Wait for every move to finish"""
+        self._executor.shutdown(wait=True)
+        # empty directories are only cleaned up now, since downloads in
+        # progress may be about to use them
+        for directory, _, _ in os.walk(self.staging_directory, topdown=False):
+            remove_empty_directories(self.staging_directory, directory)
+        if self._failures:
+            raise ManiaSeriousException(
+                f"{len(self._failures)} file(s) couldn't be moved out of the staging directory, and are still there:\n"
+                + "\n".join(self._failures)
+            )
@@ -0,0 +1,25 @@
+"""Counts of notable events during a run"""
+
+from typing import Dict, List
+import threading
+
+
+class RunStats:
+    """Named counters, shared by every thread of a run and summarized when it
+    ends. Counters that were never incremented aren't reported."""
+
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counts.get(name, 0)
+
+    def summary(self) -> List[str]:
+        with self._lock:
+            return [f"{name}: {count}" for name, count in self._counts.items()]
@@ -0,0 +1,367 @@
+"""Where downloaded files end up: the local filesystem, or an S3-compatible
+object store"""
+
+from abc import ABC, abstractmethod
+from typing import cast, BinaryIO, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import quote
+from xml.etree import ElementTree
+import datetime
+import hashlib
+import hmac
+import io
+import os
+
+import requests
+
+from . import constants
+from .throttle import parse_size
+
+STORAGE_KINDS = frozenset(("local", "s3"))
+# S3 refuses parts smaller than this, except for the last one
+MINIMUM_PART_SIZE = 5 * 1024 * 1024
+
+# tags a file given its path, or a file object holding its start
+Tagger = Callable[[Union[str, BinaryIO]], None]
+
+
+class StorageWriter(ABC):
+    """A file being written to storage. Nothing is visible at its path until
+    it's committed."""
+
+    @abstractmethod
+    def write(self, chunk: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def tag(self, tagger: Tagger) -> None:
+        """Let `tagger` rewrite the file's metadata, once everything has been
+        written"""
+
+    @abstractmethod
+    def commit(self, on_stored: Callable[[], None]) -> None:
+        """Put the file in place, and call `on_stored` once it's there, which
+        may be later, from another thread"""
+
+    @abstractmethod
+    def abort(self) -> None:
+        """Throw away everything written so far"""
+
+
+class Storage(ABC):
+    """Stores files at paths inside the output directory"""
+
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        pass
+
+    @abstractmethod
+    def open(self, path: str) -> StorageWriter:
+        pass
+
+    def wait_for_space(self) -> None:
+        """Wait until there's room for another file, if space is limited"""
+
+
+class LocalWriter(StorageWriter):
+    def __init__(self, storage: "LocalStorage", path: str):
+        self._storage = storage
+        self._path = path
+        staged_path = storage.staged_path(path)
+        base, extension = os.path.splitext(staged_path)
+        self._staged_path = staged_path
+        self._temporary_path = f"{base}.{constants.TEMPORARY_EXTENSION}{extension}"
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        self._file = open(self._temporary_path, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+
+    def tag(self, tagger: Tagger) -> None:
+        self._file.close()
+        tagger(self._temporary_path)
+
+    def commit(self, on_stored: Callable[[], None]) -> None:
+        self._file.close()
+        os.rename(self._temporary_path, self._staged_path)
+        mover = self._storage.mover
+        if mover is None:
+            on_stored()
+        else:
+            mover.move(self._staged_path, self._path, on_moved=on_stored)
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self._temporary_path):
+            os.remove(self._temporary_path)
+
+
+class LocalStorage(Storage):
+    """Files are written next to where they belong and renamed into place.
+    With a staging directory, they're written and tagged there instead, and
+    then moved to the output directory in the background."""
+
+    def __init__(self, config: dict):
+        self.mover = config["staging-mover"]
+
+    def staged_path(self, path: str) -> str:
+        return path if self.mover is None else self.mover.staging_path(path)
+
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(path) or (
+            self.mover is not None and self.mover.is_pending(path)
+        )
+
+    def open(self, path: str) -> StorageWriter:
+        return LocalWriter(self, path)
+
+    def wait_for_space(self) -> None:
+        if self.mover is not None:
+            self.mover.wait_for_space()
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+def sign_request(
+    method: str,
+    path: str,
+    query: Dict[str, str],
+    headers: Dict[str, str],
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    now: datetime.datetime,
+) -> Tuple[str, Dict[str, str]]:
+    """Sign a request to S3 with AWS Signature Version 4. `headers` must
+    include Host. Returns the canonical query string to send and the headers
+    with the signature added."""
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    date = amz_date[:8]
+    headers = {
+        **headers,
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": amz_date,
+    }
+    canonical_query = "&".join(
+        f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}"
+        for key, value in sorted(query.items())
+    )
+    canonical_headers = {
+        name.lower(): " ".join(value.split()) for name, value in headers.items()
+    }
+    signed_headers = ";".join(sorted(canonical_headers))
+    canonical_request = "\n".join(
+        (
+            method,
+            quote(path, safe="/-_.~"),
+            canonical_query,
+            "".join(
+                f"{name}:{canonical_headers[name]}\n"
+                for name in sorted(canonical_headers)
+            ),
+            signed_headers,
+            payload_hash,
+        )
+    )
+    scope = f"{date}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join(
+        (
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        )
+    )
+    signing_key = f"AWS4{secret_key}".encode("utf-8")
+    for part in (date, region, "s3", "aws4_request"):
+        signing_key = _hmac(signing_key, part)
+    signature = hmac.new(
+        signing_key, string_to_sign.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    headers["Authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return canonical_query, headers
+
+
+class ObjectWriter(StorageWriter):
+    """Uploads a file with a multipart upload as it's written, so at most two
+    parts are ever held in memory and nothing touches the disk.
+
+    Tags live at the start of a file, so the first part is held back until
+    the file has been tagged and uploaded last. Files that fit in one part
+    are uploaded whole with a single request."""
+
+    def __init__(self, storage: "ObjectStorage", key: str):
+        self._storage = storage
+        self._key = key
+        self._head: Optional[bytes] = None
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._etags: Dict[int, str] = {}
+
+    def _upload_part(self, number: int, data: bytes) -> None:
+        if self._upload_id is None:
+            response = self._storage.request("POST", self._key, query={"uploads": ""})
+            self._upload_id = _find_text(response.content, "UploadId")
+        response = self._storage.request(
+            "PUT",
+            self._key,
+            query={"partNumber": str(number), "uploadId": self._upload_id},
+            data=data,
+        )
+        self._etags[number] = response.headers["ETag"]
+
+    def write(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        part_size = self._storage.part_size
+        while len(self._buffer) >= part_size:
+            part = bytes(self._buffer[:part_size])
+            del self._buffer[:part_size]
+            if self._head is None:
+                self._head = part
+            else:
+                self._upload_part(len(self._etags) + 2, part)
+
+    def tag(self, tagger: Tagger) -> None:
+        if self._head is None:
+            # the whole file is still in memory
+            self._head, self._buffer = bytes(self._buffer), bytearray()
+        head_file = io.BytesIO(self._head)
+        tagger(head_file)
+        self._head = head_file.getvalue()
+
+    def commit(self, on_stored: Callable[[], None]) -> None:
+        if self._upload_id is None:
+            self._storage.request(
+                "PUT", self._key, data=(self._head or b"") + bytes(self._buffer)
+            )
+        else:
+            if self._buffer:
+                self._upload_part(len(self._etags) + 2, bytes(self._buffer))
+            self._upload_part(1, cast(bytes, self._head))
+            parts = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in sorted(self._etags.items())
+            )
+            response = self._storage.request(
+                "POST",
+                self._key,
+                query={"uploadId": self._upload_id},
+                data=(
+                    "<CompleteMultipartUpload>"
+                    f"{parts}</CompleteMultipartUpload>".encode("utf-8")
+                ),
+            )
+            # S3 can report a failure to complete with a 200 response
+            if b"<Error>" in response.content:
+                raise requests.exceptions.HTTPError(
+                    f"Couldn't complete the upload of {self._key}: "
+                    f"{_find_text(response.content, 'Message')}",
+                    response=response,
+                )
+        on_stored()
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            self._storage.request(
+                "DELETE", self._key, query={"uploadId": self._upload_id}
+            )
+            self._upload_id = None
+
+
+def _find_text(xml: bytes, tag: str) -> str:
+    """Find the text of the first `tag` element in an S3 response, whatever
+    its namespace"""
+    for element in ElementTree.fromstring(xml).iter():
+        if element.tag == tag or element.tag.endswith(f"}}{tag}"):
+            return element.text or ""
+    raise ValueError(f"No {tag} in the response from the object store.")
+
+
+class ObjectStorage(Storage):
+    """Stores files in a bucket of an S3-compatible object store, under keys
+    made of `storage-prefix` and their paths relative to the output
+    directory. Credentials are taken from the AWS_ACCESS_KEY_ID and
+    AWS_SECRET_ACCESS_KEY environment variables."""
+
+    def __init__(self, config: dict):
+        if not config["storage-endpoint"] or not config["storage-bucket"]:
+            raise ValueError(
+                '"s3" storage needs a storage-endpoint and a storage-bucket.'
+            )
+        if config["staging-directory"]:
+            raise ValueError('A staging-directory can\'t be used with "s3" storage.')
+        self._endpoint = config["storage-endpoint"].rstrip("/")
+        self._host = self._endpoint.split("://", 1)[-1]
+        self._bucket = config["storage-bucket"]
+        self._prefix = config["storage-prefix"]
+        self._region = config["storage-region"]
+        self._output_directory = config["output-directory"]
+        self.part_size = max(
+            int(parse_size(config["storage-part-size"])), MINIMUM_PART_SIZE
+        )
+        self._access_key = os.environ.get("AWS_ACCESS_KEY_ID", "")
+        self._secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY", "")
+        self._timeout = (
+            float(config["connect-timeout"]),
+            float(config["read-timeout"]),
+        )
+        self._session = requests.Session()
+
+    def key(self, path: str) -> str:
+        relative_path = os.path.relpath(path, self._output_directory)
+        return self._prefix + "/".join(relative_path.split(os.sep))
+
+    def request(
+        self,
+        method: str,
+        key: str,
+        query: Optional[Dict[str, str]] = None,
+        data: bytes = b"",
+    ) -> requests.models.Response:
+        """Make a signed request about the object at `key`, raising an
+        HTTPError if it fails"""
+        path = f"/{self._bucket}/{key}"
+        query_string, headers = sign_request(
+            method,
+            path,
+            query or {},
+            {"Host": self._host},
+            hashlib.sha256(data).hexdigest(),
+            self._access_key,
+            self._secret_key,
+            self._region,
+            datetime.datetime.utcnow(),
+        )
+        url = f"{self._endpoint}{quote(path, safe='/-_.~')}"
+        if query_string:
+            url = f"{url}?{query_string}"
+        response = self._session.request(
+            method, url, data=data, headers=headers, timeout=self._timeout
+        )
+        response.raise_for_status()
+        return response
+
+    def exists(self, path: str) -> bool:
+        try:
+            self.request("HEAD", self.key(path))
+        except requests.exceptions.HTTPError as error:
+            if error.response.status_code == 404:
+                return False
+            raise error
+        return True
+
+    def open(self, path: str) -> StorageWriter:
+        return ObjectWriter(self, self.key(path))
+
+
+def make_storage(config: dict) -> Storage:
+    if config["storage"] not in STORAGE_KINDS:
+        raise ValueError(f'Unknown storage "{config["storage"]}". Try "local" or "s3".')
+    if config["storage"] == "s3":
+        return ObjectStorage(config)
+    return LocalStorage(config)
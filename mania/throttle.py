@@ -0,0 +1,159 @@
+"""Bandwidth limiting shared between concurrent transfers, and a request
+budget shared between mania processes"""
+
+import json
+import re
+import threading
+import time
+from typing import Optional, Union
+
+from . import constants
+from .locking import locked, write_atomically
+from .models import StallError
+
+SIZE_SUFFIXES = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_size(size: Union[int, float, str]) -> float:
+    """Parse a number of bytes, such as `500000`, `"800K"` or `"10M"`"""
+    if isinstance(size, (int, float)):
+        return float(size)
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*$", size, re.IGNORECASE)
+    if not match:
+        raise ValueError(f'Couldn\'t parse "{size}". Try a size like "10M".')
+    number, suffix = match.groups()
+    return float(number) * SIZE_SUFFIXES[suffix.lower()]
+
+
+def parse_rate(rate: Union[int, float, str]) -> float:
+    """Parse a rate in bytes per second, in the same units as parse_size. Zero
+    means unlimited."""
+    return parse_size(rate)
+
+
+class TokenBucket:
+    """A token bucket shared by any number of threads.
+
+    Tokens are reserved in arrival order and may go negative, in which case
+    the caller sleeps until its reservation is paid off. Since each transfer
+    only reserves one chunk at a time, concurrent transfers take turns and get
+    an equal share of the rate."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        """Take `amount` tokens from the bucket, blocking until they're
+        available"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SharedRequestBudget:
+    """A token bucket of API requests shared by every mania process on the
+    machine, so that processes running side by side don't add up to more
+    requests than TIDAL will take before answering with 429s.
+
+    The bucket's state lives in a file and is only read and written under its
+    lock. Like TokenBucket, reservations may go negative and the caller sleeps
+    them off after releasing the lock."""
+
+    def __init__(self, path: str, rate: float):
+        self.path = path
+        self.rate = rate
+        self.burst = max(rate, 1.0)
+
+    def consume(self) -> None:
+        """Take one request from the budget, blocking until it's available"""
+        with locked(self.path):
+            now = time.time()
+            try:
+                with open(self.path) as state_file:
+                    state = json.load(state_file)
+                elapsed = max(now - state["updated"], 0)
+                tokens = min(self.burst, state["tokens"] + elapsed * self.rate)
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                tokens = self.burst
+            tokens -= 1
+            write_atomically(self.path, json.dumps({"tokens": tokens, "updated": now}))
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+
+class Throttle:
+    """Separate bandwidth budgets for media streams and for everything else
+    (cover art and API responses), plus the request budget shared with other
+    processes"""
+
+    def __init__(
+        self,
+        media: Optional[TokenBucket] = None,
+        auxiliary: Optional[TokenBucket] = None,
+        requests: Optional[SharedRequestBudget] = None,
+    ):
+        self.media = media
+        self.auxiliary = auxiliary
+        self.requests = requests
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Throttle":
+        def bucket(key: str) -> Optional[TokenBucket]:
+            rate = parse_rate(config[key])
+            return TokenBucket(rate) if rate > 0 else None
+
+        request_rate = float(config["max-request-rate"])
+        requests = (
+            SharedRequestBudget(constants.REQUEST_BUDGET_PATH, request_rate)
+            if request_rate > 0
+            else None
+        )
+        return cls(bucket("max-bandwidth"), bucket("max-auxiliary-bandwidth"), requests)
+
+    def consume_request(self) -> None:
+        if self.requests is not None:
+            self.requests.consume()
+
+    def consume_media(self, amount: int) -> None:
+        if self.media is not None:
+            self.media.consume(amount)
+
+    def consume_auxiliary(self, amount: int) -> None:
+        if self.auxiliary is not None:
+            self.auxiliary.consume(amount)
+
+
+class StallWatchdog:
+    """Watches a transfer's throughput, counting only the time spent waiting
+    for the network (not time spent throttled or writing), and raises
+    StallError when it stays below `minimum_rate` for `timeout` seconds"""
+
+    def __init__(self, minimum_rate: float, timeout: float):
+        self.minimum_rate = minimum_rate
+        self.timeout = timeout
+        self._waited = 0.0
+        self._received = 0
+
+    def update(self, received: int, waited: float) -> None:
+        if self.minimum_rate <= 0 or self.timeout <= 0:
+            return
+        self._waited += waited
+        self._received += received
+        if self._waited >= self.timeout:
+            rate = self._received / self._waited
+            if rate < self.minimum_rate:
+                raise StallError(
+                    f"only {rate / 1024:.1f} KiB/s over {self._waited:.0f} seconds"
+                )
+            self._waited = 0.0
+            self._received = 0
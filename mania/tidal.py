@@ -1,28 +1,54 @@
 """Tidal authentication and API client"""
 
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
-from typing import cast, Any, Callable, Dict, List, Optional, Tuple, Type, Union
+from typing import (
+    cast,
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 from urllib.parse import urlparse
-import base64
 import datetime
 import json
 import locale
+import os
 import re
 import sys
 import time
 
 import requests
+import toml
 
+from . import constants
+from .cache import Cache
+from .coalesce import SingleFlight
+from .locking import locked, write_atomically
+from .manifest import ManifestError, parse_manifest
 from .models import (
     Track,
     Album,
     Artist,
+    Playlist,
+    Mix,
     Media,
     MediaType,
+    Stream,
     Client,
+    Lookup,
     ManiaSeriousException,
+    QualityUnavailableException,
     UnavailableException,
 )
+from .stats import RunStats
 
 LOCALE = locale.getlocale()[0]
 
@@ -35,10 +61,18 @@ DEVICE_TYPE = "TABLET"
 USER_AGENT = "TIDAL_ANDROID/1000 okhttp/3.10.0"
 CLIENT_VERSION = "2.26.1"
 MAXIMUM_LIMIT = 50
+SEARCH_TYPES = "TRACKS,ALBUMS,ARTISTS,PLAYLISTS"
 
 SPECIAL_AUDIO_MODES = frozenset(("DOLBY_ATMOS", "SONY_360RA"))
 COVER_ART_SIZE = 1280
 MAXIMUM_ATTEMPTS = 4
+DEFAULT_TIMEOUT = (10.0, 60.0)
+TIDAL_QUALITIES = {
+    "master": "HI_RES",
+    "lossless": "LOSSLESS",
+    "high": "HIGH",
+    "low": "LOW",
+}
 
 
 class TidalAuthError(Exception):
@@ -67,8 +101,39 @@ class TidalSession:
         self.refresh_token = refresh_token
         self.user_id = user_id
         self.expires = expires
+        # where the session is saved, so that token refreshes can be shared
+        # with other processes using the same file
+        self.path: Optional[str] = None
+        # the (connect, read) timeout for every request
+        self.timeout: Tuple[float, float] = DEFAULT_TIMEOUT
+        # counts timeouts, when set
+        self.stats: Optional[RunStats] = None
         self._session = requests.Session()
 
+    @classmethod
+    def load(cls, path: str) -> "TidalSession":
+        """Load a session saved with `save`"""
+        with locked(path), open(path, "r") as session_file:
+            session = cls(**toml.load(session_file))
+        session.path = path
+        return session
+
+    def save(self, path: str) -> None:
+        """Save the session to `path`, unless another process has since saved a
+        session there that stays valid for longer, such as one with a more
+        recently refreshed token"""
+        self.path = path
+        with locked(path):
+            stored = _read_session_file(path)
+            if (
+                stored is not None
+                and stored.get("expires") is not None
+                and self.expires is not None
+                and stored["expires"] > self.expires
+            ):
+                return
+            write_atomically(path, toml.dumps(self.to_dict()))
+
     def to_dict(self) -> Dict[str, Any]:
         """Get the session parameters as a dict, for serialization"""
         return {
@@ -106,6 +171,7 @@ class TidalSession:
                 "client_id": CLIENT_ID,
                 "scope": "r_usr w_usr",
             },
+            timeout=self.timeout,
         )
         if authorization_response.status_code == 400:
             raise TidalAuthError(
@@ -146,7 +212,9 @@ class TidalSession:
                 # exchange access code for oauth token
                 time.sleep(0.2)
                 last_index = index
-            token_response = requests.post(f"{AUTH_ENDPOINT}/oauth2/token", data=data)
+            token_response = requests.post(
+                f"{AUTH_ENDPOINT}/oauth2/token", data=data, timeout=self.timeout
+            )
             status_code = token_response.status_code
 
             # backtrack the written characters, overwrite them with space,
@@ -176,6 +244,7 @@ class TidalSession:
         sessions_response = requests.get(
             "https://api.tidal.com/v1/sessions",
             headers=self._auth_headers(),
+            timeout=self.timeout,
         )
         sessions_response.raise_for_status()
         sessions_json = sessions_response.json()
@@ -185,6 +254,32 @@ class TidalSession:
         self.check_valid()
 
     def _refresh(self) -> None:
+        """Get a new access token. If the session is saved to a file, another
+        process (or thread) may have refreshed it already, in which case its
+        token is used instead of asking for yet another one."""
+        if self.path is None:
+            self._request_token()
+            return
+        stale_access_token = self.access_token
+        with locked(self.path):
+            stored = _read_session_file(self.path)
+            if (
+                stored is not None
+                and stored.get("access_token") not in (None, stale_access_token)
+                and stored.get("expires") is not None
+                and stored["expires"] > datetime.datetime.now()
+            ):
+                self.access_token = stored["access_token"]
+                self.refresh_token = stored.get("refresh_token", self.refresh_token)
+                self.expires = stored["expires"]
+                return
+            if self.access_token != stale_access_token:
+                # refreshed by another thread while we waited for the lock
+                return
+            self._request_token()
+            write_atomically(self.path, toml.dumps(self.to_dict()))
+
+    def _request_token(self) -> None:
         if self.refresh_token is None:
             raise TidalAuthError("Refresh token is missing.")
         refresh_response = requests.post(
@@ -194,6 +289,7 @@ class TidalSession:
                 "client_id": CLIENT_ID,
                 "grant_type": "refresh_token",
             },
+            timeout=self.timeout,
         )
         try:
             refresh_response.raise_for_status()
@@ -233,7 +329,12 @@ class TidalSession:
 
         try:
             response = self._session.request(
-                method, url, params=full_params, data=data, headers=self._auth_headers()
+                method,
+                url,
+                params=full_params,
+                data=data,
+                headers=self._auth_headers(),
+                timeout=self.timeout,
             )
             # response = self._session.request(
             #     method,
@@ -245,6 +346,17 @@ class TidalSession:
             #     verify="mitmproxy-ca-cert.pem",
             # )
             response.raise_for_status()
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as error:
+            if self.stats is not None:
+                self.stats.increment("API request timeouts")
+            if attempt < MAXIMUM_ATTEMPTS:
+                # an unresponsive server is treated like a 429
+                time.sleep(2 ** attempt)
+                return self.request(method, path, params, data, attempt=attempt + 1)
+            raise error
         except requests.exceptions.HTTPError as error:
             status = error.response.status_code
             if (
@@ -271,24 +383,54 @@ class TidalSession:
         return response
 
 
+def _read_session_file(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r") as session_file:
+            return toml.load(session_file)
+    except (FileNotFoundError, toml.TomlDecodeError):
+        return None
+
+
 class TidalClient(Client):
     """TIDAL API Client"""
 
     def __init__(self, config: dict, tidal_session: TidalSession):
         self._tidal_session = tidal_session
-        self._search_count = config["search-count"]
+        tidal_session.timeout = (
+            float(config["connect-timeout"]),
+            float(config["read-timeout"]),
+        )
+        tidal_session.stats = config["stats"]
         self._quality = config["quality"]
+        self._concurrency = int(config["concurrency"])
+        self._throttle = config["throttle"]
+        self._stats = config["stats"]
+        self._in_flight = SingleFlight("coalesced API requests")
+        self._cache = Cache(
+            os.path.join(constants.CACHE_DIR, "api"), float(config["cache-ttl"])
+        )
+        self._search_cache = Cache(
+            os.path.join(constants.CACHE_DIR, "search"),
+            float(config["search-cache-ttl"]),
+        )
+
+        # every artist and album is converted once and shared by everything
+        # that refers to it, so long listings don't hold thousands of copies
+        self._artists: Dict[str, Artist] = {}
+        self._albums: Dict[str, Album] = {}
 
     def resolve_url(self, url: str) -> Tuple[MediaType, Optional[Media]]:
         parsed = urlparse(url)
         path = parsed.path.strip("/")
 
-        # find the last occurrence of "track", "album", or "artist" in the URL
-        # path and assume that's the media type of the URL
+        # find the last occurrence of "track", "album", "artist", "playlist",
+        # or "mix" in the URL path and assume that's the media type of the URL
         strings = {
             Track: "track",
             Album: "album",
             Artist: "artist",
+            Playlist: "playlist",
+            Mix: "mix",
         }
         indices = {
             media_type: path.rfind(string) for media_type, string in strings.items()
@@ -303,7 +445,12 @@ class TidalClient(Client):
 
         media_id = path.split("/")[-1]
 
-        if not re.match(r"^\d+$", media_id):
+        # playlists are identified by UUIDs and mixes by hex strings
+        id_pattern = {
+            Playlist: r"^[0-9a-fA-F-]+$",
+            Mix: r"^[0-9a-fA-F]+$",
+        }.get(media_type, r"^\d+$")
+        if not re.match(id_pattern, media_id):
             raise ValueError(
                 'That URL doesn\'t end in an ID. Try one like "https://tidal.com/browse/track/140538043".'
             )
@@ -312,6 +459,8 @@ class TidalClient(Client):
             Track: self.get_track_by_id,
             Album: self.get_album_by_id,
             Artist: self.get_artist_by_id,
+            Playlist: self.get_playlist_by_id,
+            Mix: self.get_mix_by_id,
         }
 
         return media_type, handlers[media_type](media_id)
@@ -327,7 +476,113 @@ class TidalClient(Client):
         params: Optional[dict] = None,
         data: Optional[dict] = None,
     ) -> requests.models.Response:
-        return self._tidal_session.request(method, path, params, data)
+        """Make a request through the session. Workers often look up the same
+        album or listing at the same moment, so identical GET requests that
+        are already in flight share the one response, or error, and count
+        against the request budget once."""
+
+        def request() -> requests.models.Response:
+            self._throttle.consume_request()
+            response = self._tidal_session.request(method, path, params, data)
+            self._throttle.consume_auxiliary(len(response.content))
+            return response
+
+        if method != "GET" or data is not None:
+            return request()
+        key = json.dumps([path, params or {}], sort_keys=True)
+        return self._in_flight.do(key, request, self._stats)
+
+    def _cache_key(self, path: str, params: Optional[dict] = None) -> str:
+        return json.dumps(
+            [path, params or {}, self._tidal_session.country_code], sort_keys=True
+        )
+
+    def _get_json(self, path: str, params: Optional[dict] = None) -> Any:
+        """GET a metadata endpoint, going through the on-disk cache"""
+        key = self._cache_key(path, params)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        response_json = self._request("GET", path, params).json()
+        self._cache.set(key, response_json)
+        return response_json
+
+    def _get_many(
+        self, path: str, object_ids: Sequence[str], batched: bool
+    ) -> Dict[str, Any]:
+        """Get the objects at `{path}/{id}` for each of `object_ids`, by ID.
+        Objects in the cache come from there. The rest are requested
+        MAXIMUM_LIMIT at a time with the `ids` parameter if `batched`, or
+        otherwise one at a time, `concurrency` at once; either way, each is
+        then cached as if it had been requested on its own. IDs that TIDAL
+        doesn't know are left out."""
+        found: Dict[str, Any] = {}
+        uncached_ids: List[str] = []
+        for object_id in dict.fromkeys(str(object_id) for object_id in object_ids):
+            cached = self._cache.get(self._cache_key(f"{path}/{object_id}"))
+            if cached is not None:
+                found[object_id] = cached
+            else:
+                uncached_ids.append(object_id)
+
+        def get_one(object_id: str) -> List[Any]:
+            try:
+                return [self._get_json(f"{path}/{object_id}")]
+            except requests.exceptions.HTTPError as error:
+                if error.response.status_code == 404:
+                    return []
+                raise error
+
+        def get_batch(batch: List[str]) -> List[Any]:
+            try:
+                response_json = self._request(
+                    "GET", path, params={"ids": ",".join(batch)}
+                ).json()
+            except requests.exceptions.HTTPError as error:
+                # some IDs can make TIDAL refuse the whole batch
+                if error.response.status_code not in (400, 404):
+                    raise error
+                return [
+                    tidal_object
+                    for object_id in batch
+                    for tidal_object in get_one(object_id)
+                ]
+            tidal_objects = (
+                response_json["items"]
+                if isinstance(response_json, dict)
+                else response_json
+            )
+            for tidal_object in tidal_objects:
+                self._cache.set(
+                    self._cache_key(f"{path}/{tidal_object['id']}"), tidal_object
+                )
+            return tidal_objects
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            if batched:
+                batches = [
+                    uncached_ids[start : start + MAXIMUM_LIMIT]
+                    for start in range(0, len(uncached_ids), MAXIMUM_LIMIT)
+                ]
+                results = executor.map(get_batch, batches)
+            else:
+                results = executor.map(get_one, uncached_ids)
+            for tidal_objects in results:
+                for tidal_object in tidal_objects:
+                    found[str(tidal_object["id"])] = tidal_object
+        return found
+
+    @staticmethod
+    def _lookup(object_ids: Sequence[str], converted: Dict[str, Any]) -> Lookup:
+        items = [converted.get(str(object_id)) for object_id in object_ids]
+        return Lookup(
+            items=items,
+            missing=[
+                str(object_id)
+                for object_id, item in zip(object_ids, items)
+                if item is None
+            ],
+        )
 
     def _paginate(
         self,
@@ -336,7 +591,23 @@ class TidalClient(Client):
         params: Optional[dict] = None,
         data: Optional[dict] = None,
     ) -> List[Any]:
-        items = []
+        return [
+            item
+            for page in self._paginate_lazily(method, path, params, data)
+            for item in page
+        ]
+
+    def _paginate_lazily(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict] = None,
+        data: Optional[dict] = None,
+        cached: bool = True,
+    ) -> Iterator[List[Any]]:
+        """Yield the items of a paginated endpoint one page at a time. Each page
+        is only requested once the previous one has been consumed."""
+        item_count = 0
         params = {
             "offset": 0,
             "limit": MAXIMUM_LIMIT,
@@ -345,15 +616,18 @@ class TidalClient(Client):
             **(params or {}),
         }
         while True:
-            response = self._request(method, path, params, data).json()
-            items += response["items"]
-            if len(items) >= response["totalNumberOfItems"]:
+            if method == "GET" and data is None and cached:
+                response = self._get_json(path, params)
+            else:
+                response = self._request(method, path, params, data).json()
+            yield response["items"]
+            item_count += len(response["items"])
+            if not response["items"] or item_count >= response["totalNumberOfItems"]:
                 break
             params["offset"] += params["limit"]
-        return items
 
     def _get_quality(self, tidal_object: dict) -> Tuple[str, str]:
-        quality_levels = {"low": 1, "high": 2, "lossless": 3, "master": 4}
+        quality_levels = constants.QUALITY_LEVELS
 
         special_audio_modes = (
             frozenset(tidal_object.get("audioModes", ())) & SPECIAL_AUDIO_MODES
@@ -386,9 +660,19 @@ class TidalClient(Client):
         return chosen_quality, best_available
 
     def _tidal_artist_to_artist(self, tidal_artist: dict) -> Artist:
-        return Artist(id=tidal_artist["id"], name=tidal_artist["name"])
+        artist = self._artists.get(tidal_artist["id"])
+        if artist is None:
+            artist = self._artists.setdefault(
+                tidal_artist["id"],
+                Artist(id=tidal_artist["id"], name=tidal_artist["name"]),
+            )
+        return artist
 
     def _tidal_album_to_album(self, tidal_album: dict) -> Album:
+        album = self._albums.get(tidal_album["id"])
+        if album is not None:
+            return album
+
         year: Optional[str]
         if tidal_album.get("releaseDate"):
             year = tidal_album["releaseDate"].split("-")[0]
@@ -401,42 +685,44 @@ class TidalClient(Client):
         else:
             cover_url = None
 
-        artists = [
+        artists = tuple(
             self._tidal_artist_to_artist(tidal_artist)
             for tidal_artist in tidal_album["artists"]
-        ]
+        )
 
         _, best_available_quality = self._get_quality(tidal_album)
 
-        return Album(
-            id=tidal_album["id"],
-            name=tidal_album["title"],
-            artists=artists,
-            year=year,
-            cover_url=cover_url,
-            best_available_quality=best_available_quality,
-            explicit=tidal_album.get("explicit", False),
+        return self._albums.setdefault(
+            tidal_album["id"],
+            Album(
+                id=tidal_album["id"],
+                name=tidal_album["title"],
+                artists=artists,
+                year=year,
+                cover_url=cover_url,
+                best_available_quality=best_available_quality,
+                explicit=tidal_album.get("explicit", False),
+            ),
         )
 
     def _tidal_track_to_track(
         self, tidal_track: dict, album: Optional[Album] = None
     ) -> Track:
         # we can be pretty sure that an album ID is valid if it comes from TIDAL
-        album = album or cast(Album, self.get_album_by_id(tidal_track["album"]["id"]))
+        album = (
+            album
+            or self._albums.get(tidal_track["album"]["id"])
+            or cast(Album, self.get_album_by_id(tidal_track["album"]["id"]))
+        )
 
-        artists = [
+        artists = tuple(
             self._tidal_artist_to_artist(tidal_artist)
             for tidal_artist in tidal_track["artists"]
-        ]
+        )
 
         chosen_quality, best_available_quality = self._get_quality(tidal_track)
 
-        file_extension = {
-            "master": "flac",
-            "lossless": "flac",
-            "high": "mp4",
-            "low": "mp4",
-        }[chosen_quality]
+        file_extension = constants.FILE_EXTENSIONS[chosen_quality]
 
         return Track(
             id=tidal_track["id"],
@@ -449,38 +735,97 @@ class TidalClient(Client):
             chosen_quality=chosen_quality,
             best_available_quality=best_available_quality,
             replay_gain=tidal_track.get("replayGain"),
+            duration=tidal_track.get("duration"),
+            isrc=tidal_track.get("isrc"),
             file_extension=file_extension,
         )
 
+    def _tidal_tracks_to_tracks(self, tidal_tracks: List[dict]) -> List[Track]:
+        """Convert tracks from any number of albums, fetching the albums that
+        haven't been seen yet concurrently"""
+        missing_album_ids = {
+            tidal_track["album"]["id"] for tidal_track in tidal_tracks
+        } - self._albums.keys()
+        if missing_album_ids:
+            self.get_albums_by_ids(list(missing_album_ids))
+        return [self._tidal_track_to_track(tidal_track) for tidal_track in tidal_tracks]
+
+    def _tidal_playlist_to_playlist(self, tidal_playlist: dict) -> Playlist:
+        return Playlist(
+            id=tidal_playlist["uuid"],
+            name=tidal_playlist["title"],
+            number_of_tracks=tidal_playlist.get("numberOfTracks"),
+        )
+
     def search(
         self,
         query: str,
-        media_type: Type[Union[Track, Album, Artist]],
+        media_type: Type[Union[Track, Album, Artist, Playlist]],
         count: int,
-    ) -> List[Union[Track, Album, Artist]]:
-        types, key, resolver = {
-            Track: ("TRACKS", "tracks", self._tidal_track_to_track),
-            Album: ("ALBUMS", "albums", self._tidal_album_to_album),
-            Artist: ("ARTISTS", "artists", self._tidal_artist_to_artist),
+        offset: int = 0,
+    ) -> List[Union[Track, Album, Artist, Playlist]]:
+        """Get `count` results for `media_type`, starting at `offset`. Every
+        type is searched for in the same request, and the whole response is
+        cached for `search-cache-ttl`, so searching again, for the same thing
+        or another type of it, needs no round trip."""
+        params = {
+            "query": " ".join(query.split()),
+            "types": SEARCH_TYPES,
+            "limit": min(count, MAXIMUM_LIMIT),
+            "offset": offset,
+        }
+        cache_key = self._cache_key(
+            "search", {**params, "query": params["query"].casefold()}
+        )
+        response_json = self._search_cache.get(cache_key)
+        if response_json is None:
+            response_json = self._request("GET", "search", params=params).json()
+            self._search_cache.set(cache_key, response_json)
+
+        key, resolver = {
+            Track: ("tracks", self._tidal_tracks_to_tracks),
+            Album: ("albums", self._tidal_albums_to_albums),
+            Artist: ("artists", self._tidal_artists_to_artists),
+            Playlist: ("playlists", self._tidal_playlists_to_playlists),
         }[media_type]
-        results = self._request(
-            "GET",
-            "search",
-            params={
-                "query": query,
-                "types": types,
-                "limit": min(self._search_count, MAXIMUM_LIMIT),
-            },
-        ).json()[key]["items"]
-        return [resolver(result) for result in results]
+        return resolver(response_json[key]["items"])
+
+    def _tidal_albums_to_albums(self, tidal_albums: List[dict]) -> List[Album]:
+        return [self._tidal_album_to_album(tidal_album) for tidal_album in tidal_albums]
+
+    def _tidal_artists_to_artists(self, tidal_artists: List[dict]) -> List[Artist]:
+        return [
+            self._tidal_artist_to_artist(tidal_artist) for tidal_artist in tidal_artists
+        ]
+
+    def _tidal_playlists_to_playlists(
+        self, tidal_playlists: List[dict]
+    ) -> List[Playlist]:
+        return [
+            self._tidal_playlist_to_playlist(tidal_playlist)
+            for tidal_playlist in tidal_playlists
+        ]
+
+    def _available_quality_key(self, track: Track) -> str:
+        # what a track is available in depends on the subscription
+        return self._cache_key(
+            f"tracks/{track.id}/quality", {"user": self._tidal_session.user_id}
+        )
 
-    def get_media(self, track: Track) -> str:
-        tidal_quality = {
-            "master": "HI_RES",
-            "lossless": "LOSSLESS",
-            "high": "HIGH",
-            "low": "LOW",
-        }[track.chosen_quality]
+    def get_media(self, track: Track) -> Stream:
+        """Resolve the stream of `track` in its chosen quality. If it isn't
+        available in that quality, raise a QualityUnavailableException with
+        the stream TIDAL offered instead, and remember what the track is
+        available in, so that asking again doesn't take a request."""
+        quality_levels = constants.QUALITY_LEVELS
+        tidal_quality = TIDAL_QUALITIES[track.chosen_quality]
+        available_quality_key = self._available_quality_key(track)
+        available_quality = self._cache.get(available_quality_key)
+        if (
+            available_quality is not None
+            and quality_levels[available_quality] < quality_levels[track.chosen_quality]
+        ):
+            raise QualityUnavailableException(available_quality)
 
         try:
             playback_response = self._request(
@@ -496,13 +841,27 @@ class TidalClient(Client):
             playback_response.raise_for_status()
             playback_json = playback_response.json()
 
+            stream = parse_manifest(
+                playback_json["manifestMimeType"], playback_json["manifest"]
+            )
             if playback_json["audioQuality"] != tidal_quality:
-                raise ManiaSeriousException(
-                    "Track is unavailable in the requested quality. Did you try to download a lossless file without a TIDAL HiFi subscription?"
-                )
-
-            manifest = json.loads(base64.b64decode(playback_json["manifest"]))
-            return manifest["urls"][0]
+                available_quality = {
+                    value: key for key, value in TIDAL_QUALITIES.items()
+                }.get(playback_json["audioQuality"])
+                if (
+                    available_quality is None
+                    or quality_levels[available_quality]
+                    > quality_levels[track.chosen_quality]
+                ):
+                    # a quality we don't know, or don't know the container of
+                    raise UnavailableException()
+                self._cache.set(available_quality_key, available_quality)
+                raise QualityUnavailableException(available_quality, stream)
+            return stream
+        except ManifestError as error:
+            raise ManiaSeriousException(
+                f"Couldn't parse the manifest for track {track.id}: {error}"
+            ) from error
         except requests.exceptions.HTTPError as error:
             status_code = error.response.status_code
             sub_status = error.response.json().get("subStatus")
@@ -512,28 +871,128 @@ class TidalClient(Client):
 
     def get_track_by_id(self, track_id: str) -> Optional[Track]:
         try:
-            tidal_track = self._request("GET", f"tracks/{track_id}").json()
+            tidal_track = self._get_json(f"tracks/{track_id}")
         except requests.exceptions.HTTPError as error:
             if error.response.status_code == 404:
                 return None
+            raise error
         return self._tidal_track_to_track(tidal_track)
 
     def get_album_by_id(self, album_id: str) -> Optional[Album]:
         try:
-            tidal_album = self._request("GET", f"albums/{album_id}").json()
+            tidal_album = self._get_json(f"albums/{album_id}")
         except requests.exceptions.HTTPError as error:
             if error.response.status_code == 404:
                 return None
+            raise error
         return self._tidal_album_to_album(tidal_album)
 
     def get_artist_by_id(self, artist_id: str) -> Optional[Artist]:
         try:
-            tidal_artist = self._request("GET", f"artists/{artist_id}").json()
+            tidal_artist = self._get_json(f"artists/{artist_id}")
         except requests.exceptions.HTTPError as error:
             if error.response.status_code == 404:
                 return None
+            raise error
         return self._tidal_artist_to_artist(tidal_artist)
 
+    def get_tracks_by_ids(self, track_ids: Sequence[str]) -> Lookup:
+        """Look up many tracks at once, with as few requests as possible"""
+        tidal_tracks = self._get_many("tracks", track_ids, batched=True)
+        tracks = self._tidal_tracks_to_tracks(list(tidal_tracks.values()))
+        return self._lookup(track_ids, dict(zip(tidal_tracks.keys(), tracks)))
+
+    def get_albums_by_ids(self, album_ids: Sequence[str]) -> Lookup:
+        """Look up many albums at once, with as few requests as possible"""
+        tidal_albums = self._get_many("albums", album_ids, batched=True)
+        return self._lookup(
+            album_ids,
+            {
+                album_id: self._tidal_album_to_album(tidal_album)
+                for album_id, tidal_album in tidal_albums.items()
+            },
+        )
+
+    def get_artists_by_ids(self, artist_ids: Sequence[str]) -> Lookup:
+        """Look up many artists at once. TIDAL has no way to ask for several
+        artists in one request, so they're fetched concurrently."""
+        tidal_artists = self._get_many("artists", artist_ids, batched=False)
+        return self._lookup(
+            artist_ids,
+            {
+                artist_id: self._tidal_artist_to_artist(tidal_artist)
+                for artist_id, tidal_artist in tidal_artists.items()
+            },
+        )
+
+    def get_playlist_by_id(self, playlist_id: str) -> Optional[Playlist]:
+        try:
+            tidal_playlist = self._get_json(f"playlists/{playlist_id}")
+        except requests.exceptions.HTTPError as error:
+            if error.response.status_code == 404:
+                return None
+            raise error
+        return self._tidal_playlist_to_playlist(tidal_playlist)
+
+    def get_mix_by_id(self, mix_id: str) -> Optional[Mix]:
+        try:
+            tidal_mix_page = self._get_json(
+                "pages/mix", params={"mixId": mix_id, "deviceType": DEVICE_TYPE}
+            )
+        except requests.exceptions.HTTPError as error:
+            if error.response.status_code == 404:
+                return None
+            raise error
+        return Mix(id=mix_id, name=tidal_mix_page.get("title") or f"Mix {mix_id}")
+
+    def _get_track_list(self, path: str) -> Iterator[Track]:
+        # playlists get edited and mixes regenerated, so they aren't cached
+        for page in self._paginate_lazily("GET", path, cached=False):
+            yield from self._tidal_tracks_to_tracks(
+                [element["item"] for element in page if element["type"] == "track"]
+            )
+
+    def get_playlist_tracks(self, playlist: Playlist) -> Iterator[Track]:
+        return self._get_track_list(f"playlists/{playlist.id}/items")
+
+    def get_mix_tracks(self, mix: Mix) -> Iterator[Track]:
+        return self._get_track_list(f"mixes/{mix.id}/items")
+
+    def _get_favorites(
+        self, kind: str, exclude_ids: Collection[str]
+    ) -> Iterator[List[dict]]:
+        """Yield pages of the user's favorite tracks, albums or artists, newest
+        first, leaving out `exclude_ids`. Never cached, since favorites change
+        all the time."""
+        pages = self._paginate_lazily(
+            "GET",
+            f"users/{self._tidal_session.user_id}/favorites/{kind}",
+            params={"order": "DATE", "orderDirection": "DESC"},
+            cached=False,
+        )
+        for page in pages:
+            yield [
+                element["item"]
+                for element in page
+                if str(element["item"]["id"]) not in exclude_ids
+            ]
+
+    def get_favorite_tracks(self, exclude_ids: Collection[str] = ()) -> Iterator[Track]:
+        for tidal_tracks in self._get_favorites("tracks", exclude_ids):
+            yield from self._tidal_tracks_to_tracks(tidal_tracks)
+
+    def get_favorite_albums(self, exclude_ids: Collection[str] = ()) -> Iterator[Album]:
+        for tidal_albums in self._get_favorites("albums", exclude_ids):
+            for tidal_album in tidal_albums:
+                yield self._tidal_album_to_album(tidal_album)
+
+    def get_favorite_artists(
+        self, exclude_ids: Collection[str] = ()
+    ) -> Iterator[Artist]:
+        for tidal_artists in self._get_favorites("artists", exclude_ids):
+            for tidal_artist in tidal_artists:
+                yield self._tidal_artist_to_artist(tidal_artist)
+
     def get_album_tracks(self, album: Album) -> List[Track]:
         tidal_tracks = [
             element["item"]
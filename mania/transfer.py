@@ -0,0 +1,104 @@
+"""Pooled keep-alive connections for media and cover downloads"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set, Tuple
+from urllib.parse import urlparse
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .stats import RunStats
+
+
+class TransferClient:
+    """Makes the requests that download media and covers, through one session
+    per host, so consecutive transfers from the same CDN reuse connections
+    instead of making a TCP and TLS handshake each. Each host's pool holds as
+    many connections as can be in use at once: `concurrency` tracks, each
+    fetching up to `segment-concurrency` segments."""
+
+    def __init__(self, config: dict):
+        concurrency = int(config["concurrency"])
+        self._pool_size = max(concurrency * int(config["segment-concurrency"]), 1)
+        self._warm_count = concurrency if config["warm-connections"] else 0
+        self._timeout = float(config["connect-timeout"]), float(config["read-timeout"])
+        self._sessions: Dict[str, requests.Session] = {}
+        self._warmed_hosts: Set[str] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url: str) -> str:
+        parsed_url = urlparse(url)
+        return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+    def _session(self, url: str) -> requests.Session:
+        host = self._host(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                session.mount(host, adapter)
+                self._sessions[host] = session
+            return session
+
+    def get(self, url: str, **kwargs) -> requests.models.Response:
+        return self._session(url).get(url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.models.Response:
+        return self._session(url).head(url, **kwargs)
+
+    def warm(self, url: str) -> None:
+        """Open connections to the host of `url` ahead of time, one for each
+        track that can download at once, so that the first transfers from it
+        don't wait for handshakes. The connections are opened by making that
+        many HEAD requests for `url` at once, which leave them in the pool.
+        Each host is only warmed once."""
+        host = self._host(url)
+        with self._lock:
+            if host in self._warmed_hosts or self._warm_count <= 0:
+                return
+            self._warmed_hosts.add(host)
+
+        def head() -> None:
+            try:
+                self.head(url, timeout=self._timeout).close()
+            except requests.exceptions.RequestException:
+                # warming up is only an optimization; transfers connect as usual
+                pass
+
+        with ThreadPoolExecutor(max_workers=self._warm_count) as executor:
+            for _ in range(self._warm_count):
+                executor.submit(head)
+
+    def connection_counts(self) -> Tuple[int, int]:
+        """How many connections were opened, and how many requests were made
+        over them"""
+        opened_count = 0
+        request_count = 0
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            for adapter in session.adapters.values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        opened_count += pool.num_connections
+                        request_count += pool.num_requests
+        return opened_count, request_count
+
+    def close(self, stats: RunStats) -> None:
+        """Close every connection, and count how often they were reused"""
+        opened_count, request_count = self.connection_counts()
+        if request_count:
+            stats.increment("transfer requests", request_count)
+            stats.increment("transfer connections opened", opened_count)
+            stats.increment(
+                "transfer connections reused", max(request_count - opened_count, 0)
+            )
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -0,0 +1,43 @@
+from typing import Callable, List, Sequence
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = os.path.join(REPOSITORY, "tests", "workers.py")
+
+RunWorkers = Callable[[str, str, Sequence[Sequence[str]]], List[str]]
+
+
+@pytest.fixture
+def run_workers(tmp_path) -> RunWorkers:
+    """Start one worker process per list of arguments, all at once, and
+    wait for them, returning what each printed. Each process gets the same
+    fresh cache directory."""
+
+    def run(mode: str, url: str, arguments: Sequence[Sequence[str]]) -> List[str]:
+        environment = {
+            **os.environ,
+            "PYTHONPATH": REPOSITORY,
+            "XDG_CACHE_HOME": str(tmp_path / "cache"),
+        }
+        processes = [
+            subprocess.Popen(
+                [sys.executable, WORKERS, mode, url, *worker_arguments],
+                env=environment,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for worker_arguments in arguments
+        ]
+        outputs = []
+        for process in processes:
+            stdout, stderr = process.communicate(timeout=120)
+            assert process.returncode == 0, stderr
+            outputs.append(stdout.strip())
+        return outputs
+
+    return run
@@ -0,0 +1,447 @@
+"""Stand-in servers for the TIDAL API, its media CDN and an S3-compatible
+object store, for checking mania end to end without a network connection or
+an account. Each runs in a background thread on a free local port."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, parse_qsl, unquote, urlparse
+import base64
+import datetime
+import hashlib
+import json
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+
+from mania.storage import sign_request
+
+ALBUM_TRACKS_PAGE = "pages/data/2fbf68c2-dc58-49b1-b1be-6958e66383f3"
+ACCESS_KEY = "stand-in-access-key"
+SECRET_KEY = "stand-in-secret-key"
+REGION = "us-east-1"
+
+
+def flac_bytes(seed: int, audio_size: int = 64 * 1024) -> bytes:
+    """A FLAC file with only a STREAMINFO block, different for each seed"""
+    streaminfo = (
+        (4096).to_bytes(2, "big")
+        + (4096).to_bytes(2, "big")
+        + bytes(6)
+        # 44100 Hz, 2 channels, 16 bits per sample, no sample count
+        + ((44100 << 44) | (1 << 41) | (15 << 36)).to_bytes(8, "big")
+        + hashlib.md5(str(seed).encode("utf-8")).digest()
+    )
+    header = bytes([0x80]) + len(streaminfo).to_bytes(3, "big")
+    audio = bytes((seed * 7 + index) % 251 for index in range(audio_size))
+    return b"fLaC" + header + streaminfo + audio
+
+
+def _box(box_type: bytes, content: bytes) -> bytes:
+    return (8 + len(content)).to_bytes(4, "big") + box_type + content
+
+
+def fmp4_segments(seed: int, segment_count: int = 3) -> List[bytes]:
+    """FLAC audio in fragmented MP4, the way DASH manifests serve lossless
+    streams: an initialization segment, then media segments of a movie
+    fragment and its audio each, different for each seed"""
+    # version and flags, creation and modification times, a timescale of
+    # 1000, a duration of one second, then the rest of the fields zeroed
+    movie_header = bytes(12) + (1000).to_bytes(4, "big") + (1000).to_bytes(4, "big")
+    movie_header += bytes(80)
+    track_extends = bytes(4) + (1).to_bytes(4, "big") * 2 + bytes(12)
+    initialization = _box(b"ftyp", b"iso6\x00\x00\x00\x00iso6mp41") + _box(
+        b"moov",
+        _box(b"mvhd", movie_header) + _box(b"mvex", _box(b"trex", track_extends)),
+    )
+    segments = [initialization]
+    for number in range(1, segment_count + 1):
+        # with an explicit base data offset, which tagging has to keep right
+        fragment_header = (1).to_bytes(4, "big") + (1).to_bytes(4, "big") + bytes(8)
+        movie_fragment = _box(
+            b"moof",
+            _box(b"mfhd", bytes(4) + number.to_bytes(4, "big"))
+            + _box(b"traf", _box(b"tfhd", fragment_header)),
+        )
+        audio = bytes((seed * 7 + number + index) % 251 for index in range(4096))
+        segments.append(movie_fragment + _box(b"mdat", audio))
+    return segments
+
+
+def _page(items: List[Any], query: Dict[str, List[str]]) -> Dict[str, Any]:
+    offset = int(query.get("offset", ["0"])[0])
+    limit = int(query.get("limit", ["50"])[0])
+    return {
+        "offset": offset,
+        "limit": limit,
+        "totalNumberOfItems": len(items),
+        "items": items[offset : offset + limit],
+    }
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler: type):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, path: str) -> None:
+        with self.lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: Any
+
+    def log_message(self, *arguments) -> None:
+        pass
+
+    def reply(
+        self,
+        status: int,
+        body: Any = b"",
+        content_type: str = "application/json",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+
+class _TidalHandler(_Handler):
+    def do_POST(self) -> None:
+        self.read_body()
+        path = urlparse(self.path).path
+        self.server.count(path)
+        if path.endswith("/oauth2/token"):
+            # slow enough that processes refreshing at once overlap
+            time.sleep(0.3)
+            with self.server.lock:
+                self.server.token_count += 1
+                token = f"token-{self.server.token_count}"
+            return self.reply(200, {"access_token": token, "expires_in": 3600})
+        self.reply(404, {"status": 404})
+
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        # HEAD requests, such as those warming connections, are counted apart
+        # from the GETs that download
+        self.server.count(
+            parsed.path if self.command == "GET" else f"{self.command} {parsed.path}"
+        )
+        parts = parsed.path.strip("/").split("/")
+        tidal = self.server
+
+        if parts[:1] == ["media"]:
+            return self.send_media(int(parts[1]))
+        if parts[:1] == ["dash"]:
+            segment = tidal.segments(int(parts[1]))[int(parts[2])]
+            return self.reply(200, segment, "audio/mp4")
+        # everything else is under the API's version prefix
+        parts = parts[1:]
+        if parts[:1] == ["users"] and parts[2:] == ["subscription"]:
+            return self.reply(200, {"subscription": {"type": "HIFI"}})
+        if parts[:1] == ["users"] and parts[2:3] == ["favorites"] and len(parts) == 4:
+            kind = parts[3]
+            media = tidal.tracks if kind == "tracks" else tidal.albums
+            items = [{"item": media[id]} for id in tidal.favorites.get(kind, [])]
+            return self.reply(200, _page(items, query))
+        if parts[:1] == ["albums"] and len(parts) == 2:
+            album = tidal.albums.get(int(parts[1]))
+            return self.reply(200, album) if album else self.reply(404, {})
+        if "/".join(parts) == ALBUM_TRACKS_PAGE:
+            album_id = int(query["albumId"][0])
+            items = [
+                {"type": "track", "item": track}
+                for track in tidal.tracks.values()
+                if track["album"]["id"] == album_id
+            ]
+            return self.reply(200, _page(items, query))
+        if parts[:1] == ["tracks"] and len(parts) == 2:
+            track = tidal.tracks.get(int(parts[1]))
+            return self.reply(200, track) if track else self.reply(404, {})
+        if parts[:1] == ["tracks"] and parts[2:] == ["playbackinfopostpaywall"]:
+            track_id = int(parts[1])
+            if track_id not in tidal.tracks:
+                return self.reply(404, {})
+            if track_id in tidal.dash:
+                return self.reply(
+                    200,
+                    {
+                        "trackId": track_id,
+                        "audioQuality": query["audioquality"][0],
+                        "manifestMimeType": "application/dash+xml",
+                        "manifest": base64.b64encode(
+                            tidal.mpd(track_id).encode("utf-8")
+                        ).decode("ascii"),
+                    },
+                )
+            manifest = json.dumps(
+                {
+                    "mimeType": "audio/flac",
+                    "codecs": "flac",
+                    "encryptionType": "NONE",
+                    "urls": [f"{tidal.url}/media/{track_id}"],
+                }
+            ).encode("utf-8")
+            return self.reply(
+                200,
+                {
+                    "trackId": track_id,
+                    "audioQuality": query["audioquality"][0],
+                    "manifestMimeType": "application/vnd.tidal.bts",
+                    "manifest": base64.b64encode(manifest).decode("ascii"),
+                },
+            )
+        self.reply(404, {"status": 404})
+
+    def send_media(self, track_id: int) -> None:
+        body = self.server.media(track_id)
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            return self.reply(
+                206,
+                body[start:],
+                "audio/flac",
+                {"Content-Range": f"bytes {start}-{len(body) - 1}/{len(body)}"},
+            )
+        with self.server.lock:
+            drop_after = self.server.drops.pop(track_id, None)
+        if drop_after is None or self.command != "GET":
+            return self.reply(200, body, "audio/flac")
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/flac")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:drop_after])
+        self.wfile.flush()
+        # give the client time to read what was sent, which a reset discards
+        time.sleep(0.2)
+        # close without lingering, so the client sees the connection reset
+        self.connection.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+        )
+        self.connection.close()
+        self.close_connection = True
+
+
+class StandInTidal(_Server):
+    """The parts of the TIDAL API that downloading albums, tracks and
+    favorites, and refreshing a session, use. Serves `album_count` albums of
+    `tracks_per_album` tracks each, with album IDs counting from 1 and track
+    IDs of `album_id * 100 + track_number`, and media files with `audio_size`
+    bytes of audio. `favorites` lists the IDs of the user's favorite "tracks"
+    and "albums", and `counts` counts requests by path. Tracks in `dash` are
+    served through DASH manifests, as FLAC in fragmented MP4.
+
+    Media requests with a Range header get the rest of the file, and the
+    first download of a track in `drops` sends only that many bytes before
+    resetting the connection."""
+
+    def __init__(
+        self,
+        album_count: int = 3,
+        tracks_per_album: int = 4,
+        audio_size: int = 64 * 1024,
+    ):
+        super().__init__(_TidalHandler)
+        self.audio_size = audio_size
+        self.token_count = 0
+        self.drops: Dict[int, int] = {}
+        self.favorites: Dict[str, List[int]] = {}
+        self.dash: Set[int] = set()
+        artist = {"id": 1, "name": "Stand-in Artist"}
+        self.albums: Dict[int, Dict[str, Any]] = {}
+        self.tracks: Dict[int, Dict[str, Any]] = {}
+        for album_id in range(1, album_count + 1):
+            self.albums[album_id] = {
+                "id": album_id,
+                "title": f"Album {album_id}",
+                "artists": [artist],
+                "releaseDate": "2001-01-01",
+                "audioQuality": "LOSSLESS",
+                "numberOfTracks": tracks_per_album,
+            }
+            for track_number in range(1, tracks_per_album + 1):
+                track_id = album_id * 100 + track_number
+                self.tracks[track_id] = {
+                    "id": track_id,
+                    "title": f"Track {track_number}",
+                    "artists": [artist],
+                    "album": {"id": album_id, "title": f"Album {album_id}"},
+                    "trackNumber": track_number,
+                    "volumeNumber": 1,
+                    "audioQuality": "LOSSLESS",
+                    "duration": 100,
+                }
+
+    def media(self, track_id: int) -> bytes:
+        return flac_bytes(track_id, self.audio_size)
+
+    def segments(self, track_id: int) -> List[bytes]:
+        return fmp4_segments(track_id)
+
+    def mpd(self, track_id: int) -> str:
+        segment_count = len(self.segments(track_id)) - 1
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static">
+  <Period>
+    <AdaptationSet mimeType="audio/mp4">
+      <Representation id="FLAC,44100,16" codecs="flac">
+        <SegmentTemplate initialization="{self.url}/dash/{track_id}/0"
+            media="{self.url}/dash/{track_id}/$Number$" startNumber="1">
+          <SegmentTimeline><S d="1000" r="{segment_count - 1}"/></SegmentTimeline>
+        </SegmentTemplate>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>"""
+
+
+class _ObjectStoreHandler(_Handler):
+    def _verify(self, body: bytes) -> bool:
+        """Check the request's SigV4 signature the way S3 would, by signing
+        it again"""
+        parsed = urlparse(self.path)
+        query = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        payload_hash = self.headers.get("x-amz-content-sha256", "")
+        if hashlib.sha256(body).hexdigest() != payload_hash:
+            return False
+        now = datetime.datetime.strptime(self.headers["x-amz-date"], "%Y%m%dT%H%M%SZ")
+        _, headers = sign_request(
+            self.command,
+            unquote(parsed.path),
+            query,
+            {"Host": self.headers["Host"]},
+            payload_hash,
+            ACCESS_KEY,
+            SECRET_KEY,
+            REGION,
+            now,
+        )
+        return headers["Authorization"] == self.headers.get("Authorization")
+
+    def _handle(self) -> None:
+        body = self.read_body()
+        store = self.server
+        parsed = urlparse(self.path)
+        query = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        key = unquote(parsed.path)
+        with store.lock:
+            store.requests.append((self.command, key, tuple(sorted(query)), len(body)))
+        if not self._verify(body):
+            with store.lock:
+                store.errors.append(f"bad signature: {self.command} {self.path}")
+            return self.reply(403, b"<Error><Code>SignatureDoesNotMatch</Code></Error>")
+
+        if self.command in ("GET", "HEAD"):
+            if key not in store.objects:
+                return self.reply(404)
+            return self.reply(200, store.objects[key], "application/octet-stream")
+        if self.command == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with store.lock:
+                store.uploads[upload_id] = (key, {})
+            return self.reply(
+                200,
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>".encode(
+                    "utf-8"
+                ),
+                "application/xml",
+            )
+        if self.command == "PUT" and "uploadId" in query:
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            with store.lock:
+                _, parts = store.uploads[query["uploadId"]]
+                parts[int(query["partNumber"])] = (body, etag)
+            return self.reply(200, headers={"ETag": etag})
+        if self.command == "POST" and "uploadId" in query:
+            if store.fail_completion:
+                # S3 can report a failed completion with a 200 response
+                return self.reply(
+                    200,
+                    b"<Error><Code>InternalError</Code>"
+                    b"<Message>We encountered an internal error.</Message></Error>",
+                    "application/xml",
+                )
+            return self._complete(query["uploadId"], body)
+        if self.command == "DELETE" and "uploadId" in query:
+            with store.lock:
+                store.uploads.pop(query["uploadId"], None)
+            return self.reply(204)
+        if self.command == "PUT":
+            with store.lock:
+                store.objects[key] = body
+            return self.reply(200, headers={"ETag": '"single"'})
+        self.reply(400)
+
+    def _complete(self, upload_id: str, body: bytes) -> None:
+        store = self.server
+        listed = [
+            (int(number), etag.decode("utf-8"))
+            for number, etag in re.findall(
+                rb"<PartNumber>(\d+)</PartNumber><ETag>([^<]+)</ETag>", body
+            )
+        ]
+        with store.lock:
+            key, parts = store.uploads.pop(upload_id)
+            numbers = [number for number, _ in listed]
+            if numbers != sorted(numbers):
+                store.errors.append("parts listed out of order")
+            for index, (number, etag) in enumerate(listed):
+                data, stored_etag = parts[number]
+                if etag != stored_etag:
+                    store.errors.append(f"wrong ETag for part {number}")
+                if index < len(listed) - 1 and len(data) < store.minimum_part_size:
+                    store.errors.append(f"part {number} is too small")
+            store.objects[key] = b"".join(parts[number][0] for number in numbers)
+        self.reply(200, b"<CompleteMultipartUploadResult/>", "application/xml")
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _handle
+
+
+class StandInObjectStore(_Server):
+    """An S3-compatible object store holding everything in memory. It checks
+    every request's signature against ACCESS_KEY and SECRET_KEY, and checks
+    multipart uploads the way S3 does: parts listed in order with the ETags
+    they were uploaded with, and all but the last at least 5 MiB.
+    `objects` maps "/bucket/key" to contents, `requests` lists
+    (method, path, query keys, body size) in order, and `errors` lists
+    whatever S3 would have refused."""
+
+    def __init__(self, minimum_part_size: int = 5 * 1024 * 1024):
+        super().__init__(_ObjectStoreHandler)
+        self.minimum_part_size = minimum_part_size
+        self.objects: Dict[str, bytes] = {}
+        self.uploads: Dict[str, Tuple[str, Dict[int, Tuple[bytes, str]]]] = {}
+        self.requests: List[Tuple[str, str, Tuple[str, ...], int]] = []
+        self.errors: List[str] = []
+        self.fail_completion = False
@@ -0,0 +1,121 @@
+import os
+import time
+
+from mania import crawl as crawl_module
+from mania.crawl import CrawlDirectory, item_key
+
+from stand_in import StandInTidal
+
+
+def make_stale(path: str) -> None:
+    old = time.time() - 3600
+    os.utime(path, (old, old))
+
+
+def test_stale_claim_is_taken_over(tmp_path):
+    crawl = CrawlDirectory(str(tmp_path), claim_timeout=60)
+    crawl.add("https://tidal.com/browse/album/1")
+    (item,) = crawl.items()
+    dead_worker = CrawlDirectory(str(tmp_path), claim_timeout=60)
+    dead_claim = dead_worker.claim(item)
+    assert dead_claim is not None
+    dead_claim._released.set()
+    make_stale(dead_claim.path)
+
+    claim = crawl.claim(item)
+    assert claim is not None
+    with claim, open(claim.path) as claim_file:
+        assert claim_file.read() == crawl.worker_id
+
+
+def test_fresh_claim_is_not_taken_over(tmp_path):
+    crawl = CrawlDirectory(str(tmp_path), claim_timeout=60)
+    crawl.add("https://tidal.com/browse/album/1")
+    (item,) = crawl.items()
+    other = CrawlDirectory(str(tmp_path), claim_timeout=60)
+    with other.claim(item) as other_claim:
+        assert crawl.claim(item) is None
+        with open(other_claim.path) as claim_file:
+            assert claim_file.read() == other.worker_id
+
+
+def test_takeover_leaves_a_claim_that_replaced_the_stale_one(tmp_path, monkeypatch):
+    """A worker that finds a claim stale may be beaten to it by another
+    worker, which replaces it with a fresh claim before the first one
+    renames it away. The fresh claim has to survive."""
+    crawl = CrawlDirectory(str(tmp_path), claim_timeout=60)
+    crawl.add("https://tidal.com/browse/album/1")
+    (item,) = crawl.items()
+    path = os.path.join(str(tmp_path), "claims", item_key(item.url))
+    with open(path, "w") as claim_file:
+        claim_file.write("dead worker")
+    make_stale(path)
+
+    faster = CrawlDirectory(str(tmp_path), claim_timeout=60)
+    rename = os.rename
+
+    def rename_after_the_faster_worker(source: str, destination: str) -> None:
+        if source == path and destination.endswith(f"{crawl.worker_id}.stale"):
+            monkeypatch.setattr(crawl_module.os, "rename", rename)
+            faster_claim = faster.claim(item)
+            assert faster_claim is not None
+            faster_claim._released.set()
+        rename(source, destination)
+
+    monkeypatch.setattr(crawl_module.os, "rename", rename_after_the_faster_worker)
+    assert crawl.claim(item) is None
+    with open(path) as claim_file:
+        assert claim_file.read() == faster.worker_id
+    assert sorted(os.listdir(os.path.join(str(tmp_path), "claims"))) == [
+        item_key(item.url)
+    ]
+
+
+def test_workers_share_a_crawl_and_pick_up_after_a_dead_one(tmp_path, run_workers):
+    """Three worker processes crawl the stand-in server's albums plus a URL
+    that doesn't exist. One album is claimed by a worker that dies without
+    finishing it, so the others have to wait for the claim to go stale and
+    take it over."""
+    tidal = StandInTidal(album_count=6, tracks_per_album=3)
+    crawl_directory = str(tmp_path / "crawl")
+    output_directory = str(tmp_path / "output")
+    crawl = CrawlDirectory(crawl_directory, claim_timeout=2)
+    urls = [f"https://tidal.com/browse/album/{album_id}" for album_id in range(1, 7)]
+    for url in [*urls, "https://tidal.com/browse/album/999"]:
+        crawl.add(url)
+    dead_item = next(item for item in crawl.items() if item.url == urls[0])
+    dead_claim = CrawlDirectory(crawl_directory, claim_timeout=2).claim(dead_item)
+    assert dead_claim is not None
+    # the worker dies: its claim is never touched or released again
+    dead_claim._released.set()
+
+    run_workers(
+        "crawl",
+        tidal.url,
+        [
+            [str(tmp_path / f"config-{index}.toml"), output_directory, crawl_directory]
+            for index in range(3)
+        ],
+    )
+
+    states = {item.url: crawl.state(item) for item in crawl.items()}
+    assert states == {
+        **{url: "done" for url in urls},
+        "https://tidal.com/browse/album/999": "failed",
+    }
+    # every track was downloaded exactly once
+    media_requests = {
+        path: count
+        for path, count in tidal.counts.items()
+        if path.startswith("/media/")
+    }
+    assert sorted(media_requests) == sorted(f"/media/{id}" for id in tidal.tracks)
+    assert set(media_requests.values()) == {1}
+    assert os.listdir(os.path.join(crawl_directory, "claims")) == []
+    downloaded = [
+        name
+        for _, _, names in os.walk(output_directory)
+        for name in names
+        if name.endswith(".flac")
+    ]
+    assert len(downloaded) == len(tidal.tracks)
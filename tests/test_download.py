@@ -0,0 +1,41 @@
+import os
+
+from mutagen.mp4 import MP4
+
+from mania import integrity
+
+from stand_in import StandInTidal
+
+
+def test_fragmented_mp4_is_saved_and_tagged_as_mp4(tmp_path, run_workers):
+    """A lossless track served through a DASH manifest is FLAC in fragmented
+    MP4, so it's saved, tagged and checksummed as an MP4 file, not as FLAC"""
+    tidal = StandInTidal()
+    tidal.dash = {101}
+    tidal.favorites = {"tracks": [101, 102]}
+    output_directory = str(tmp_path / "output")
+
+    run_workers(
+        "favorites",
+        tidal.url,
+        [[str(tmp_path / "config.toml"), output_directory, ""]],
+    )
+
+    names = sorted(
+        name
+        for _, _, names in os.walk(output_directory)
+        for name in names
+        if not name.startswith(".")
+    )
+    assert names == ["Track 1.mp4", "Track 2.flac"]
+    records = integrity.load_records({"output-directory": output_directory})
+    assert len(records) == 2
+    for path, record in records.items():
+        assert integrity.verify_file(path, record) == []
+    (mp4_path,) = [path for path in records if path.endswith(".mp4")]
+    assert MP4(mp4_path)["\xa9nam"] == ["Track 1"]
+    with open(mp4_path, "rb") as mp4_file:
+        downloaded = mp4_file.read()
+    # every segment's audio made it in
+    for segment in tidal.segments(101)[1:]:
+        assert segment[segment.index(b"mdat") + 4 :] in downloaded
@@ -0,0 +1,45 @@
+import json
+import os
+
+import toml
+
+from mania import constants
+
+from stand_in import StandInTidal
+
+
+def media_files(output_directory: str):
+    return sorted(
+        name
+        for _, _, names in os.walk(output_directory)
+        for name in names
+        if name.endswith(".flac")
+    )
+
+
+def test_export_writes_metadata_only(tmp_path, run_workers):
+    """Exporting favorites downloads nothing and doesn't mark anything as
+    synced, so a later sync still downloads every favorite"""
+    tidal = StandInTidal()
+    tidal.favorites = {"tracks": [101, 202], "albums": [3]}
+    output_directory = str(tmp_path / "output")
+    export_path = str(tmp_path / "favorites.ndjson")
+    config_path = str(tmp_path / "config.toml")
+    state_path = os.path.join(output_directory, constants.FAVORITES_STATE_NAME)
+
+    run_workers("favorites", tidal.url, [[config_path, output_directory, export_path]])
+
+    with open(export_path) as export_file:
+        rows = [json.loads(line) for line in export_file]
+    assert sorted(row["track_id"] for row in rows) == [101, 202, 301, 302, 303, 304]
+    assert media_files(output_directory) == []
+    assert not os.path.exists(state_path)
+    assert not any(path.startswith("/media/") for path in tidal.counts)
+
+    run_workers("favorites", tidal.url, [[config_path, output_directory, ""]])
+
+    assert len(media_files(output_directory)) == 6
+    assert toml.load(state_path) == {
+        "tracks": ["101", "202"],
+        "albums": ["3"],
+    }
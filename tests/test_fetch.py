@@ -0,0 +1,34 @@
+from mania import constants
+from mania.mania import fetch
+from mania.stats import RunStats
+from mania.throttle import Throttle
+from mania.transfer import TransferClient
+
+from stand_in import StandInTidal
+
+
+def make_config() -> dict:
+    config = {**constants.DEFAULT_CONFIG_TOML, "warm-connections": False}
+    config["stats"] = RunStats()
+    config["throttle"] = Throttle()
+    config["transfer"] = TransferClient(config)
+    return config
+
+
+def test_dropped_connection_is_resumed():
+    tidal = StandInTidal(audio_size=300 * 1024)
+    # partway through the third chunk
+    tidal.drops[101] = 2 * constants.DOWNLOAD_CHUNK_SIZE + 30000
+    config = make_config()
+    lengths = []
+    chunks = []
+
+    fetch(config, f"{tidal.url}/media/101", chunks.append, lengths.append)
+
+    assert b"".join(chunks) == tidal.media(101)
+    assert lengths == [len(tidal.media(101))]
+    assert tidal.counts["/media/101"] == 2
+    assert config["stats"].summary() == [
+        "stalled transfers: 1",
+        "resumed transfers: 1",
+    ]
@@ -0,0 +1,41 @@
+import datetime
+import time
+
+from mania.tidal import TidalSession
+
+from stand_in import StandInTidal
+
+
+def test_processes_share_one_token_refresh(tmp_path, run_workers):
+    """Four processes start with the same expired session. The first one to
+    get the session file's lock refreshes the token, and the others pick up
+    the new token from the file instead of asking for another."""
+    tidal = StandInTidal()
+    session_path = str(tmp_path / "session.toml")
+    TidalSession(
+        country_code="US",
+        access_token="expired",
+        refresh_token="refresh",
+        user_id="1",
+        expires=datetime.datetime.now() - datetime.timedelta(hours=1),
+    ).save(session_path)
+
+    tokens = run_workers("refresh", tidal.url, [[session_path]] * 4)
+
+    assert tidal.counts["/auth/oauth2/token"] == 1
+    assert tokens == ["token-1"] * 4
+    assert TidalSession.load(session_path).access_token == "token-1"
+
+
+def test_processes_share_one_request_budget(tmp_path, run_workers):
+    """Four processes take 10 requests each from a budget of 10 requests per
+    second. Only the first 10 come out of the burst, so the other 30 take
+    at least three seconds between them."""
+    tidal = StandInTidal()
+    budget_path = str(tmp_path / "request-budget.json")
+
+    start = time.monotonic()
+    run_workers("budget", tidal.url, [[budget_path, "10", "10"]] * 4)
+    elapsed = time.monotonic() - start
+
+    assert 2.8 <= elapsed < 10
@@ -0,0 +1,86 @@
+import threading
+
+from mania.models import Album, Artist, Track
+from mania.schedule import DownloadScheduler, Job
+
+ARTIST = Artist(id="1", name="Artist")
+ALBUM = Album(
+    id="1",
+    name="Album",
+    artists=(ARTIST,),
+    year="2001",
+    explicit=False,
+    cover_url=None,
+    best_available_quality="lossless",
+)
+
+
+def make_track(number: int, duration: int) -> Track:
+    return Track(
+        id=str(number),
+        name=f"Track {number}",
+        artists=(ARTIST,),
+        album=ALBUM,
+        explicit=False,
+        track_number=number,
+        disc_number=1,
+        chosen_quality="lossless",
+        best_available_quality="lossless",
+        replay_gain=None,
+        duration=duration,
+        isrc=None,
+        file_extension="flac",
+    )
+
+
+def start_order(concurrency: int, jobs_of) -> list:
+    """The numbers of the tracks in the order their jobs started. Every job
+    waits until the whole batch is queued, so the order doesn't depend on
+    how fast the first jobs run."""
+    started = []
+    submitted = threading.Event()
+
+    def job(number: int) -> None:
+        started.append(number)
+        assert submitted.wait(timeout=10)
+
+    config = {"download-order": "largest-first", "concurrency": concurrency}
+    with DownloadScheduler(config) as scheduler:
+        futures = scheduler.submit_all(jobs_of(job))
+        submitted.set()
+        for future in futures:
+            future.result()
+    return started
+
+
+def test_whole_batch_starts_largest_first():
+    tracks = [make_track(number, duration=number * 10) for number in range(1, 9)]
+    started = start_order(
+        2, lambda job: [Job(lambda n=t.track_number: job(n), t) for t in tracks]
+    )
+    assert set(started[:2]) == {8, 7}
+    assert set(started[2:4]) == {6, 5}
+
+
+def test_priority_goes_before_size():
+    tracks = [make_track(number, duration=number * 10) for number in range(1, 9)]
+    started = start_order(
+        2,
+        lambda job: [
+            Job(lambda n=t.track_number: job(n), t, priority=int(t.track_number == 1))
+            for t in tracks
+        ],
+    )
+    assert 1 in started[:2]
+
+
+def test_one_worker_keeps_listing_order_after_priorities():
+    tracks = [make_track(number, duration=number * 10) for number in range(1, 6)]
+    started = start_order(
+        1,
+        lambda job: [
+            Job(lambda n=t.track_number: job(n), t, priority=int(t.track_number == 4))
+            for t in tracks
+        ],
+    )
+    assert started == [4, 1, 2, 3, 5]
@@ -0,0 +1,105 @@
+"""Worker processes that tests start several of at once, to check what
+happens when mania processes share files. Run as
+
+    python tests/workers.py <mode> <stand-in server URL> <arguments...>
+
+with the repository on PYTHONPATH."""
+
+import sys
+
+from mania import constants, tidal
+from mania import mania as cli
+from mania.throttle import SharedRequestBudget
+
+
+def point_at(url: str) -> None:
+    tidal.API_ENDPOINT = f"{url}/v1"
+    tidal.AUTH_ENDPOINT = f"{url}/auth"
+
+
+def load_config(config_path: str, options: dict) -> dict:
+    with open(config_path, "w") as config_file:
+        config_file.write(constants.DEFAULT_CONFIG)
+    return cli.load_config(
+        {
+            "config-path": config_path,
+            "skip-metadata": True,
+            "cache-ttl": "0",
+            "quiet": True,
+            "progress": "none",
+            **options,
+        }
+    )
+
+
+def make_client(config: dict) -> tidal.TidalClient:
+    session = tidal.TidalSession(country_code="US", access_token="x", user_id="1")
+    return tidal.TidalClient(config, session)
+
+
+def crawl(config_path: str, output_directory: str, crawl_directory: str) -> None:
+    """Work through a crawl like `mania crawl-work`, with a claim timeout of
+    two seconds"""
+    config = load_config(
+        config_path,
+        {
+            "output-directory": output_directory,
+            "crawl-directory": crawl_directory,
+            "crawl-claim-timeout": "2",
+        },
+    )
+    try:
+        cli.handle_crawl_work(make_client(config), config, "")
+    finally:
+        config["progress-reporter"].close()
+
+
+def favorites(config_path: str, output_directory: str, export_path: str) -> None:
+    """Sync favorite tracks and albums like `mania favorites tracks albums`,
+    tagging them, or only export their metadata to `export_path` if it isn't
+    empty"""
+    config = load_config(
+        config_path,
+        {
+            "output-directory": output_directory,
+            "export": bool(export_path),
+            "export-path": export_path,
+            "skip-metadata": False,
+        },
+    )
+    try:
+        cli.handle_favorites(make_client(config), config, "tracks albums")
+    finally:
+        config["progress-reporter"].close()
+        if config["export-writer"] is not None:
+            config["export-writer"].close()
+
+
+def refresh(session_path: str) -> None:
+    """Load a saved session whose token has expired, make a request with it
+    and save it, printing the access token it ended up with"""
+    session = tidal.TidalSession.load(session_path)
+    session.check_valid()
+    print(session.access_token)
+    session.save(session_path)
+
+
+def budget(budget_path: str, rate: str, count: str) -> None:
+    """Take `count` requests from a shared request budget of `rate`
+    requests per second"""
+    shared_budget = SharedRequestBudget(budget_path, float(rate))
+    for _ in range(int(count)):
+        shared_budget.consume()
+
+
+MODES = {
+    "crawl": crawl,
+    "favorites": favorites,
+    "refresh": refresh,
+    "budget": budget,
+}
+
+if __name__ == "__main__":
+    mode, url, *arguments = sys.argv[1:]
+    point_at(url)
+    MODES[mode](*arguments)